@@ -1,7 +1,62 @@
 import boto3
+import json
 import os
+import urllib.request
 from slack_sdk import WebClient
 
+try:
+    from src.shared.orchestration import (attached_requests, mark_delivered,
+                                          parse_output_key)
+except ImportError:
+    # Deployed with src/shared packaged next to this file
+    from shared.orchestration import (attached_requests, mark_delivered,
+                                      parse_output_key)
+
+
+def report_channels(s3, bucket, key, slack_channel):
+    """
+    (channel, response_url) pairs to post the report to: the configured
+    channel, without a response_url, plus the channels of repeated commands
+    that were attached to the report's run. The run is marked delivered
+    first, so that commands attached after the listing start a new run
+    instead
+    """
+    channels = [(slack_channel, None)]
+    parsed = parse_output_key(key)
+    if parsed is None or parsed[0] != 'pdf':
+        return channels
+    _, team_id, run_id = parsed
+    mark_delivered(s3, bucket, team_id, run_id)
+    seen = {slack_channel}
+    for request in attached_requests(s3, bucket, team_id, run_id):
+        channel = request.get('channel_id')
+        if channel and channel not in seen:
+            seen.add(channel)
+            channels.append((channel, request.get('response_url')))
+    return channels
+
+
+def notify_not_posted(response_url, slack_channel):
+    """
+    Tell a command whose channel the bot cannot post to, e.g. because it
+    has not been invited or the command came from a DM, where the report is
+    """
+    if not response_url:
+        return
+    body = json.dumps({
+        'response_type': 'ephemeral',
+        'text': (f"📄 The report could not be posted here, since the bot "
+                 f"is not in this conversation. It has been posted to "
+                 f"<#{slack_channel}>.")
+    }).encode('utf-8')
+    request = urllib.request.Request(
+        response_url, data=body,
+        headers={'Content-Type': 'application/json'})
+    try:
+        urllib.request.urlopen(request, timeout=5).close()
+    except Exception as e:
+        print(f"Could not notify {response_url}: {str(e)}")
+
 
 def lambda_handler(event, context):
     """
@@ -36,15 +91,31 @@ def lambda_handler(event, context):
             # Extract just the filename from the full S3 key
             filename = key.split('/')[-1]
 
-            # Send to Slack
-            slack.files_upload_v2(
-                channel=slack_channel,
-                content=file_content,
-                filename=filename,
-                title=filename.replace('.pdf', '').replace('_', ' ').title()
-            )
+            # Send to Slack, once per channel that asked for the report
+            channels = report_channels(s3, bucket, key, slack_channel)
+            sent = 0
+            for channel, response_url in channels:
+                try:
+                    slack.files_upload_v2(
+                        channel=channel,
+                        content=file_content,
+                        filename=filename,
+                        title=filename.replace('.pdf', '').replace('_', ' ')
+                        .title()
+                    )
+                    sent += 1
+                except Exception as e:
+                    # Only the configured channel fails the invocation: S3
+                    # retries it, and every other channel would get the
+                    # report again
+                    if response_url is None:
+                        raise
+                    print(f"Could not send {filename} to {channel}: "
+                          f"{str(e)}")
+                    notify_not_posted(response_url, slack_channel)
 
-            print(f"Successfully sent {filename} to Slack channel")
+            print(f"Successfully sent {filename} to {sent} of "
+                  f"{len(channels)} Slack channel(s)")
 
         except Exception as e:
             print(f"Error processing {key}: {str(e)}")
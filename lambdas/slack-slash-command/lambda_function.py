@@ -1,15 +1,41 @@
 import json
-import boto3
 import os
 import hmac
 import hashlib
 import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
+try:
+    from src.shared.orchestration import request_run
+except ImportError:
+    # Deployed with src/shared packaged next to this file
+    from shared.orchestration import request_run
 
-def lambda_handler(event, context):
-    print(f"Received event: {json.dumps(event)}")
+# Slack drops slash commands that are not answered within 3 seconds, so
+# everything expensive is created once per container and reused by warm
+# invocations: boto3 is only imported on the first Slack request, and the
+# clients and the pool used to write the run record and enqueue
+# extraction concurrently live at module scope
+_clients = {}
+_pool = None
+
+
+def get_client(service):
+    if service not in _clients:
+        import boto3
+        _clients[service] = boto3.client(service)
+    return _clients[service]
+
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        _pool = ThreadPoolExecutor(max_workers=2)
+    return _pool
 
+
+def lambda_handler(event, context):
     # Handle missing headers
     headers = event.get('headers') or {}
     body = event.get('body', '')
@@ -24,7 +50,6 @@ def lambda_handler(event, context):
 
     # If not a Slack request, return test response
     if not is_slack_request:
-        print("Test request detected - returning test response")
         return {
             'statusCode': 200,
             'headers': {'Content-Type': 'application/json'},
@@ -33,8 +58,6 @@ def lambda_handler(event, context):
             })
         }
 
-    print("Slack request detected - processing normally")
-
     # Verify Slack signature for real requests
     signing_secret = os.environ.get('SLACK_SIGNING_SECRET', '')
     slack_signature = headers.get('x-slack-signature', '')
@@ -45,7 +68,6 @@ def lambda_handler(event, context):
                                       slack_signature):
             print("Signature verification failed")
             return {'statusCode': 401, 'body': 'Unauthorized'}
-        print("Signature verified successfully")
     else:
         print("Warning: Signature verification skipped")
 
@@ -57,112 +79,49 @@ def lambda_handler(event, context):
         }
 
     body_params = urllib.parse.parse_qs(body)
-    print(f"Parsed body: {body_params}")
-
-    # Extract data for all queues
     team_id = body_params.get('team_id', ['unknown'])[0]
     current_timestamp = datetime.utcnow().strftime('%Y%m%d_%H%M%S')
 
-    # Send to SQS for message extraction
-    sqs = boto3.client('sqs')
-    message = {
-        'channel_id': body_params.get('channel_id', ['unknown'])[0],
-        'user_id': body_params.get('user_id', ['unknown'])[0],
-        'response_url': body_params.get('response_url', [''])[0],
+    # Start the run with the extraction stage. Each later stage is started
+    # by the stage-router Lambda as soon as the one before it writes its
+    # output to S3. A repeated command from the same team joins the run
+    # already in flight instead, unless that run started more than the
+    # dedupe window ago, has stalled or has already been delivered
+    run = {
         'team_id': team_id,
-        'timestamp': datetime.utcnow().isoformat()
+        'run_id': current_timestamp,
+        'trigger_source': 'slack_command',
+        'requested_at': datetime.utcnow().isoformat(),
+        'original_request': {
+            'channel_id': body_params.get('channel_id', ['unknown'])[0],
+            'user_id': body_params.get('user_id', ['unknown'])[0],
+            'response_url': body_params.get('response_url', [''])[0]
+        }
     }
 
     try:
-        # Send to message extraction queue
-        response = sqs.send_message(
-            QueueUrl=os.environ['QUEUE_URL'],
-            MessageBody=json.dumps(message)
-        )
-        print(f"Message sent to extraction SQS: {response['MessageId']}")
-
-        # Send to ML processing queue with delay
-        ml_queue_url = os.environ.get(
-            'ML_QUEUE_URL',
-            'https://sqs.us-east-2.amazonaws.com/822218735328/'
-            'ml-processing-queue'
-        )
-        ml_message = {
-            'team_id': team_id,
-            's3_key': (f'extractions/{team_id}/'
-                       f'{current_timestamp}_messages.json'),
-            'trigger_source': 'slack_command',
-            'extraction_timestamp': current_timestamp,
-            'original_request': {
-                'channel_id': body_params.get('channel_id', ['unknown'])[0],
-                'user_id': body_params.get('user_id', ['unknown'])[0],
-                'response_url': body_params.get('response_url', [''])[0]
-            }
-        }
-
-        ml_response = sqs.send_message(
-            QueueUrl=ml_queue_url,
-            MessageBody=json.dumps(ml_message),
-            DelaySeconds=60
-        )
-        print(f"ML processing message sent to SQS: "
-              f"{ml_response['MessageId']})")
-
-        insights_queue_url = os.environ.get(
-            'INSIGHTS_QUEUE_URL',
-            'https://sqs.us-east-2.amazonaws.com/822218735328/'
-            'insights-processing-queue'
-        )
-        insights_message = {
-            'bucket': 'slack-message-extract',
-            'key': (f'preprocessed/{team_id}/'
-                    f'{current_timestamp}_preprocessed.json'),
-            'team_id': team_id,
-            'extraction_timestamp': current_timestamp,
-            'trigger_source': 'slack_command'
-        }
-
-        insights_response = sqs.send_message(
-            QueueUrl=insights_queue_url,
-            MessageBody=json.dumps(insights_message),
-            DelaySeconds=180
-        )
-        print(f"Insights processing message sent to SQS: "
-              f"{insights_response['MessageId']} (delayed 8 minutes)")
-
-        pdf_queue_url = os.environ.get(
-            'PDF_QUEUE_URL',
-            'https://sqs.us-east-2.amazonaws.com/822218735328/'
-            'pdf-processing-queue'
-        )
-        pdf_message = {
-            'bucket': 'slack-message-extract',
-            'key': f'insights/{team_id}/{current_timestamp}_insights.json',
-            'team_id': team_id,
-            'extraction_timestamp': current_timestamp,
-            'trigger_source': 'slack_command'
-        }
-
-        pdf_response = sqs.send_message(
-            QueueUrl=pdf_queue_url,
-            MessageBody=json.dumps(pdf_message),
-            DelaySeconds=300
-        )
-        print(f"PDF processing message sent to SQS: "
-              f"{pdf_response['MessageId']} (delayed 12 minutes)")
-
+        active, started = request_run(get_client('sqs'), get_client('s3'),
+                                      run, pool=get_pool())
     except Exception as e:
-        print(f"Error sending to SQS: {e}")
+        print(f"Error starting the pipeline: {e}")
         return {
             'statusCode': 500,
             'body': json.dumps({'text': 'Internal error occurred'})
         }
 
-    response_text = ('🚀 Starting complete pipeline: message extraction → '
-                     'ML analysis → executive insights → PDF report '
-                     'generation... This will take about 12-15 minutes! '
-                     'The complete executive intelligence report will be '
-                     'automatically generated.')
+    if started:
+        response_text = ('🚀 Starting complete pipeline: message extraction'
+                         ' → ML analysis → executive insights → PDF report '
+                         'generation... Each stage starts as soon as the '
+                         'one before it finishes, and the complete '
+                         'executive intelligence report will be posted to '
+                         'Slack.')
+    else:
+        response_text = (f"⏳ A report for this workspace is already being "
+                         f"generated (run {active['run_id']}). It will be "
+                         f"posted to this channel too when it is ready, or "
+                         f"you will be told where it was posted if the bot "
+                         f"is not in this channel.")
 
     return {
         'statusCode': 200,
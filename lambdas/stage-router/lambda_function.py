@@ -0,0 +1,44 @@
+import json
+import urllib.parse
+
+try:
+    from src.shared.orchestration import stage_done
+except ImportError:
+    # Deployed with src/shared packaged next to this file
+    from shared.orchestration import stage_done
+
+# Clients are created once per container and reused by warm invocations
+_clients = {}
+
+
+def get_client(service):
+    if service not in _clients:
+        import boto3
+        _clients[service] = boto3.client(service)
+    return _clients[service]
+
+
+def lambda_handler(event, context):
+    """
+    Chains the pipeline stages: triggered by S3 events for stage outputs,
+    it starts the next stage as soon as the previous one has written its
+    output
+    """
+    sqs = get_client('sqs')
+    s3 = get_client('s3')
+
+    started = []
+    for record in event['Records']:
+        bucket = record['s3']['bucket']['name']
+        # Keys in S3 events are URL-encoded
+        key = urllib.parse.unquote_plus(record['s3']['object']['key'])
+        print(f"Stage output written: {bucket}/{key}")
+
+        following = stage_done(sqs, s3, bucket, key)
+        if following is not None:
+            started.append({'key': key, 'next_stage': following})
+
+    return {
+        'statusCode': 200,
+        'body': json.dumps({'started': started})
+    }
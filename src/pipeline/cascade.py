@@ -0,0 +1,68 @@
+import re
+
+"""
+A cheap first stage in front of the zero-shot classifier.
+
+The scoring filter drops every positive or neutral message whose top
+category is "other", which is what bare acknowledgements ("+1", "ok",
+"lol", "got it", ":tada:") almost always end up as. SmallTalkFilter
+recognises those messages with a few precompiled patterns so that they can
+be dropped without a bart-large-mnli pass. It only rejects when it is
+confident: anything longer than a few words, containing a question or a
+word outside the acknowledgement vocabulary goes on to the large model.
+Thanks and greetings are not acknowledgements: "thanks everyone" is what
+the praise category is for.
+"""
+
+# Words that make up an acknowledgement when a short message contains
+# nothing else
+SMALL_TALK_WORDS = {
+    "+1", "ack", "noted", "ok", "okay", "k", "kk", "lol", "lmao", "haha",
+    "hahaha", "yes", "yep", "yup", "yeah", "sure", "np", "got", "it", "will",
+    "do",
+}
+
+EMPTY_PATTERN = re.compile(
+    r"^(?:\s|:[a-z0-9_+\-']+:|<[^>\s]*>|[^\w\s?])*$", re.IGNORECASE)
+WORD_PATTERN = re.compile(r"\+1|[a-z']+", re.IGNORECASE)
+NOISE_PATTERN = re.compile(r":[a-z0-9_+\-']+:|<[^>\s]*>", re.IGNORECASE)
+
+
+class SmallTalkFilter:
+    COUNTERS = ("checked", "rejected")
+
+    def __init__(self, max_words=6, vocabulary=SMALL_TALK_WORDS):
+        self.max_words = max_words
+        self.vocabulary = vocabulary
+        self.checked = 0
+        self.rejected = 0
+
+    def _is_small_talk(self, text):
+        text = text or ""
+        # Emoji, mentions, links and punctuation only
+        if EMPTY_PATTERN.match(text):
+            return True
+        if "?" in text:
+            return False
+
+        words = WORD_PATTERN.findall(NOISE_PATTERN.sub(" ", text.lower()))
+        if len(words) == 0 or len(words) > self.max_words:
+            return False
+        return all(word.strip("'") in self.vocabulary for word in words)
+
+    """
+    Return True if the message is confidently small talk and can be dropped
+    without running the zero-shot classifier.
+    """
+    def is_small_talk(self, text):
+        rejected = self._is_small_talk(text)
+        self.checked += 1
+        self.rejected += int(rejected)
+        return rejected
+
+    def stats(self):
+        return {
+            "checked": self.checked,
+            "rejected": self.rejected,
+            "hit_rate": self.rejected / self.checked if self.checked else 0.0,
+        }
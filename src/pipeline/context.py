@@ -0,0 +1,90 @@
+from collections import deque
+
+"""
+The context a thread reply is scored with: the thread root plus the most
+recent kept replies that fit into a token budget, followed by the reply
+itself.
+
+Every message is tokenized once when it is scored and its ids are reused
+each time it appears as context, so building a reply's input costs time
+proportional to the budget rather than to the length of the thread. Replies
+that no longer fit next to the root are dropped from the window for good.
+"""
+
+
+def special_token_ids(tokenizer):
+    """
+    Return the special token ids a tokenizer puts before and after a
+    single sequence, e.g. ([<s>], [</s>]) for RoBERTa.
+    """
+    bare = tokenizer("hello", add_special_tokens=False)["input_ids"]
+    full = tokenizer("hello")["input_ids"]
+    for start in range(len(full) - len(bare) + 1):
+        if full[start:start + len(bare)] == bare:
+            return full[:start], full[start + len(bare):]
+    return [], []
+
+
+class ThreadContext:
+    def __init__(self, tokenizer, max_tokens):
+        self.tokenizer = tokenizer
+        self.max_tokens = max_tokens
+        self.separator_ids = tokenizer(
+            "\n", add_special_tokens=False)["input_ids"]
+        self.root = None
+        self.recent = deque()
+        self.recent_tokens = 0
+
+    def _cost(self, ids):
+        return len(ids) + len(self.separator_ids)
+
+    """
+    Add a kept message to the context. The first message added is the
+    thread root and is always preferred over older replies.
+    """
+    def add(self, text, ids):
+        if self.root is None:
+            self.root = (text, ids)
+            return
+
+        self.recent.append((text, ids))
+        self.recent_tokens += self._cost(ids)
+
+        root_tokens = self._cost(self.root[1])
+        while (len(self.recent) > 0
+               and root_tokens + self.recent_tokens > self.max_tokens):
+            _, old_ids = self.recent.popleft()
+            self.recent_tokens -= self._cost(old_ids)
+
+    """
+    Return the text and token ids (without special tokens) to score a
+    message with. The message itself is truncated to the budget if needed
+    and context fills whatever budget is left, newest replies first.
+    """
+    def build(self, text, ids):
+        if len(ids) > self.max_tokens:
+            ids = ids[:self.max_tokens]
+            text = self.tokenizer.decode(ids)
+        budget = self.max_tokens - len(ids)
+
+        selected = []
+        if self.root is not None and self._cost(self.root[1]) <= budget:
+            selected.append(self.root)
+            budget -= self._cost(self.root[1])
+
+        recent = []
+        for entry in reversed(self.recent):
+            if self._cost(entry[1]) > budget:
+                break
+            recent.append(entry)
+            budget -= self._cost(entry[1])
+        selected.extend(reversed(recent))
+
+        input_ids = []
+        for _, entry_ids in selected:
+            input_ids.extend(entry_ids)
+            input_ids.extend(self.separator_ids)
+        input_ids.extend(ids)
+
+        texts = [entry_text for entry_text, _ in selected] + [text]
+        return "\n".join(texts), input_ids
@@ -0,0 +1,121 @@
+import re
+import zlib
+import numpy as np
+
+"""
+Collapses duplicate messages before inference. Slack exports are full of
+repeated messages (standup templates, "+1", "thanks!", copy-pasted alerts)
+and scoring every copy is wasted model time.
+
+Messages are first grouped by a hash of their normalized text. The
+remaining messages are then grouped as near-duplicates with MinHash
+signatures over character shingles and locality-sensitive hashing:
+messages that share a band of their signature are compared, and grouped if
+their estimated Jaccard similarity reaches the threshold. Every message is
+mapped to a representative, which is scored in its place.
+
+Only messages scored without thread context can be collapsed safely, since
+the input of a reply depends on its thread.
+"""
+
+WHITESPACE_PATTERN = re.compile(r"\s+")
+# Mersenne prime used as the modulus of the MinHash permutations
+MERSENNE_PRIME = (1 << 31) - 1
+
+
+def normalize_text(text):
+    return WHITESPACE_PATTERN.sub(" ", (text or "").lower()).strip()
+
+
+class Deduplicator:
+    COUNTERS = ("checked", "collapsed")
+
+    def __init__(self, num_perm=64, bands=16, shingle_size=5,
+                 threshold=0.8, near_duplicates=True, seed=1):
+        if num_perm % bands != 0:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.num_perm = num_perm
+        self.bands = bands
+        self.shingle_size = shingle_size
+        self.threshold = threshold
+        self.near_duplicates = near_duplicates
+        self.checked = 0
+        self.collapsed = 0
+
+        generator = np.random.default_rng(seed)
+        self._a = generator.integers(1, MERSENNE_PRIME, num_perm,
+                                     dtype=np.int64)
+        self._b = generator.integers(0, MERSENNE_PRIME, num_perm,
+                                     dtype=np.int64)
+
+    def signature(self, text):
+        shingles = {text[i:i + self.shingle_size]
+                    for i in range(len(text) - self.shingle_size + 1)}
+        hashes = np.fromiter(
+            (zlib.crc32(shingle.encode("utf-8")) & MERSENNE_PRIME
+             for shingle in shingles),
+            dtype=np.int64, count=len(shingles))
+        permuted = ((self._a[:, None] * hashes[None, :] + self._b[:, None])
+                    % MERSENNE_PRIME)
+        return permuted.min(axis=1)
+
+    """
+    Return, for every text, the index of the text that represents it. A
+    representative is the first member of its group and maps to itself.
+    """
+    def group(self, texts):
+        normalized = [normalize_text(text) for text in texts]
+        representatives = list(range(len(texts)))
+
+        # Exact duplicates by normalized text hash
+        first_seen = {}
+        for i, text in enumerate(normalized):
+            representatives[i] = first_seen.setdefault(text, i)
+
+        if self.near_duplicates:
+            self._group_near_duplicates(normalized, representatives)
+
+        self.checked += len(texts)
+        self.collapsed += sum(1 for i, r in enumerate(representatives)
+                              if i != r)
+        return representatives
+
+    def _group_near_duplicates(self, normalized, representatives):
+        # Texts shorter than a shingle only ever match exactly
+        unique = [i for i, r in enumerate(representatives)
+                  if i == r and len(normalized[i]) >= self.shingle_size]
+        signatures = {i: self.signature(normalized[i]) for i in unique}
+
+        rows = self.num_perm // self.bands
+        parent = {i: i for i in unique}
+
+        def find(i):
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        for band in range(self.bands):
+            buckets = {}
+            for i in unique:
+                key = signatures[i][band * rows:(band + 1) * rows].tobytes()
+                buckets.setdefault(key, []).append(i)
+            for members in buckets.values():
+                for other in members[1:]:
+                    first, second = find(members[0]), find(other)
+                    if first == second:
+                        continue
+                    similarity = np.mean(signatures[members[0]]
+                                         == signatures[other])
+                    if similarity >= self.threshold:
+                        parent[max(first, second)] = min(first, second)
+
+        for i, r in enumerate(representatives):
+            if r in parent:
+                representatives[i] = find(r)
+
+    def stats(self):
+        return {
+            "checked": self.checked,
+            "collapsed": self.collapsed,
+        }
@@ -0,0 +1,135 @@
+from transformers import AutoModel, AutoTokenizer
+import numpy as np
+import torch
+
+try:
+    from .inference import length_sorted_batches, load_backend
+except ImportError:
+    from inference import length_sorted_batches, load_backend
+
+"""
+An alternative to the ZeroShotClassifier with the same classify contract.
+
+Instead of re-encoding every label with every message through a
+cross-encoder, messages are encoded once with a sentence-embedding model and
+compared against label prototype embeddings that are computed once per label
+set and cached. A whole batch of messages is scored with a single matrix
+multiply of normalized embeddings, and the cosine similarities are turned
+into label scores with a temperature-scaled softmax.
+"""
+
+# Short descriptions each label's prototype embedding is averaged from
+LABEL_PROTOTYPES = {
+    "inquiry": ["a question asking for information",
+                "can someone help me with this?",
+                "does anyone know how this works?"],
+    "goal": ["a goal or plan the team wants to achieve",
+             "we aim to ship this by the end of the quarter",
+             "our target for next sprint"],
+    "complaint": ["a complaint about a problem",
+                  "this is broken and frustrating",
+                  "I am unhappy with how this is going"],
+    "praise": ["praise or appreciation for good work",
+               "great job on the launch, well done",
+               "really impressed with the team"],
+    "other": ["casual small talk", "thanks, sounds good",
+              "good morning everyone"],
+}
+
+
+class EmbeddingClassifier:
+    def __init__(self,
+                 model_name="sentence-transformers/all-MiniLM-L6-v2",
+                 batch_size=64, temperature=0.05,
+                 prototypes=LABEL_PROTOTYPES, revision=None,
+                 backend="torch", num_threads=None):
+        if backend == "onnx":
+            raise ValueError("EmbeddingClassifier supports the torch and "
+                             "quantized backends only")
+
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.temperature = temperature
+        self.prototypes = prototypes
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name,
+                                                       revision=revision)
+        self.model = AutoModel.from_pretrained(model_name, revision=revision)
+        self.backend = load_backend(self.model, self.tokenizer, backend,
+                                    num_threads)
+        self.fingerprint = {
+            "model": model_name,
+            "revision": revision or getattr(self.model.config,
+                                            "_commit_hash", None),
+            "backend": backend,
+            "prototypes": prototypes,
+            "temperature": temperature,
+        }
+        self._label_embeddings = {}
+
+    """
+    Return L2-normalized mean-pooled embeddings, one row per text.
+    """
+    def embed(self, texts, batch_size=None):
+        batch_size = batch_size or self.batch_size
+        embeddings = np.zeros((len(texts), self.model.config.hidden_size),
+                              dtype=np.float32)
+        if len(texts) == 0:
+            return embeddings
+
+        input_ids = self.tokenizer(list(texts),
+                                   truncation=True)["input_ids"]
+        lengths = [len(ids) for ids in input_ids]
+        for batch in length_sorted_batches(lengths, batch_size):
+            encoded_input = self.tokenizer.pad(
+                {"input_ids": [input_ids[i] for i in batch]},
+                return_tensors='pt')
+            hidden = self.backend(encoded_input)
+            mask = encoded_input["attention_mask"].unsqueeze(-1).to(
+                hidden.dtype)
+            pooled = (hidden * mask).sum(dim=1) / mask.sum(dim=1).clamp(
+                min=1)
+            embeddings[batch] = torch.nn.functional.normalize(
+                pooled, dim=1).numpy()
+        return embeddings
+
+    """
+    Return the (labels x dim) prototype matrix for a label set, computing it
+    only the first time the label set is seen.
+    """
+    def label_embeddings(self, labels):
+        key = tuple(labels)
+        if key not in self._label_embeddings:
+            rows = []
+            for label in labels:
+                phrases = self.prototypes.get(label, [label])
+                prototype = self.embed(phrases).mean(axis=0)
+                rows.append(prototype / max(np.linalg.norm(prototype),
+                                            1e-12))
+            self._label_embeddings[key] = np.stack(rows)
+        return self._label_embeddings[key]
+
+    def classify(self, text,
+                 labels=list(LABEL_PROTOTYPES)):
+        return self.classify_batch([text], labels)[0]
+
+    def classify_batch(self, texts, labels=list(LABEL_PROTOTYPES),
+                       batch_size=None):
+        if len(texts) == 0:
+            return []
+
+        similarities = (self.embed(texts, batch_size)
+                        @ self.label_embeddings(labels).T)
+        logits = similarities / self.temperature
+        logits -= logits.max(axis=1, keepdims=True)
+        scores = np.exp(logits)
+        scores /= scores.sum(axis=1, keepdims=True)
+
+        results = []
+        order = np.argsort(-scores, axis=1, kind="stable")
+        for text, text_scores, ranking in zip(texts, scores, order):
+            results.append({
+                "sequence": text,
+                "labels": [labels[i] for i in ranking],
+                "scores": [float(text_scores[i]) for i in ranking]
+            })
+        return results
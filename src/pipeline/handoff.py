@@ -0,0 +1,413 @@
+import gzip
+import io
+import json
+import os
+from pathlib import Path
+
+"""
+Compact format for handing records between pipeline stages
+(extraction -> preprocessing -> scoring -> insights).
+
+A stage file is a text file of JSON lines, gzip- or zstd-compressed
+depending on its extension (.jsonl, .jsonl.gz or .jsonl.zst). The first
+line is a header naming the stage and its fields. Every following line is a
+self-contained block of up to block_size records stored column by column:
+
+- float fields, such as timestamps, are stored as numbers
+- intern fields, such as channel ids and labels, are stored as indexes
+  into a per-block string table
+- str, bool and json fields are stored as they are
+
+A file may repeat the header before any block, so that files can be made
+of independently compressed segments (see SegmentedStageWriter).
+
+Pretty-printed JSON (.json) remains available as a debug export.
+"""
+
+FORMAT_NAME = "intellicue-stage"
+FORMAT_VERSION = 1
+COMPACT_SUFFIXES = (".jsonl", ".jsonl.gz", ".jsonl.zst")
+
+# Field name -> type for each stage's records
+STAGE_SCHEMAS = {
+    "extraction": {
+        "channel_id": "intern",
+        "channel_name": "intern",
+        "user_id": "intern",
+        "message_text": "str",
+        "message_type": "intern",
+        "timestamp": "float",
+        "parent_thread_ts": "intern",
+        "is_thread_reply": "bool",
+        "reactions": "json",
+        "subtype": "intern",
+        "sent_by_bot_id": "intern",
+        "last_edited": "json",
+    },
+    "preprocessed": {
+        "message_text": "str",
+        "reactions": "json",
+        "channel_id": "intern",
+        "channel_name": "intern",
+        "timestamp": "float",
+        "is_thread_reply": "bool",
+        "parent_thread_ts": "intern",
+    },
+    "scored": {
+        "message_text": "str",
+        "timestamp": "float",
+        "parent_thread_ts": "intern",
+        "sentiment": "intern",
+        "category": "intern",
+        "reactions": "json",
+        "thread_sentiment": "intern",
+    },
+}
+
+# Fields left out of a record when they are empty
+OPTIONAL_FIELDS = {"thread_sentiment"}
+
+
+def is_compact_path(path):
+    return str(path).endswith(COMPACT_SUFFIXES)
+
+
+def _zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError("Reading or writing .zst stage files requires "
+                          "the zstandard package")
+    return zstandard
+
+
+def compression_of(path):
+    path = str(path)
+    if path.endswith(".gz"):
+        return "gzip"
+    if path.endswith(".zst"):
+        return "zstd"
+    return None
+
+
+def open_stage_file(path, mode):
+    """Open a stage file in text mode ('r' or 'w') with its compression"""
+    compression = compression_of(path)
+    if compression == "gzip":
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    if compression == "zstd":
+        zstandard = _zstandard()
+        raw = open(path, mode + "b")
+        if mode == "w":
+            stream = zstandard.ZstdCompressor().stream_writer(raw)
+        else:
+            stream = zstandard.ZstdDecompressor().stream_reader(
+                raw, read_across_frames=True)
+        return io.TextIOWrapper(stream, encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+
+def _compress(data, compression):
+    if compression == "gzip":
+        return gzip.compress(data)
+    if compression == "zstd":
+        return _zstandard().ZstdCompressor().compress(data)
+    return data
+
+
+def _decompress(data, compression):
+    if compression == "gzip":
+        return gzip.decompress(data)
+    if compression == "zstd":
+        return _zstandard().ZstdDecompressor().decompress(data)
+    return data
+
+
+def _dumps(data):
+    return json.dumps(data, separators=(",", ":")) + "\n"
+
+
+def _header(stage):
+    types = STAGE_SCHEMAS[stage]
+    return {
+        "format": FORMAT_NAME,
+        "version": FORMAT_VERSION,
+        "stage": stage,
+        "fields": list(types),
+        "types": types,
+    }
+
+
+def _check_fields(stage, record):
+    unknown = set(record) - set(STAGE_SCHEMAS[stage])
+    if len(unknown) > 0:
+        raise ValueError(f"Fields not in the {stage} schema: "
+                         f"{', '.join(sorted(unknown))}")
+
+
+def _encode_block(types, records):
+    columns, strings = {}, {}
+    for field, kind in types.items():
+        values = [record.get(field) for record in records]
+        if kind == "intern":
+            table = {}
+            columns[field] = [table.setdefault(value, len(table))
+                              for value in values]
+            strings[field] = list(table)
+        elif kind == "float":
+            columns[field] = [None if value is None else float(value)
+                              for value in values]
+        else:
+            columns[field] = values
+    return {"n": len(records), "columns": columns, "strings": strings}
+
+
+class StageWriter:
+    def __init__(self, path, stage, block_size=4096):
+        if stage not in STAGE_SCHEMAS:
+            raise ValueError(f"Unknown stage '{stage}'")
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.stage = stage
+        self.types = STAGE_SCHEMAS[stage]
+        self.block_size = block_size
+        self.count = 0
+        self._pending = []
+        self._file = open_stage_file(self.path, "w")
+        self._file.write(_dumps(_header(stage)))
+
+    def write(self, record):
+        _check_fields(self.stage, record)
+        self._pending.append(record)
+        self.count += 1
+        if len(self._pending) >= self.block_size:
+            self.flush()
+
+    def write_many(self, records):
+        for record in records:
+            self.write(record)
+
+    """
+    Write the pending records as one block.
+    """
+    def flush(self):
+        if len(self._pending) == 0:
+            return
+        self._file.write(_dumps(_encode_block(self.types, self._pending)))
+        self._pending = []
+
+    def close(self):
+        self.flush()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def manifest_path(path):
+    return Path(str(path) + ".manifest.json")
+
+
+"""
+Writes a stage file as a series of segments, each an independently
+compressed gzip member or zstd frame holding a header and one block of
+records with the same segment_field value (a channel id for extraction).
+
+Records are buffered per segment value and appended to the file every
+block_size records, or when end_segment() is called, so memory stays
+bounded and everything flushed survives a failure part-way. A manifest
+next to the file (<path>.manifest.json) lists the record count, byte
+offset and length of every segment and is rewritten as segments end,
+along with anything the producer puts in the metadata dict (extraction
+sets "incremental" when it only fetched messages since its checkpoints).
+Downstream stages can read the file as a whole with read_records(), or
+read or shard single segments with read_segment() without decompressing
+the rest.
+"""
+
+
+class SegmentedStageWriter:
+    def __init__(self, path, stage, segment_field="channel_id",
+                 block_size=4096):
+        if stage not in STAGE_SCHEMAS:
+            raise ValueError(f"Unknown stage '{stage}'")
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.stage = stage
+        self.types = STAGE_SCHEMAS[stage]
+        self.segment_field = segment_field
+        self.block_size = block_size
+        self.compression = compression_of(path)
+        self.count = 0
+        self.segments = []
+        self.metadata = {}
+        self._buffers = {}
+        self._header = _dumps(_header(stage))
+        self._file = open(self.path, "wb")
+
+    def write(self, record):
+        _check_fields(self.stage, record)
+        key = record.get(self.segment_field)
+        buffer = self._buffers.setdefault(key, [])
+        buffer.append(record)
+        self.count += 1
+        if len(buffer) >= self.block_size:
+            self._flush_segment(key)
+
+    def write_many(self, records):
+        for record in records:
+            self.write(record)
+
+    def _flush_segment(self, key):
+        records = self._buffers.pop(key, [])
+        if len(records) == 0:
+            return
+        text = self._header + _dumps(_encode_block(self.types, records))
+        data = _compress(text.encode("utf-8"), self.compression)
+
+        offset = self._file.tell()
+        self._file.write(data)
+        self._file.flush()
+        self.segments.append({"key": key, "records": len(records),
+                              "offset": offset, "length": len(data)})
+
+    """
+    Flush the buffered records of a segment value, e.g. once a channel has
+    been extracted, and update the manifest.
+    """
+    def end_segment(self, key):
+        self._flush_segment(key)
+        self.write_manifest()
+
+    def write_manifest(self):
+        manifest = {
+            "format": FORMAT_NAME,
+            "stage": self.stage,
+            "compression": self.compression,
+            "segment_field": self.segment_field,
+            "records": sum(segment["records"] for segment in self.segments),
+            "bytes": self._file.tell(),
+            "segments": self.segments,
+        }
+        manifest.update(self.metadata)
+        path = manifest_path(self.path)
+        tmp_path = path.with_name(path.name + ".tmp")
+        with tmp_path.open("w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, path)
+
+    def close(self):
+        for key in list(self._buffers):
+            self._flush_segment(key)
+        self.write_manifest()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def _decode_block(block, fields, types):
+    columns = []
+    for field in fields:
+        column = block["columns"][field]
+        if types[field] == "intern":
+            table = block["strings"][field]
+            column = [table[index] for index in column]
+        columns.append(column)
+
+    for values in zip(*columns):
+        record = dict(zip(fields, values))
+        for field in OPTIONAL_FIELDS:
+            if field in record and record[field] is None:
+                del record[field]
+        yield record
+
+
+def read_records(path):
+    """
+    Yield the records of a stage file one block at a time. Plain JSON Lines
+    files without a stage header are read record by record.
+    """
+    with open_stage_file(path, "r") as file:
+        header = None
+        for line in file:
+            if not line.strip():
+                continue
+            data = json.loads(line)
+            if data.get("format") == FORMAT_NAME:
+                header = data
+                if header["version"] > FORMAT_VERSION:
+                    raise ValueError(f"Unsupported stage file version "
+                                     f"{header['version']}")
+            elif header is not None:
+                yield from _decode_block(data, header["fields"],
+                                         header["types"])
+            else:
+                yield data
+
+
+def read_manifest(path):
+    with manifest_path(path).open("r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+"""
+Whether the stage file at path only holds the messages extracted since the
+previous extraction's checkpoints, according to its manifest.
+"""
+
+
+def is_incremental(path):
+    if not manifest_path(path).exists():
+        return False
+    return bool(read_manifest(path).get("incremental", False))
+
+
+"""
+Yield the records of one segment listed in the manifest of a file written
+by SegmentedStageWriter, reading only its bytes.
+"""
+
+
+def read_segment(path, segment, compression=None):
+    with open(path, "rb") as f:
+        f.seek(segment["offset"])
+        data = f.read(segment["length"])
+    lines = _decompress(data, compression or compression_of(path))
+    header, block = lines.decode("utf-8").splitlines()
+    header = json.loads(header)
+    yield from _decode_block(json.loads(block), header["fields"],
+                             header["types"])
+
+
+def write_records(path, stage, records):
+    """
+    Write records to path: the compact stage format for .jsonl[.gz|.zst]
+    paths, or the pretty-printed debug JSON otherwise.
+    """
+    if is_compact_path(path):
+        with StageWriter(path, stage) as writer:
+            writer.write_many(records)
+    else:
+        dump_debug_json(list(records), path)
+
+
+def load_records(path):
+    """Load every record from a stage file or a debug JSON export"""
+    if is_compact_path(path):
+        return list(read_records(path))
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def dump_debug_json(data, path, indent=4):
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with path.open("w", encoding="utf-8") as f:
+        json.dump(data, f, indent=indent)
@@ -0,0 +1,167 @@
+import json
+import os
+from pathlib import Path
+
+try:
+    from .preprocessing import UnscoredMessage
+    from .thread_index import ThreadIndex
+except ImportError:
+    from preprocessing import UnscoredMessage
+    from thread_index import ThreadIndex
+
+"""
+State for incremental preprocessing.
+
+A small JSON file keeps, for each channel, a watermark (the newest message
+timestamp processed so far) and the open threads (threads with activity in
+the last open_days before the watermark) with their messages. It is a local
+path, or s3://bucket/key for stages on short-lived containers. A run then
+only looks at messages newer than the watermark, merges them into their
+threads, and hands the threads it touched to scoring, so a daily report
+costs one day of traffic instead of the whole channel history.
+
+Messages at or below the watermark still count as new when they were not
+seen before or have changed since, so an extraction that fetches a
+look-back window again passes on late replies and edited messages. Those
+are recognised within the open window: a message there always keeps its
+thread open. Replies to threads that have already been closed are passed
+on without their earlier messages.
+"""
+
+STATE_VERSION = 1
+
+
+class PreprocessState:
+    def __init__(self, path, open_days=7, s3_client=None):
+        self.path = str(path)
+        self.open_seconds = open_days * 86400
+        self.channels = {}
+        self.s3 = s3_client
+        self.load()
+
+    def _s3_location(self):
+        if not self.path.startswith("s3://"):
+            return None
+        bucket, _, key = self.path[len("s3://"):].partition("/")
+        if self.s3 is None:
+            import boto3
+            self.s3 = boto3.client("s3")
+        return bucket, key
+
+    def _read(self):
+        location = self._s3_location()
+        if location is not None:
+            try:
+                response = self.s3.get_object(Bucket=location[0],
+                                              Key=location[1])
+            except self.s3.exceptions.NoSuchKey:
+                return None
+            return json.loads(response["Body"].read())
+
+        path = Path(self.path)
+        if not path.exists():
+            return None
+        with path.open("r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def load(self):
+        data = self._read()
+        if data is None:
+            return
+        if data.get("version") != STATE_VERSION:
+            print(f"Warning: ignoring preprocessing state {self.path} "
+                  f"with unknown version {data.get('version')}")
+            return
+        self.channels = data["channels"]
+
+    """
+    Write the state to s3://bucket/key, or to a temporary file that is
+    moved into place, so that a crash never leaves a half-written state
+    behind.
+    """
+    def save(self):
+        data = json.dumps({"version": STATE_VERSION,
+                           "channels": self.channels},
+                          separators=(",", ":"))
+        location = self._s3_location()
+        if location is not None:
+            self.s3.put_object(Bucket=location[0], Key=location[1],
+                               Body=data.encode("utf-8"),
+                               ContentType="application/json")
+            return
+
+        path = Path(self.path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(path.name + ".tmp")
+        with tmp_path.open("w", encoding="utf-8") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def watermark(self, channel_id):
+        channel = self.channels.get(channel_id)
+        return None if channel is None else channel["watermark"]
+
+    """
+    Whether a message was not processed before, or was edited or reacted
+    to since.
+    """
+    def is_new(self, message):
+        watermark = self.watermark(message.channel_id)
+        if watermark is None or message.timestamp > watermark:
+            return True
+        thread = self.channels[message.channel_id]["open_threads"].get(
+            message.parent_thread_ts)
+        if thread is None:
+            return message.timestamp >= watermark - self.open_seconds
+        for record in thread:
+            if float(record["timestamp"]) == message.timestamp:
+                return (record["message_text"] != message.message_text
+                        or record["reactions"] != message.reactions)
+        return True
+
+    """
+    Merge the new and changed messages into their threads and return the
+    touched threads, complete with the messages kept from earlier runs,
+    grouped like MessageParser.group_messages. Advances the watermarks and
+    prunes threads that have gone quiet.
+    """
+    def merge(self, messages):
+        new_messages = [message for message in messages
+                        if self.is_new(message)]
+
+        touched = set()
+        replaced = set()
+        for message in new_messages:
+            touched.add((message.channel_id, message.parent_thread_ts))
+            replaced.add((message.channel_id, message.timestamp))
+
+        index = ThreadIndex()
+        for channel_id, parent_ts in touched:
+            channel = self.channels.get(channel_id, {})
+            for record in channel.get("open_threads", {}).get(parent_ts, []):
+                # Edited messages replace their earlier version
+                if (channel_id, float(record["timestamp"])) not in replaced:
+                    index.add(UnscoredMessage(**record))
+        index.add_many(new_messages)
+
+        for message in new_messages:
+            channel = self.channels.setdefault(
+                message.channel_id, {"watermark": None, "open_threads": {}})
+            if (channel["watermark"] is None
+                    or message.timestamp > channel["watermark"]):
+                channel["watermark"] = message.timestamp
+        for (channel_id, parent_ts), thread in index.threads():
+            self.channels[channel_id]["open_threads"][parent_ts] = [
+                message.to_dict() for message in thread]
+        self._prune()
+
+        return index.grouped()
+
+    def _prune(self):
+        for channel in self.channels.values():
+            cutoff = channel["watermark"] - self.open_seconds
+            channel["open_threads"] = {
+                parent_ts: records
+                for parent_ts, records in channel["open_threads"].items()
+                if float(records[-1]["timestamp"]) >= cutoff
+            }
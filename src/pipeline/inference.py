@@ -0,0 +1,148 @@
+import hashlib
+import os
+import tempfile
+import numpy as np
+import torch
+
+"""
+Inference backends for the sequence classification models used in scoring.
+Every backend takes the padded tokenizer output of a batch and returns the
+logits as a torch tensor, so the models' callers do not change.
+
+- torch: stock PyTorch in inference mode with a tuned number of threads
+- quantized: PyTorch with Linear layers dynamically quantized to int8
+- onnx: the model exported once to ONNX and run in an ONNX Runtime CPU
+  session (requires the optional onnxruntime package)
+"""
+
+BACKENDS = ["torch", "quantized", "onnx"]
+
+
+def length_sorted_batches(lengths, batch_size):
+    """
+    Yield batches of indices ordered by sequence length so that each padded
+    batch wastes as little compute on padding tokens as possible.
+    """
+    order = sorted(range(len(lengths)), key=lambda i: lengths[i])
+    for start in range(0, len(order), batch_size):
+        yield order[start:start + batch_size]
+
+
+class TorchBackend:
+    def __init__(self, model, num_threads=None):
+        if num_threads:
+            torch.set_num_threads(num_threads)
+        self.model = model.eval()
+
+    def __call__(self, encoded_input):
+        with torch.inference_mode():
+            result = self.model(
+                input_ids=encoded_input["input_ids"],
+                attention_mask=encoded_input["attention_mask"])
+        return result[0]
+
+
+class QuantizedBackend(TorchBackend):
+    def __init__(self, model, num_threads=None):
+        quantized = torch.ao.quantization.quantize_dynamic(
+            model.eval(), {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+        super().__init__(quantized, num_threads)
+
+
+class _LogitsOnly(torch.nn.Module):
+    """Exposes a HuggingFace model as (input_ids, attention_mask) -> logits"""
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_ids, attention_mask):
+        return self.model(input_ids=input_ids,
+                          attention_mask=attention_mask)[0]
+
+
+class OnnxBackend:
+    def __init__(self, model, tokenizer, num_threads=None, export_path=None):
+        try:
+            import onnxruntime
+        except ImportError:
+            raise ImportError("The onnx inference backend requires the "
+                              "onnxruntime package (pip install onnxruntime)")
+
+        self.onnxruntime = onnxruntime
+        self.num_threads = num_threads
+        self.export_path = export_path or self._default_export_path(model)
+        if not os.path.exists(self.export_path):
+            self._export(model, tokenizer)
+
+        self._session = None
+        self._pid = None
+
+    @staticmethod
+    def _default_export_path(model):
+        name = model.config._name_or_path
+        revision = getattr(model.config, "_commit_hash", None)
+        digest = hashlib.sha256(f"{name}@{revision}".encode("utf-8"))
+        return os.path.join(tempfile.gettempdir(), "intellicue-onnx",
+                            f"{digest.hexdigest()[:16]}.onnx")
+
+    def _export(self, model, tokenizer):
+        os.makedirs(os.path.dirname(self.export_path), exist_ok=True)
+        wrapper = _LogitsOnly(model).eval()
+        sample = tokenizer(["This is an example.", "Another example"],
+                           padding=True, return_tensors="pt")
+        dynamic_axes = {"input_ids": {0: "batch", 1: "sequence"},
+                        "attention_mask": {0: "batch", 1: "sequence"},
+                        "logits": {0: "batch"}}
+
+        # Export next to the target and rename so that concurrent workers
+        # never load a half-written file
+        partial_path = f"{self.export_path}.{os.getpid()}.partial"
+        with torch.no_grad():
+            torch.onnx.export(wrapper,
+                              (sample["input_ids"], sample["attention_mask"]),
+                              partial_path,
+                              input_names=["input_ids", "attention_mask"],
+                              output_names=["logits"],
+                              dynamic_axes=dynamic_axes, opset_version=17,
+                              dynamo=False)
+        os.replace(partial_path, self.export_path)
+        model.eval()
+
+    """
+    Sessions are created lazily and per process, since ONNX Runtime thread
+    pools do not survive a fork into scoring workers.
+    """
+    def session(self):
+        if self._session is None or self._pid != os.getpid():
+            # Follow torch's thread count, which scoring workers lower to
+            # their share of the cores, unless one was configured
+            options = self.onnxruntime.SessionOptions()
+            options.intra_op_num_threads = (self.num_threads or
+                                            torch.get_num_threads())
+            self._session = self.onnxruntime.InferenceSession(
+                self.export_path, options,
+                providers=["CPUExecutionProvider"])
+            self._pid = os.getpid()
+        return self._session
+
+    def __call__(self, encoded_input):
+        inputs = {
+            "input_ids": np.asarray(encoded_input["input_ids"],
+                                    dtype=np.int64),
+            "attention_mask": np.asarray(encoded_input["attention_mask"],
+                                         dtype=np.int64),
+        }
+        logits = self.session().run(["logits"], inputs)[0]
+        return torch.from_numpy(logits)
+
+
+def load_backend(model, tokenizer, backend="torch", num_threads=None,
+                 export_path=None):
+    if backend == "torch":
+        return TorchBackend(model, num_threads)
+    if backend == "quantized":
+        return QuantizedBackend(model, num_threads)
+    if backend == "onnx":
+        return OnnxBackend(model, tokenizer, num_threads, export_path)
+    raise ValueError(f"Unknown inference backend '{backend}'. "
+                     f"Expected one of: {', '.join(BACKENDS)}")
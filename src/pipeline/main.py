@@ -1,10 +1,14 @@
 from insight import generate_insights_from_json
+from handoff import load_records
 import json
+import sys
 
 if __name__ == "__main__":
-    # Load the JSON file (must be an array of {"message_text": "..."} entries)
-    with open("preprocessed_messages.json", "r", encoding="utf-8") as f:
-        data = json.load(f)
+    # Load the scored messages: a compact stage file (.jsonl[.gz|.zst]) or a
+    # JSON array of {"message_text": "..."} entries
+    input_path = sys.argv[1] if len(sys.argv) > 1 else \
+        "preprocessed_messages.json"
+    data = load_records(input_path)
 
     insights = generate_insights_from_json(data)
 
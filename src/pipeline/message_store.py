@@ -0,0 +1,307 @@
+from array import array
+
+import numpy as np
+
+try:
+    from .thread_index import ThreadIndex
+except ImportError:
+    from thread_index import ThreadIndex
+
+"""
+Structure-of-arrays storage for large runs.
+
+Instead of one Python object per message, a MessageStore keeps each field in
+a column: timestamps, flags and sentiment scores in NumPy arrays, and
+channel ids, thread timestamps and labels as int32 codes into one shared
+string table. Message texts and reactions stay in plain lists.
+
+StoredMessage is a two-slot view on one row. It has the same attributes as
+UnscoredMessage, so MessageParser grouping and ScoringPipeline can use the
+store without changes to the scoring loop. group() sorts the columns with
+np.lexsort instead of indexing a view per row, and hands out each thread as
+a StoredThread of row indices, whose views are only created when a message
+is read.
+"""
+
+# Columns other than texts and reactions, and the value of an empty row
+COLUMNS = {
+    "channel_id": (np.int32, -1),
+    "channel_name": (np.int32, -1),
+    "parent_thread_ts": (np.int32, -1),
+    "timestamp": (np.float64, np.nan),
+    "is_thread_reply": (np.bool_, False),
+    "sentiment": (np.int32, -1),
+    "category": (np.int32, -1),
+    "thread_sentiment": (np.int32, -1),
+}
+
+# Shared by every message without reactions; never mutated
+_NO_REACTIONS = []
+
+
+class StringTable:
+    def __init__(self):
+        self.values = []
+        self._codes = {}
+
+    def code(self, value):
+        if value is None:
+            return -1
+        code = self._codes.get(value)
+        if code is None:
+            code = len(self.values)
+            self._codes[value] = code
+            self.values.append(value)
+        return code
+
+    def value(self, code):
+        return None if code < 0 else self.values[code]
+
+    def __len__(self):
+        return len(self.values)
+
+
+class StoredMessage:
+    __slots__ = ("store", "index")
+
+    def __init__(self, store, index):
+        self.store = store
+        self.index = index
+
+    @property
+    def message_text(self):
+        return self.store.message_text[self.index]
+
+    @property
+    def reactions(self):
+        return self.store.reactions[self.index]
+
+    @property
+    def channel_id(self):
+        return self.store.label("channel_id", self.index)
+
+    @property
+    def channel_name(self):
+        return self.store.label("channel_name", self.index)
+
+    @property
+    def timestamp(self):
+        return float(self.store.timestamp[self.index])
+
+    @property
+    def is_thread_reply(self):
+        return bool(self.store.is_thread_reply[self.index])
+
+    @property
+    def parent_thread_ts(self):
+        return self.store.label("parent_thread_ts", self.index)
+
+    def to_dict(self):
+        return {
+            "message_text": self.message_text,
+            "reactions": self.reactions,
+            "channel_id": self.channel_id,
+            "channel_name": self.channel_name,
+            "timestamp": str(self.timestamp),
+            "is_thread_reply": self.is_thread_reply,
+            "parent_thread_ts": self.parent_thread_ts,
+        }
+
+
+class StoredThread:
+    __slots__ = ("store", "indices")
+
+    def __init__(self, store, indices):
+        self.store = store
+        self.indices = indices
+
+    def __len__(self):
+        return len(self.indices)
+
+    def __getitem__(self, position):
+        if isinstance(position, slice):
+            return [StoredMessage(self.store, int(index))
+                    for index in self.indices[position]]
+        return StoredMessage(self.store, int(self.indices[position]))
+
+    def __iter__(self):
+        for index in self.indices:
+            yield StoredMessage(self.store, int(index))
+
+
+class MessageStore:
+    def __init__(self, capacity=1024, num_sentiments=3):
+        self.strings = StringTable()
+        self.message_text = []
+        self.reactions = []
+        self._size = 0
+        self._capacity = capacity
+        for name, (dtype, empty) in COLUMNS.items():
+            setattr(self, name, np.full(capacity, empty, dtype=dtype))
+        self.sentiment_scores = np.full((capacity, num_sentiments), np.nan,
+                                        dtype=np.float32)
+        # Kept message indices in scoring order, and the scored text of
+        # those whose text was prefixed with thread context
+        self._scored_order = array("q")
+        self._scored_text = {}
+
+    @classmethod
+    def from_messages(cls, messages):
+        store = cls()
+        for message in messages:
+            store.add_message(message)
+        return store
+
+    def __len__(self):
+        return self._size
+
+    def __getitem__(self, index):
+        if not 0 <= index < self._size:
+            raise IndexError("message index out of range")
+        return StoredMessage(self, index)
+
+    def __iter__(self):
+        for index in range(self._size):
+            yield StoredMessage(self, index)
+
+    def _grow(self):
+        self._capacity *= 2
+        for name, (dtype, empty) in COLUMNS.items():
+            column = getattr(self, name)
+            grown = np.full(self._capacity, empty, dtype=dtype)
+            grown[:self._size] = column[:self._size]
+            setattr(self, name, grown)
+        grown = np.full((self._capacity, self.sentiment_scores.shape[1]),
+                        np.nan, dtype=np.float32)
+        grown[:self._size] = self.sentiment_scores[:self._size]
+        self.sentiment_scores = grown
+
+    def append(self, message_text, reactions, channel_id, channel_name,
+               timestamp, is_thread_reply, parent_thread_ts):
+        if self._size == self._capacity:
+            self._grow()
+        index = self._size
+        self.message_text.append(message_text)
+        # Most messages have no reactions, so share one empty list
+        self.reactions.append(reactions if reactions else _NO_REACTIONS)
+        self.channel_id[index] = self.strings.code(channel_id)
+        self.channel_name[index] = self.strings.code(channel_name)
+        self.timestamp[index] = float(timestamp)
+        self.is_thread_reply[index] = is_thread_reply
+        self.parent_thread_ts[index] = self.strings.code(parent_thread_ts)
+        self._size += 1
+        return index
+
+    def add_message(self, message):
+        return self.append(message.message_text, message.reactions,
+                           message.channel_id, message.channel_name,
+                           message.timestamp, message.is_thread_reply,
+                           message.parent_thread_ts)
+
+    def label(self, column, index):
+        return self.strings.value(int(getattr(self, column)[index]))
+
+    """
+    Index the messages by thread, as StoredMessage views.
+    """
+    def thread_index(self):
+        return ThreadIndex.from_messages(iter(self))
+
+    """
+    Group the messages by channel and parent thread timestamp, in the same
+    shape and order as MessageParser.group_messages: channels in first-seen
+    order, their threads by root timestamp and each thread by timestamp,
+    ties in arrival order. Threads are StoredThreads.
+    """
+    def group(self):
+        grouped = {}
+        size = self._size
+        if size == 0:
+            return grouped
+        channels = self.channel_id[:size]
+        parents = self.parent_thread_ts[:size]
+        # Codes are handed out in first-seen order, so sorting channels by
+        # code keeps them in that order; roots sort by their float value
+        codes = np.unique(parents)
+        values = np.array([float(self.strings.value(int(code)))
+                           for code in codes], dtype=np.float64)
+        roots = values[np.searchsorted(codes, parents)]
+        order = np.lexsort((self.timestamp[:size], parents, roots, channels))
+
+        sorted_channels = channels[order]
+        sorted_parents = parents[order]
+        starts = np.flatnonzero(
+            (sorted_channels[1:] != sorted_channels[:-1])
+            | (sorted_parents[1:] != sorted_parents[:-1])) + 1
+        bounds = np.concatenate(([0], starts, [size]))
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            channel = grouped.setdefault(
+                self.strings.value(int(sorted_channels[start])), {})
+            channel[self.strings.value(int(sorted_parents[start]))] = \
+                StoredThread(self, order[start:end])
+        return grouped
+
+    """
+    Record the scores of kept ScoredMessages whose index points into this
+    store.
+    """
+    def record_scores(self, scored_messages):
+        for scored in scored_messages:
+            index = scored.index
+            self.sentiment[index] = self.strings.code(scored.sentiment)
+            self.category[index] = self.strings.code(scored.category)
+            self.thread_sentiment[index] = self.strings.code(
+                scored.thread_sentiment)
+            if scored.sentiment_scores is not None:
+                self.sentiment_scores[index] = scored.sentiment_scores
+            if scored.message_text != self.message_text[index]:
+                self._scored_text[index] = scored.message_text
+            self._scored_order.append(index)
+
+    def scored_records(self):
+        return ScoredRecords(self)
+
+    """
+    Yield the messages as preprocessed-stage records, thread by thread.
+    """
+    def records(self):
+        for threads in self.group().values():
+            for thread in threads.values():
+                for message in thread:
+                    yield message.to_dict()
+
+    def nbytes(self):
+        arrays = sum(getattr(self, name).nbytes for name in COLUMNS)
+        return arrays + self.sentiment_scores.nbytes
+
+
+"""
+The kept messages of a store in scoring order. Iterating yields the same
+dictionaries as ScoredMessage.to_dict, built one at a time so that the
+writers never hold them all.
+"""
+
+
+class ScoredRecords:
+    def __init__(self, store):
+        self.store = store
+
+    def __len__(self):
+        return len(self.store._scored_order)
+
+    def __iter__(self):
+        store = self.store
+        for index in store._scored_order:
+            result = {
+                "message_text": store._scored_text.get(
+                    index, store.message_text[index]),
+                "timestamp": float(store.timestamp[index]),
+                "parent_thread_ts": store.label("parent_thread_ts", index),
+                "sentiment": store.label("sentiment", index),
+                "category": store.label("category", index),
+                "reactions": store.reactions[index]
+            }
+            thread_sentiment = store.label("thread_sentiment", index)
+            if thread_sentiment is not None:
+                result["thread_sentiment"] = thread_sentiment
+            yield result
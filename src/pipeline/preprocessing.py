@@ -1,8 +1,176 @@
+import html
 import json
+import os
+import re
 import sys
 # from datetime import datetime
 from pathlib import Path
 
+try:
+    from .handoff import (is_compact_path, is_incremental, read_records,
+                          write_records)
+    from .message_store import MessageStore
+    from .thread_index import ThreadIndex
+except ImportError:
+    from handoff import (is_compact_path, is_incremental, read_records,
+                         write_records)
+    from message_store import MessageStore
+    from thread_index import ThreadIndex
+
+
+def _skip_separators(buffer, pos):
+    while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+        pos += 1
+    return pos
+
+
+def iter_records(file, chunk_size=1 << 16):
+    """
+    Yield the records of a JSON array or JSON Lines file one at a time,
+    reading it in chunks so that memory stays flat for large exports.
+    """
+    decoder = json.JSONDecoder()
+    buffer, pos, eof = "", 0, False
+
+    def refill():
+        nonlocal buffer, pos, eof
+        chunk = file.read(chunk_size)
+        eof = len(chunk) == 0
+        buffer = buffer[pos:] + chunk
+        pos = 0
+
+    refill()
+    pos = _skip_separators(buffer, pos)
+    in_array = buffer[pos:pos + 1] == "["
+    if in_array:
+        pos += 1
+
+    while True:
+        pos = _skip_separators(buffer, pos)
+        if pos >= len(buffer):
+            if eof:
+                if in_array:
+                    raise json.JSONDecodeError("Unterminated array",
+                                               buffer, pos)
+                return
+            refill()
+            continue
+        if in_array and buffer[pos] == "]":
+            return
+
+        try:
+            record, end = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            # The record continues in the next chunk
+            if eof:
+                raise
+            refill()
+            continue
+        yield record
+        pos = end
+
+
+# Slack markup, see https://api.slack.com/reference/surfaces/formatting
+CODE_BLOCK_PATTERN = re.compile(r"```.*?```", re.DOTALL)
+INLINE_CODE_PATTERN = re.compile(r"`([^`\n]+)`")
+USER_MENTION_PATTERN = re.compile(r"<@[UW][A-Z0-9]+(?:\|[^>]*)?>")
+CHANNEL_MENTION_PATTERN = re.compile(r"<#C[A-Z0-9]+(?:\|([^>]*))?>")
+SPECIAL_MENTION_PATTERN = re.compile(
+    r"<!(here|channel|everyone)(?:\|[^>]*)?>|<!subteam\^[^>|]+\|?([^>]*)>")
+LINK_PATTERN = re.compile(r"<(?:https?|mailto|tel):[^>|]*(?:\|([^>]*))?>")
+EMOJI_PATTERN = re.compile(r"(?<!\w):[a-z0-9_+\-']+:(?::skin-tone-\d:)?",
+                           re.IGNORECASE)
+WHITESPACE_PATTERN = re.compile(r"\s+")
+# Messages without a single letter or digit left carry nothing to score
+TRIVIAL_PATTERN = re.compile(r"^[\W_]*$")
+# Rough token count: words and punctuation marks
+TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+
+def _channel_name(match):
+    return "#" + (match.group(1) or "channel")
+
+
+def _special_mention(match):
+    return "@" + (match.group(1) or match.group(2).lstrip("@") or "group")
+
+
+def _link_label(match):
+    return match.group(1) or "link"
+
+
+def count_tokens(text):
+    return len(TOKEN_PATTERN.findall(text or ""))
+
+
+"""
+Strips or canonicalizes Slack markup in message texts before they reach
+the tokenizers, and drops messages with nothing left to score.
+
+- code blocks become [code] and inline code keeps its contents
+- user mentions become @user, channel and group mentions their names
+- links become their label, or link when they have none
+- emoji codes are removed and HTML entities unescaped
+- runs of whitespace collapse to a single space
+
+Token savings are estimated by counting words and punctuation marks, which
+tracks the model tokenizers closely enough for reporting.
+"""
+
+
+class TextNormalizer:
+    COUNTERS = ("checked", "dropped", "tokens_before", "tokens_after")
+
+    def __init__(self, drop_trivial=True):
+        self.drop_trivial = drop_trivial
+        self.checked = 0
+        self.dropped = 0
+        self.tokens_before = 0
+        self.tokens_after = 0
+
+    @staticmethod
+    def normalize(text):
+        text = text or ""
+        text = CODE_BLOCK_PATTERN.sub(" [code] ", text)
+        text = INLINE_CODE_PATTERN.sub(r"\1", text)
+        text = USER_MENTION_PATTERN.sub("@user", text)
+        text = CHANNEL_MENTION_PATTERN.sub(_channel_name, text)
+        text = SPECIAL_MENTION_PATTERN.sub(_special_mention, text)
+        text = LINK_PATTERN.sub(_link_label, text)
+        text = EMOJI_PATTERN.sub(" ", text)
+        text = html.unescape(text)
+        return WHITESPACE_PATTERN.sub(" ", text).strip()
+
+    """
+    Normalize the text of a message in place. Returns None if the message
+    is empty or trivial afterwards and should be dropped.
+    """
+    def apply(self, message):
+        original = message.message_text
+        text = self.normalize(original)
+        self.checked += 1
+        self.tokens_before += count_tokens(original)
+
+        if self.drop_trivial and TRIVIAL_PATTERN.match(text):
+            self.dropped += 1
+            return None
+        self.tokens_after += count_tokens(text)
+        message.message_text = text
+        return message
+
+    def stats(self):
+        saved = self.tokens_before - self.tokens_after
+        return {
+            "checked": self.checked,
+            "dropped": self.dropped,
+            "tokens_before": self.tokens_before,
+            "tokens_after": self.tokens_after,
+            "tokens_saved": saved,
+            "saved_rate": (saved / self.tokens_before
+                           if self.tokens_before else 0.0),
+        }
+
+
 """
 An object used to represent a message in the Slack export before it is passed
 through the Sentiment Analysis Model.
@@ -19,6 +187,9 @@ Fields:
 
 
 class UnscoredMessage:
+    __slots__ = ("message_text", "reactions", "channel_id", "channel_name",
+                 "timestamp", "is_thread_reply", "parent_thread_ts")
+
     def __init__(self, message_text, reactions, channel_id, channel_name,
                  timestamp, is_thread_reply, parent_thread_ts):
         self.message_text = message_text
@@ -49,95 +220,188 @@ It loads the messages from the file and creates UnscoredMessage objects.
 - filters out non-message types and automated messages
 - checks if a message is a thread reply
 
-Also groups messages by channel and parent thread timestamp.
+Also groups messages by channel and parent thread timestamp, with each
+thread sorted by timestamp (see ThreadIndex).
+
+With a TextNormalizer, message texts are normalized as they are read and
+messages left empty are dropped before they reach the scoring models. Only
+extracted records are normalized: preprocessed records were normalized
+already, and normalizing twice would unescape their HTML entities twice.
+
+In streaming mode the export (a JSON array, or JSON Lines with one record
+per line) is parsed record by record and filtered as it is read, and the
+messages are fed lazily into grouping instead of being held in a list.
 """
 
 
+def _expand_grouped(record):
+    """
+    Yield the messages of the grouped JSON that get_messages_json writes
+    for non-compact paths ({channel_id: {parent_ts: [message, ...]}}), or
+    the record itself when it is a single message.
+    """
+    if "message_text" in record or not all(
+            isinstance(channel, dict) for channel in record.values()):
+        yield record
+        return
+    for channel in record.values():
+        for thread in channel.values():
+            yield from thread
+
+
 class MessageParser:
-    def __init__(self, input_path):
+    def __init__(self, input_path, streaming=False, normalizer=None):
         self.input_path = input_path
+        self.streaming = streaming
+        self.normalizer = normalizer
         self.ungrouped_messages = []
         self.grouped_messages = {}
+        # Set once messages are grouped, even if no thread came out of it
+        self.grouped = False
+        self.thread_index = ThreadIndex()
 
     """
-    Load messages from the file and return a list of dictionaries.
+    Create an UnscoredMessage from an extracted record, or return None for
+    non-messages and automated messages. Preprocessed records, which were
+    filtered already and lack those fields, are read back as they are.
     """
-    def load_messages(self):
-        # Open JSON file
-        data = {}
+    @staticmethod
+    def parse_record(message):
+        # Skip non-messages and automated messages
+        not_message = message.get('message_type', 'message') != 'message'
+        automated = message.get('subtype') is not None
+        bot = message.get('sent_by_bot_id') is not None
+        if not_message or automated or bot:
+            return None
+
+        # Create new UnscoredMessage object
+        if message['is_thread_reply']:
+            return UnscoredMessage(
+                message_text=message['message_text'],
+                reactions=message['reactions'],
+                channel_id=message['channel_id'],
+                channel_name=message['channel_name'],
+                timestamp=message['timestamp'],
+                is_thread_reply=True,
+                parent_thread_ts=message['parent_thread_ts']
+            )
+        return UnscoredMessage(
+            message_text=message['message_text'],
+            reactions=message['reactions'],
+            channel_id=message['channel_id'],
+            channel_name=message['channel_name'],
+            timestamp=message['timestamp'],
+            is_thread_reply=False,
+            # Top-level messages are their own thread; prefer the original
+            # string ts since stage files store timestamps as floats
+            parent_thread_ts=(message.get('parent_thread_ts')
+                              or message['timestamp'])
+        )
+
+    """
+    Yield the filtered messages of the file one at a time. Compact stage
+    files (.jsonl, .jsonl.gz, .jsonl.zst) are read block by block.
+    """
+    def iter_messages(self):
+        for msg, extracted in self._iter_parsed():
+            if self.normalizer is not None and extracted:
+                msg = self.normalizer.apply(msg)
+            if msg is not None:
+                yield msg
+
+        if self.normalizer is not None and self.normalizer.checked > 0:
+            stats = self.normalizer.stats()
+            print(f"Normalization: dropped {stats['dropped']} of "
+                  f"{stats['checked']} messages as empty, saved about "
+                  f"{stats['tokens_saved']} tokens "
+                  f"({stats['saved_rate']:.0%})")
+
+    """
+    Yield (message, extracted) pairs, where extracted says whether the
+    record came from the extraction rather than from preprocessing.
+    """
+    def _iter_parsed(self):
         try:
+            if is_compact_path(self.input_path):
+                for record in read_records(self.input_path):
+                    msg = self.parse_record(record)
+                    if msg is not None:
+                        yield msg, 'message_type' in record
+                return
+
             with open(self.input_path, 'r') as file:
-                # Load JSON data
-                data = json.load(file)
-
-                # Run through all messages
-                for message in data:
-                    # Skip non-messages and automated messages
-                    not_message = message['message_type'] != 'message'
-                    automated = message['subtype'] is not None
-                    bot = message['sent_by_bot_id'] is not None
-                    if not_message or automated or bot:
-                        continue
-
-                    # Create new UnscoredMessage object
-                    msg = None
-                    if message['is_thread_reply']:
-                        msg = UnscoredMessage(
-                            message_text=message['message_text'],
-                            reactions=message['reactions'],
-                            channel_id=message['channel_id'],
-                            channel_name=message['channel_name'],
-                            timestamp=message['timestamp'],
-                            is_thread_reply=True,
-                            parent_thread_ts=message['parent_thread_ts']
-                        )
-                    else:
-                        msg = UnscoredMessage(
-                            message_text=message['message_text'],
-                            reactions=message['reactions'],
-                            channel_id=message['channel_id'],
-                            channel_name=message['channel_name'],
-                            timestamp=message['timestamp'],
-                            is_thread_reply=False,
-                            parent_thread_ts=message['timestamp']
-                        )
-                    # Add to unscored messages list
-                    self.ungrouped_messages.append(msg)
+                for record in iter_records(file):
+                    for message in _expand_grouped(record):
+                        msg = self.parse_record(message)
+                        if msg is not None:
+                            yield msg, 'message_type' in message
 
         except json.JSONDecodeError:
-            print(f"Error: The file {self.file_path} is not a valid JSON file")
+            print(f"Error: The file {self.input_path} is not a valid JSON "
+                  f"file")
             sys.exit(1)
         except FileNotFoundError:
-            print(f"Error: The file {self.file_path} was not found")
+            print(f"Error: The file {self.input_path} was not found")
             sys.exit(1)
 
+    """
+    Load messages from the file and return a list of dictionaries. In
+    streaming mode nothing is read yet and a lazy iterator is returned.
+    """
+    def load_messages(self):
+        if self.streaming:
+            return self.iter_messages()
+
+        # Add to unscored messages list
+        self.ungrouped_messages.extend(self.iter_messages())
         return self.ungrouped_messages
+
+    """
+    Load messages from the file into a column-based MessageStore. Records
+    are parsed one at a time, so no list of message objects is built.
+    """
+    def load_store(self):
+        return MessageStore.from_messages(self.iter_messages())
     """
-    Group messages by channel and parent thread timestamp.
+    Group messages by channel and parent thread timestamp. Threads come
+    out oldest first whatever order the export lists them in.
     """
-    def group_messages(self):
+    def group_messages(self, messages=None):
+        if messages is None:
+            if self.streaming:
+                messages = self.iter_messages()
+            else:
+                messages = self.ungrouped_messages
 
-        for message in self.ungrouped_messages:
-            # Create a channel key for the message
-            channel_key = message.channel_id
-            if channel_key not in self.grouped_messages:
-                self.grouped_messages[channel_key] = {}
-            channel_messages = self.grouped_messages[channel_key]
+        self.thread_index.add_many(messages)
+        self.grouped_messages = self.thread_index.grouped()
+        self.grouped = True
+        return self.grouped_messages
 
-            # Create a parent thread key for the message
-            parent_key = message.parent_thread_ts
-            if parent_key not in channel_messages:
-                channel_messages[parent_key] = []
-            channel_messages[parent_key].append(message)
+    """
+    Group only the messages newer than the watermarks of a PreprocessState,
+    merged into the open threads they belong to. Returns just the threads
+    that gained messages.
+    """
+    def group_new_messages(self, state):
+        if self.streaming:
+            messages = self.iter_messages()
+        else:
+            messages = self.ungrouped_messages
 
+        self.grouped_messages = state.merge(messages)
+        self.grouped = True
         return self.grouped_messages
     """
-    Return the unscored messages to a JSON file.
+    Return the unscored messages to a JSON file. Compact stage paths
+    (.jsonl, .jsonl.gz, .jsonl.zst) are written in the columnar handoff
+    format, one record per message in thread order.
     """
     def get_messages_json(self, output_path=None):
         # Get file path
         output = Path(output_path)
-        self.group_messages()
+        if not self.grouped:
+            self.group_messages()
 
         # Get grouped message data
         data = {}
@@ -148,8 +412,13 @@ class MessageParser:
                 data[channel_id][parent_ts] = msg_arr
 
         # Save to JSON file
-        with output.open('w', encoding='utf-8') as file:
-            json.dump(data, file, indent=4)
+        if is_compact_path(output):
+            write_records(output, "preprocessed",
+                          (msg for channel in data.values()
+                           for thread in channel.values() for msg in thread))
+        else:
+            with output.open('w', encoding='utf-8') as file:
+                json.dump(data, file, indent=4)
 
         print(f"Unscored messages saved to {output_path}")
         return data
@@ -157,16 +426,39 @@ class MessageParser:
 
 def main():
     # Check if the file path is provided
-    if len(sys.argv) != 2:
-        print("Usage: python preprocessing.py <input_path>")
+    if len(sys.argv) not in (2, 3):
+        print("Usage: python preprocessing.py <input_path> [output_path]")
         sys.exit(1)
 
     # Get the input file path from command line arguments
     input_path = sys.argv[1]
-    mp = MessageParser(input_path)
+    normalize = os.getenv("NORMALIZE_TEXT", "1") != "0"
+    mp = MessageParser(input_path,
+                       normalizer=TextNormalizer() if normalize else None)
     mp.load_messages()
+
+    # Only process messages since the last run when a state file is set
+    state = None
+    if os.getenv("PREPROCESS_STATE_PATH"):
+        # Imported here since the incremental module builds on this one
+        try:
+            from .incremental import PreprocessState
+        except ImportError:
+            from incremental import PreprocessState
+        state = PreprocessState(os.getenv("PREPROCESS_STATE_PATH"))
+        mp.group_new_messages(state)
+    elif is_incremental(input_path):
+        print(f"Warning: {input_path} only holds the messages extracted "
+              f"since the last extraction. Set PREPROCESS_STATE_PATH to "
+              f"merge them into the threads of earlier runs, or the report "
+              f"only covers them")
+
     # Get the output path from command line arguments
-    mp.get_messages_json()
+    output_path = (sys.argv[2] if len(sys.argv) == 3
+                   else "preprocessed_messages.json")
+    mp.get_messages_json(output_path)
+    if state is not None:
+        state.save()
 
 
 if __name__ == "__main__":
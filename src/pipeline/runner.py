@@ -0,0 +1,185 @@
+import argparse
+import json
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from pathlib import Path
+
+try:
+    from .handoff import is_incremental, write_records
+    from .insight import generate_insights_from_json
+    from .pdf_generator import PDFGenerator
+    from .preprocessing import MessageParser, TextNormalizer
+    from .scoring import ScoringPipeline, scoring_options_from_env
+except ImportError:
+    from handoff import is_incremental, write_records
+    from insight import generate_insights_from_json
+    from pdf_generator import PDFGenerator
+    from preprocessing import MessageParser, TextNormalizer
+    from scoring import ScoringPipeline, scoring_options_from_env
+
+"""
+Runs the whole pipeline in one process, from an extraction file to the PDF
+report:
+
+    parse ----\\
+               +--> score --> insights --> report
+    models ---/
+
+Stages run as a DAG on a thread pool, each as soon as the stages it needs
+are done, so loading the models overlaps with parsing the messages. Stage
+results are handed on in memory: the parser's MessageStore goes straight
+to ScoringPipeline, and the scored messages straight to the insights.
+Intermediates are only written when a persist directory is given.
+"""
+
+
+class Stage:
+    def __init__(self, name, func, requires=()):
+        self.name = name
+        self.func = func
+        self.requires = tuple(requires)
+
+
+def _run_stage(stage, inputs):
+    start = time.perf_counter()
+    result = stage.func(**inputs)
+    print(f"Stage {stage.name} done in {time.perf_counter() - start:.1f}s")
+    return result
+
+
+"""
+Run stages as soon as the stages they require are done, passing each the
+results of its requirements as keyword arguments. Returns every stage's
+result by name. The first failing stage's error is raised once the stages
+already running have finished.
+"""
+
+
+def run_stages(stages, max_workers=None):
+    names = {stage.name for stage in stages}
+    for stage in stages:
+        missing = set(stage.requires) - names
+        if len(missing) > 0:
+            raise ValueError(f"Stage {stage.name} requires unknown stages: "
+                             f"{', '.join(sorted(missing))}")
+
+    results, running = {}, {}
+    pending = list(stages)
+    with ThreadPoolExecutor(max_workers or len(stages)) as pool:
+        while len(pending) > 0 or len(running) > 0:
+            ready = [stage for stage in pending
+                     if all(name in results for name in stage.requires)]
+            for stage in ready:
+                pending.remove(stage)
+                inputs = {name: results[name] for name in stage.requires}
+                running[pool.submit(_run_stage, stage, inputs)] = stage
+            if len(running) == 0:
+                raise ValueError("Stages have circular requirements: "
+                                 f"{', '.join(s.name for s in pending)}")
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage = running.pop(future)
+                results[stage.name] = future.result()
+    return results
+
+
+class PipelineRunner:
+    def __init__(self, input_path, report_path="feedback_report.pdf",
+                 persist_dir=None, normalize=True, scoring_options=None,
+                 generate_insights=generate_insights_from_json):
+        self.input_path = input_path
+        self.report_path = report_path
+        self.persist_dir = Path(persist_dir) if persist_dir else None
+        self.normalize = normalize
+        self.scoring_options = (scoring_options if scoring_options is not None
+                                else scoring_options_from_env())
+        self.generate_insights = generate_insights
+
+    def _persist(self, name):
+        if self.persist_dir is None:
+            return None
+        self.persist_dir.mkdir(parents=True, exist_ok=True)
+        return self.persist_dir / name
+
+    def parse(self):
+        if is_incremental(self.input_path):
+            print(f"Warning: {self.input_path} only holds the messages "
+                  f"extracted since the last extraction, so the report only "
+                  f"covers them. Unset EXTRACTION_CURSORS for a full "
+                  f"extraction")
+        normalizer = TextNormalizer() if self.normalize else None
+        store = MessageParser(self.input_path,
+                              normalizer=normalizer).load_store()
+        path = self._persist("preprocessed.jsonl.gz")
+        if path is not None:
+            write_records(path, "preprocessed", store.records())
+        return store
+
+    def models(self):
+        pipeline = ScoringPipeline({}, **self.scoring_options)
+        pipeline.load_models()
+        return pipeline
+
+    def score(self, parse, models):
+        options = dict(self.scoring_options,
+                       sentiment_analyzer=models.sentiment_analyzer,
+                       classifier=models.classifier)
+        scored = list(ScoringPipeline(parse, **options).score_messages())
+        path = self._persist("scored.jsonl.gz")
+        if path is not None:
+            write_records(path, "scored", scored)
+        return scored
+
+    def insights(self, score):
+        insights = self.generate_insights(score)
+        path = self._persist("insights.json")
+        if path is not None:
+            with path.open("w", encoding="utf-8") as f:
+                json.dump(insights, f, indent=2)
+        return insights
+
+    def report(self, insights):
+        PDFGenerator(str(self.report_path)).generate_report(insights)
+        print(f"Report saved to {self.report_path}")
+        return self.report_path
+
+    def stages(self):
+        stages = [
+            Stage("parse", self.parse),
+            Stage("models", self.models),
+            Stage("score", self.score, requires=("parse", "models")),
+            Stage("insights", self.insights, requires=("score",)),
+        ]
+        if self.report_path is not None:
+            stages.append(Stage("report", self.report,
+                                requires=("insights",)))
+        return stages
+
+    def run(self):
+        return run_stages(self.stages())
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run the pipeline from an extraction file to a PDF "
+                    "report. Scoring options are read from the same "
+                    "environment variables as scoring.py.")
+    parser.add_argument("input_path",
+                        help="extraction file (.json or .jsonl[.gz|.zst])")
+    parser.add_argument("--report", default="feedback_report.pdf",
+                        help="where to write the PDF report")
+    parser.add_argument("--persist-dir",
+                        help="also write the preprocessed and scored "
+                             "messages and the insights to this directory")
+    parser.add_argument("--no-normalize", action="store_true",
+                        help="score the raw Slack message texts")
+    args = parser.parse_args()
+
+    PipelineRunner(args.input_path, report_path=args.report,
+                   persist_dir=args.persist_dir,
+                   normalize=not args.no_normalize).run()
+
+
+if __name__ == "__main__":
+    main()
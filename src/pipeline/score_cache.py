@@ -0,0 +1,129 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+"""
+An on-disk, content-addressed cache of model outputs used by the
+ScoringPipeline so that re-runs over mostly unchanged history only run
+inference on new messages.
+
+Entries are keyed by a hash of everything that determines a model output
+(model name, model revision, label set and the exact input text including
+thread context) and are evicted least-recently-used once the cache holds
+more than max_entries rows. Hit and miss counters are kept per process.
+"""
+
+
+class ScoreCache:
+    COUNTERS = ("hits", "misses")
+
+    def __init__(self, path, max_entries=500000):
+        self.path = str(path)
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._connection = None
+        self._pid = None
+
+    @staticmethod
+    def make_key(*parts):
+        hasher = hashlib.sha256()
+        for part in parts:
+            hasher.update(json.dumps(part, sort_keys=True).encode("utf-8"))
+            hasher.update(b"\0")
+        return hasher.hexdigest()
+
+    """
+    Return the open connection, reconnecting in forked worker processes
+    since sqlite connections cannot be shared across a fork.
+    """
+    def _connect(self):
+        if self._connection is None or self._pid != os.getpid():
+            parent = os.path.dirname(self.path)
+            if parent:
+                os.makedirs(parent, exist_ok=True)
+            self._connection = sqlite3.connect(self.path, timeout=30)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS scores ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+                "last_used REAL NOT NULL)")
+            self._connection.execute(
+                "CREATE INDEX IF NOT EXISTS scores_last_used "
+                "ON scores (last_used)")
+            self._pid = os.getpid()
+        return self._connection
+
+    """
+    Look up many keys at once. Returns a dict of the keys that were found.
+    """
+    def get_many(self, keys):
+        keys = list(dict.fromkeys(keys))
+        if len(keys) == 0:
+            return {}
+
+        connection = self._connect()
+        found = {}
+        # Stay below sqlite's limit on bound parameters
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            rows = connection.execute(
+                f"SELECT key, value FROM scores WHERE key IN ({placeholders})",
+                chunk).fetchall()
+            for key, value in rows:
+                found[key] = json.loads(value)
+
+        if len(found) > 0:
+            now = time.time()
+            with connection:
+                connection.executemany(
+                    "UPDATE scores SET last_used = ? WHERE key = ?",
+                    [(now, key) for key in found])
+
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        return found
+
+    def put_many(self, items):
+        if len(items) == 0:
+            return
+
+        connection = self._connect()
+        now = time.time()
+        with connection:
+            connection.executemany(
+                "INSERT OR REPLACE INTO scores (key, value, last_used) "
+                "VALUES (?, ?, ?)",
+                [(key, json.dumps(value), now)
+                 for key, value in items.items()])
+            self._evict(connection)
+
+    def _evict(self, connection):
+        count = connection.execute("SELECT COUNT(*) FROM scores").fetchone()
+        excess = count[0] - self.max_entries
+        if excess > 0:
+            connection.execute(
+                "DELETE FROM scores WHERE key IN ("
+                "SELECT key FROM scores ORDER BY last_used LIMIT ?)",
+                (excess,))
+
+    def __len__(self):
+        return self._connect().execute(
+            "SELECT COUNT(*) FROM scores").fetchone()[0]
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    def close(self):
+        if self._connection is not None and self._pid == os.getpid():
+            self._connection.close()
+        self._connection = None
+        self._pid = None
@@ -1,30 +1,168 @@
-from transformers import pipeline
 from transformers import (
     AutoTokenizer,
     AutoModelForSequenceClassification as AutoModel
 )
-import numpy as np
 import torch
-import json
+import multiprocessing
+import os
 import sys
-from preprocessing import MessageParser
-from pathlib import Path
+
+try:
+    from .cascade import SmallTalkFilter
+    from .context import ThreadContext, special_token_ids
+    from .dedup import Deduplicator
+    from .embedding_classifier import EmbeddingClassifier
+    from .handoff import write_records
+    from .message_store import MessageStore
+    from .inference import TorchBackend, length_sorted_batches, load_backend
+    from .preprocessing import MessageParser, TextNormalizer
+    from .score_cache import ScoreCache
+except ImportError:
+    from cascade import SmallTalkFilter
+    from context import ThreadContext, special_token_ids
+    from dedup import Deduplicator
+    from embedding_classifier import EmbeddingClassifier
+    from handoff import write_records
+    from message_store import MessageStore
+    from inference import TorchBackend, length_sorted_batches, load_backend
+    from preprocessing import MessageParser, TextNormalizer
+    from score_cache import ScoreCache
+
+SENTIMENTS = ["negative", "neutral", "positive"]
+CATEGORY_LABELS = ["inquiry", "goal", "complaint", "praise", "other"]
+
+# message: score each message with its thread context as a prefix
+# thread: score each thread once and assign per-message labels from it
+SCORING_MODES = ["message", "thread"]
+
+# Longest input both scoring models accept, special tokens included
+MAX_MODEL_TOKENS = 512
+
+# Model types whose classification head reads the hidden state of the first
+# (<s>) position, which analyze_threads relies on
+THREAD_POOLING_MODEL_TYPES = {"roberta", "xlm-roberta", "camembert"}
+
+
+def shard_threads(threads, num_shards):
+    """
+    Split threads into at most num_shards shards of roughly equal message
+    count. Whole threads always land in the same shard so that their context
+    stays in one worker. Returns lists of thread indices in input order.
+    """
+    shards = [[] for _ in range(num_shards)]
+    loads = [0] * num_shards
+    by_size = sorted(range(len(threads)), key=lambda t: -len(threads[t]))
+    for t in by_size:
+        shard = loads.index(min(loads))
+        shards[shard].append(t)
+        loads[shard] += len(threads[t])
+    return [sorted(shard) for shard in shards if len(shard) > 0]
+
+
+# Pipeline and threads handed to forked scoring workers. They are set right
+# before the pool is created so that workers inherit the loaded model weights
+# copy-on-write instead of loading their own copies.
+_worker_pipeline = None
+_worker_threads = None
+
+
+def _init_scoring_worker(num_threads):
+    torch.set_num_threads(num_threads)
+
+
+def _score_shard(shard):
+    threads = [_worker_threads[t] for t in shard]
+    before = _worker_pipeline._counters()
+    kept = _worker_pipeline._score_threads(threads)
+    after = _worker_pipeline._counters()
+    return kept, {key: after[key] - before[key] for key in after}
+
+
+def _model_fingerprint(model_name, revision, model, backend):
+    return {
+        "model": model_name,
+        "revision": revision or getattr(model.config, "_commit_hash", None),
+        "backend": backend
+    }
+
 
 """
 Used to classify messages into different categories such as question,
 feedback, complaint, praise, or other.This is done using a zero-shot
 classification model.
+
+Every (message, label) pair is an NLI premise/hypothesis pair, so instead of
+calling the HuggingFace pipeline once per message the pairs of many messages
+are gathered into large length-sorted batches. The returned dicts have the
+same shape as the pipeline's output.
 """
 
 
 class ZeroShotClassifier:
-    def __init__(self, model_name="facebook/bart-large-mnli"):
-        self.classifier = pipeline("zero-shot-classification",
-                                   model=model_name)
+    def __init__(self, model_name="facebook/bart-large-mnli",
+                 batch_size=64, hypothesis_template="This example is {}.",
+                 revision=None, backend="torch", num_threads=None):
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.hypothesis_template = hypothesis_template
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name,
+                                                       revision=revision)
+        self.model = AutoModel.from_pretrained(model_name, revision=revision)
+        self.backend = load_backend(self.model, self.tokenizer, backend,
+                                    num_threads)
+        self.fingerprint = _model_fingerprint(model_name, revision,
+                                              self.model, backend)
+        self.fingerprint["hypothesis_template"] = hypothesis_template
+
+        # Same lookup the zero-shot pipeline uses to find the entailment logit
+        self.entailment_id = -1
+        for label, label_id in self.model.config.label2id.items():
+            if label.lower().startswith("entail"):
+                self.entailment_id = label_id
+                break
 
     def classify(self, text,
-                 labels=["inquiry", "goal", "complaint", "praise", "other"]):
-        results = self.classifier(text, labels)
+                 labels=CATEGORY_LABELS):
+        results = self.classify_batch([text], labels)
+        return results[0]
+
+    """
+    Classify many texts against the same labels in shared NLI batches.
+    """
+    def classify_batch(self, texts, labels=CATEGORY_LABELS, batch_size=None):
+        batch_size = batch_size or self.batch_size
+        if len(texts) == 0:
+            return []
+
+        hypotheses = [self.hypothesis_template.format(label)
+                      for label in labels]
+        premises = [text for text in texts for _ in labels]
+        input_ids = self.tokenizer(
+            premises, hypotheses * len(texts),
+            truncation="only_first")["input_ids"]
+        lengths = [len(ids) for ids in input_ids]
+
+        entail_logits = torch.empty(len(premises))
+        for batch in length_sorted_batches(lengths, batch_size):
+            encoded_input = self.tokenizer.pad(
+                {"input_ids": [input_ids[i] for i in batch]},
+                return_tensors='pt')
+            logits = self.backend(encoded_input)
+            entail_logits[batch] = logits[:, self.entailment_id]
+
+        # Softmax over the candidate labels of each message
+        scores = torch.nn.functional.softmax(
+            entail_logits.view(len(texts), len(labels)), dim=1)
+
+        results = []
+        for text, text_scores in zip(texts, scores.tolist()):
+            ranked = sorted(zip(labels, text_scores),
+                            key=lambda pair: pair[1], reverse=True)
+            results.append({
+                "sequence": text,
+                "labels": [label for label, _ in ranked],
+                "scores": [score for _, score in ranked]
+            })
         return results
 
 
@@ -35,21 +173,167 @@ This is done using a pre-trained sentiment analysis model.
 
 
 class SentimentAnalyzer:
-    def __init__(self, model_name="cardiffnlp/twitter-roberta-base-sentiment"):
-        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
-        self.model = AutoModel.from_pretrained(model_name)
+    def __init__(self, model_name="cardiffnlp/twitter-roberta-base-sentiment",
+                 batch_size=32, revision=None, backend="torch",
+                 num_threads=None):
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name,
+                                                       revision=revision)
+        self.model = AutoModel.from_pretrained(model_name, revision=revision)
+        self.backend = load_backend(self.model, self.tokenizer, backend,
+                                    num_threads)
+        self.fingerprint = _model_fingerprint(model_name, revision,
+                                              self.model, backend)
+        self.special_prefix, self.special_suffix = special_token_ids(
+            self.tokenizer)
+        self.max_input_tokens = (
+            min(self.tokenizer.model_max_length, MAX_MODEL_TOKENS)
+            - len(self.special_prefix) - len(self.special_suffix))
 
     def analyze_sentiment(self, text):
-        encoded_input = self.tokenizer(text, return_tensors='pt')
-        result = self.model(**encoded_input)
-        scores = result[0][0].detach().numpy()
-
-        normalized_scores = torch.nn.functional.softmax(
-            torch.tensor(scores), dim=0)
+        return self.analyze_batch([text])[0]
+
+    """
+    Tokenize texts without special tokens or truncation.
+    """
+    def encode(self, texts):
+        if len(texts) == 0:
+            return []
+        return self.tokenizer(list(texts),
+                              add_special_tokens=False)["input_ids"]
+
+    """
+    Analyze many texts at once. Texts are sorted by token length and padded
+    per batch; the softmaxed scores are returned in the original order.
+    """
+    def analyze_batch(self, texts, batch_size=None):
+        return self.analyze_encoded(self.encode(texts), batch_size)
+
+    """
+    Same as analyze_batch for texts that are already tokenized with encode.
+    Inputs longer than the model accepts are truncated.
+    """
+    def analyze_encoded(self, input_ids, batch_size=None):
+        batch_size = batch_size or self.batch_size
+        if len(input_ids) == 0:
+            return []
+
+        input_ids = [
+            self.special_prefix + list(ids[:self.max_input_tokens])
+            + self.special_suffix
+            for ids in input_ids
+        ]
+        lengths = [len(ids) for ids in input_ids]
+
+        normalized_scores = [None] * len(input_ids)
+        for batch in length_sorted_batches(lengths, batch_size):
+            encoded_input = self.tokenizer.pad(
+                {"input_ids": [input_ids[i] for i in batch]},
+                return_tensors='pt')
+            logits = self.backend(encoded_input)
+            scores = torch.nn.functional.softmax(logits, dim=1)
+            for i, row in zip(batch, scores):
+                normalized_scores[i] = row
         return normalized_scores
 
+    """
+    Whether analyze_threads can score threads in one encoder pass: the model
+    needs a head that reads the <s> position, and the backend has to run the
+    PyTorch model (ONNX sessions only return the logits).
+    """
+    def supports_thread_pass(self):
+        return (self.model.config.model_type in THREAD_POOLING_MODEL_TYPES
+                and isinstance(self.backend, TorchBackend)
+                and len(self.special_prefix) > 0)
+
+    """
+    Score every message of each thread from a single encoder pass over the
+    thread. Each message is wrapped in the special tokens it would get on
+    its own, the wrapped messages are packed into chunks that fit the model,
+    and the hidden state at each message's <s> position goes through the
+    classification head. Only the first message of a chunk sits at the
+    positions a single message would; later ones get shifted position ids,
+    and every message also attends to the rest of its chunk. A message
+    alone in its chunk, such as a thread of one, therefore scores the same
+    as analyze_encoded. The backend's model is used, so a quantized backend
+    applies here too; models or backends that cannot do this fall back to
+    analyze_encoded per message.
+
+    Takes one list of encoded messages per thread and returns one list of
+    softmaxed scores per thread.
+    """
+    def analyze_threads(self, threads_ids, batch_size=None):
+        batch_size = batch_size or self.batch_size
+        if not self.supports_thread_pass():
+            flat = self.analyze_encoded(
+                [ids for thread_ids in threads_ids for ids in thread_ids],
+                batch_size)
+            results, start = [], 0
+            for thread_ids in threads_ids:
+                results.append(flat[start:start + len(thread_ids)])
+                start += len(thread_ids)
+            return results
+
+        model = self.backend.model
+        max_chunk = (self.max_input_tokens + len(self.special_prefix)
+                     + len(self.special_suffix))
+
+        # Each chunk is (input_ids, [(thread, message, position)])
+        chunks = []
+        for t, thread_ids in enumerate(threads_ids):
+            chunk_ids, spans = [], []
+            for m, ids in enumerate(thread_ids):
+                wrapped = (self.special_prefix
+                           + list(ids[:self.max_input_tokens])
+                           + self.special_suffix)
+                if (len(spans) > 0 and
+                        len(chunk_ids) + len(wrapped) > max_chunk):
+                    chunks.append((chunk_ids, spans))
+                    chunk_ids, spans = [], []
+                spans.append((t, m, len(chunk_ids)))
+                chunk_ids = chunk_ids + wrapped
+            if len(spans) > 0:
+                chunks.append((chunk_ids, spans))
+
+        results = [[None] * len(thread_ids) for thread_ids in threads_ids]
+        lengths = [len(chunk_ids) for chunk_ids, _ in chunks]
+        for batch in length_sorted_batches(lengths, batch_size):
+            encoded_input = self.tokenizer.pad(
+                {"input_ids": [chunks[i][0] for i in batch]},
+                return_tensors='pt')
+            with torch.inference_mode():
+                hidden = model.base_model(
+                    input_ids=encoded_input["input_ids"],
+                    attention_mask=encoded_input["attention_mask"])[0]
+
+                rows, positions, owners = [], [], []
+                for row, i in enumerate(batch):
+                    for t, m, position in chunks[i][1]:
+                        rows.append(row)
+                        positions.append(position)
+                        owners.append((t, m))
+                features = hidden[rows, positions]
+                logits = model.classifier(features[:, None])
+                scores = torch.nn.functional.softmax(logits, dim=1)
+
+            for (t, m), row in zip(owners, scores):
+                results[t][m] = row
+        return results
+
+
+# Category classifiers ScoringPipeline can load by name
+CLASSIFIERS = {
+    "zero-shot": ZeroShotClassifier,
+    "embedding": EmbeddingClassifier,
+}
+
 
 class ScoredMessage:
+    __slots__ = ("message_text", "timestamp", "parent_thread_ts", "sentiment",
+                 "category", "reactions", "thread_sentiment", "index",
+                 "sentiment_scores")
+
     def __init__(self):
         self.message_text = None
         self.timestamp = None
@@ -57,9 +341,13 @@ class ScoredMessage:
         self.sentiment = None
         self.category = None
         self.reactions = None
+        self.thread_sentiment = None
+        # Row of the message in a MessageStore, if it came from one
+        self.index = None
+        self.sentiment_scores = None
 
     def to_dict(self):
-        return {
+        result = {
             "message_text": self.message_text,
             "timestamp": self.timestamp,
             "parent_thread_ts": self.parent_thread_ts,
@@ -67,75 +355,452 @@ class ScoredMessage:
             "category": self.category,
             "reactions": self.reactions
         }
+        # Only set when scoring whole threads in a single pass
+        if self.thread_sentiment is not None:
+            result["thread_sentiment"] = self.thread_sentiment
+        return result
 
 
 class ScoringPipeline:
-    def __init__(self, unscored_messages):
+    def __init__(self, unscored_messages, sentiment_analyzer=None,
+                 classifier=None, batch_size=32, workers=1, cache=None,
+                 backend="torch", num_threads=None, context_tokens=None,
+                 mode="message", cascade=None, classifier_type="zero-shot",
+                 dedup=None):
+        if mode not in SCORING_MODES:
+            raise ValueError(f"Unknown scoring mode '{mode}'. "
+                             f"Expected one of: {', '.join(SCORING_MODES)}")
+        if classifier_type not in CLASSIFIERS:
+            raise ValueError(f"Unknown classifier '{classifier_type}'. "
+                             f"Expected one of: {', '.join(CLASSIFIERS)}")
+        # A MessageStore records the scores in its columns instead of
+        # building a dictionary per kept message
+        self.store = None
+        if isinstance(unscored_messages, MessageStore):
+            self.store = unscored_messages
+            unscored_messages = self.store.group()
         self.unscored_messages = unscored_messages
         self.scored_messages = []
+        self.sentiment_analyzer = sentiment_analyzer
+        self.classifier = classifier
+        self.batch_size = batch_size
+        self.workers = workers
+        self.cache = cache
+        self.backend = backend
+        self.num_threads = num_threads
+        self.context_tokens = context_tokens
+        self.mode = mode
+        self.cascade = cascade
+        self.classifier_type = classifier_type
+        self.dedup = dedup
+
+    def load_models(self):
+        if self.sentiment_analyzer is None:
+            self.sentiment_analyzer = SentimentAnalyzer(
+                batch_size=self.batch_size, backend=self.backend,
+                num_threads=self.num_threads)
+        if self.classifier is None:
+            classifier_class = CLASSIFIERS[self.classifier_type]
+            self.classifier = classifier_class(
+                backend=self.backend, num_threads=self.num_threads)
 
     def score_messages(self):
-        sa = SentimentAnalyzer()
-        zcs = ZeroShotClassifier()
+        self.load_models()
 
         print("Scoring messages...")
 
-        for channel, threads in self.unscored_messages.items():
-            for thread_id, thread in threads.items():
-                if len(thread) == 0:
-                    continue
-
-                context = []
-                for message in thread:
-                    # Clustering algorithm
-                    # - if single message, run normally
-                    # - if part of thread, use previous text as context
-
-                    # Filtering algorithm
-                    # - if negative, keep no matter what
-                    # - if positive or neutral:
-                    #   - check categories
-                    #   - keep if any category is >= 0.5
-
-                    text = message.message_text
-                    if len(context) > 0:
-                        text = "\n".join(context) + "\n" + text
-
-                    # Analyze sentiment
-                    sentiments = ["negative", "neutral", "positive"]
-                    raw_sentiment_scores = sa.analyze_sentiment(text)
-                    sentiment_score_idx = np.argmax(raw_sentiment_scores)
-                    sentiment = sentiments[sentiment_score_idx]
-
-                    # Classify message
-                    raw_category_results = zcs.classify(text)
-                    category = raw_category_results['labels']
-                    scores = raw_category_results['scores']
-
-                    # Create ScoredMessage object
-                    scored_message = ScoredMessage()
-                    scored_message.message_text = text
-                    scored_message.timestamp = message.timestamp
-                    scored_message.parent_thread_ts = message.parent_thread_ts
-                    scored_message.sentiment = sentiment
-                    scored_message.category = category[0]
-                    scored_message.reactions = message.reactions
-
-                    if sentiment != "negative":
-                        if category[0] == "other" or scores[0] < 0.5:
-                            continue
-
-                    self.scored_messages.append(scored_message.to_dict())
-
-                    context.append(message.message_text)
+        threads = [
+            thread
+            for threads in self.unscored_messages.values()
+            for thread in threads.values()
+            if len(thread) > 0
+        ]
+        if self.workers > 1 and len(threads) > 1:
+            results = self._score_threads_parallel(threads)
+        else:
+            results = self._score_threads(threads)
+
+        for kept in results:
+            if self.store is not None:
+                self.store.record_scores(kept)
+            else:
+                self.scored_messages.extend(
+                    message.to_dict() for message in kept)
+        if self.store is not None:
+            self.scored_messages = self.store.scored_records()
+
+        if self.cache is not None:
+            stats = self.cache.stats()
+            print(f"Score cache: {stats['hits']} hits, "
+                  f"{stats['misses']} misses "
+                  f"({stats['hit_rate']:.0%} hit rate)")
+        if self.cascade is not None:
+            stats = self.cascade.stats()
+            print(f"Cascade: {stats['rejected']} of {stats['checked']} "
+                  f"positive/neutral messages dropped before zero-shot "
+                  f"classification ({stats['hit_rate']:.0%} hit rate)")
+        if self.dedup is not None:
+            stats = self.dedup.stats()
+            print(f"Dedup: {stats['collapsed']} of {stats['checked']} "
+                  f"context-free messages scored as duplicates")
 
         print("Scoring completed.")
         return self.scored_messages
 
+    """
+    Score a list of threads and return the kept ScoredMessages of each
+    thread.
+    """
+    def _score_threads(self, threads):
+        if self.mode == "thread":
+            return self._score_threads_single_pass(threads)
+        return self._score_threads_incremental(threads)
+
+    """
+    Score every message with its thread context as a prefix.
+
+    Which earlier messages end up in a reply's context depends on whether
+    they passed the filter, so threads are walked breadth-first: the n-th
+    message of every thread is scored in one batch once the first n - 1
+    messages of each thread have been filtered.
+    """
+    def _score_threads_incremental(self, threads):
+        tokenizer = self.sentiment_analyzer.tokenizer
+        max_tokens = self.sentiment_analyzer.max_input_tokens
+        if self.context_tokens is not None:
+            max_tokens = min(self.context_tokens, max_tokens)
+        contexts = [ThreadContext(tokenizer, max_tokens) for _ in threads]
+        kept = [[] for _ in threads]
+
+        depth = 0
+        active = list(range(len(threads)))
+        while len(active) > 0:
+            # Clustering algorithm
+            # - if single message, run normally
+            # - if part of thread, use previous text as context
+            messages = [threads[t][depth] for t in active]
+            message_ids = self.sentiment_analyzer.encode(
+                [message.message_text for message in messages])
+            texts, input_ids = [], []
+            for t, message, ids in zip(active, messages, message_ids):
+                text, ids = contexts[t].build(message.message_text, ids)
+                texts.append(text)
+                input_ids.append(ids)
+
+            # Thread roots have no context, so duplicates among them are
+            # scored once and their results fanned out to every copy
+            representatives = list(range(len(texts)))
+            if depth == 0 and self.dedup is not None:
+                representatives = self.dedup.group(texts)
+            unique = sorted(set(representatives))
+            position = {i: p for p, i in enumerate(unique)}
+
+            # Analyze sentiment
+            unique_scores = self._analyze_sentiment(
+                [texts[i] for i in unique], [input_ids[i] for i in unique])
+
+            # Classify messages
+            unique_results = self._classify_candidates(
+                [texts[i] for i in unique], [messages[i] for i in unique],
+                unique_scores)
+
+            raw_sentiment_scores = [unique_scores[position[r]]
+                                    for r in representatives]
+            raw_category_results = [unique_results[position[r]]
+                                    for r in representatives]
+
+            for t, message, ids, text, raw_scores, category_results in zip(
+                    active, messages, message_ids, texts,
+                    raw_sentiment_scores, raw_category_results):
+                if category_results is None:
+                    continue
+                scored_message = self._filter(message, text, raw_scores,
+                                              category_results)
+                if scored_message is not None:
+                    kept[t].append(scored_message)
+                    contexts[t].add(message.message_text, ids)
+
+            depth += 1
+            active = [t for t in active if len(threads[t]) > depth]
+
+        return kept
+
+    """
+    Score each thread as a unit: one encoder pass per thread chunk assigns
+    every message its sentiment, and each message is classified on its own
+    text. This is linear in the length of the thread instead of quadratic.
+    """
+    def _score_threads_single_pass(self, threads):
+        # Single-message threads have no context, so duplicates among them
+        # are scored once and their results fanned out to every copy
+        representatives = list(range(len(threads)))
+        if self.dedup is not None:
+            singles = [t for t, thread in enumerate(threads)
+                       if len(thread) == 1]
+            groups = self.dedup.group(
+                [threads[t][0].message_text for t in singles])
+            for t, r in zip(singles, groups):
+                representatives[t] = singles[r]
+        unique = sorted(set(representatives))
+        position = {t: p for p, t in enumerate(unique)}
+
+        messages = [message for t in unique for message in threads[t]]
+        texts = [message.message_text for message in messages]
+        flat_ids = self.sentiment_analyzer.encode(texts)
+
+        threads_ids, thread_texts, start = [], [], 0
+        for t in unique:
+            threads_ids.append(flat_ids[start:start + len(threads[t])])
+            thread_texts.append(texts[start:start + len(threads[t])])
+            start += len(threads[t])
+        unique_scores = self._analyze_threads(thread_texts, threads_ids)
+
+        flat_results = self._classify_candidates(
+            texts, messages,
+            [scores for thread in unique_scores for scores in thread])
+        unique_results, start = [], 0
+        for t in unique:
+            unique_results.append(flat_results[start:start + len(threads[t])])
+            start += len(threads[t])
+
+        kept = [[] for _ in threads]
+        for t, thread in enumerate(threads):
+            thread_scores = unique_scores[position[representatives[t]]]
+            thread_results = unique_results[position[representatives[t]]]
+            mean_scores = torch.stack(thread_scores).mean(dim=0)
+            thread_sentiment = SENTIMENTS[int(mean_scores.argmax())]
+
+            for message, raw_scores, category_results in zip(
+                    thread, thread_scores, thread_results):
+                if category_results is None:
+                    continue
+                scored_message = self._filter(message, message.message_text,
+                                              raw_scores, category_results)
+                if scored_message is not None:
+                    scored_message.thread_sentiment = thread_sentiment
+                    kept[t].append(scored_message)
+
+        return kept
+
+    """
+    Build the ScoredMessage for a message, or return None if the filter
+    drops it.
+    """
+    def _filter(self, message, text, raw_scores, category_results):
+        sentiment = SENTIMENTS[int(raw_scores.argmax())]
+        category = category_results['labels']
+        scores = category_results['scores']
+
+        # Filtering algorithm
+        # - if negative, keep no matter what
+        # - if positive or neutral:
+        #   - check categories
+        #   - keep if any category is >= 0.5
+        if sentiment != "negative":
+            if category[0] == "other" or scores[0] < 0.5:
+                return None
+
+        # Create ScoredMessage object
+        scored_message = ScoredMessage()
+        scored_message.message_text = text
+        scored_message.timestamp = message.timestamp
+        scored_message.parent_thread_ts = message.parent_thread_ts
+        scored_message.sentiment = sentiment
+        scored_message.category = category[0]
+        scored_message.reactions = message.reactions
+        scored_message.index = getattr(message, "index", None)
+        scored_message.sentiment_scores = raw_scores.tolist()
+        return scored_message
+
+    """
+    Classify texts, except for positive/neutral messages that the cascade
+    confidently rejects as bare acknowledgements. Those get None instead of
+    a result and are dropped like the "other" category they would almost
+    always get, which changes the report only where the classifier would
+    have found a category in an acknowledgement. The cascade
+    looks at the same text the classifier would get, thread context
+    included, so a short reply is only dropped when its context is small
+    talk too.
+    """
+    def _classify_candidates(self, texts, messages, raw_sentiment_scores):
+        candidates = []
+        for i, raw_scores in enumerate(raw_sentiment_scores):
+            negative = SENTIMENTS[int(raw_scores.argmax())] == "negative"
+            if (self.cascade is None or negative
+                    or not self.cascade.is_small_talk(texts[i])):
+                candidates.append(i)
+
+        results = [None] * len(texts)
+        if len(candidates) > 0:
+            classified = self._classify([texts[i] for i in candidates])
+            for i, result in zip(candidates, classified):
+                results[i] = result
+        return results
+
+    def _analyze_sentiment(self, texts, input_ids):
+        def analyze(indices):
+            scores = self.sentiment_analyzer.analyze_encoded(
+                [input_ids[i] for i in indices], batch_size=self.batch_size)
+            return [row.tolist() for row in scores]
+
+        if self.cache is None:
+            return self.sentiment_analyzer.analyze_encoded(
+                input_ids, batch_size=self.batch_size)
+        results = self._cached(
+            texts, analyze, "sentiment", self.sentiment_analyzer.fingerprint)
+        return [torch.tensor(scores) for scores in results]
+
+    """
+    Per-message sentiment of whole threads. A message's scores depend on the
+    rest of its thread, so the cache key is the thread's texts. Without a
+    single-pass capable model the messages are scored one by one, through
+    the per-message cache.
+    """
+    def _analyze_threads(self, thread_texts, threads_ids):
+        if not self.sentiment_analyzer.supports_thread_pass():
+            flat = self._analyze_sentiment(
+                [text for texts in thread_texts for text in texts],
+                [ids for thread_ids in threads_ids for ids in thread_ids])
+            results, start = [], 0
+            for texts in thread_texts:
+                results.append(flat[start:start + len(texts)])
+                start += len(texts)
+            return results
+
+        def analyze(indices):
+            results = self.sentiment_analyzer.analyze_threads(
+                [threads_ids[i] for i in indices],
+                batch_size=self.batch_size)
+            return [[row.tolist() for row in thread] for thread in results]
+
+        if self.cache is None:
+            return self.sentiment_analyzer.analyze_threads(
+                threads_ids, batch_size=self.batch_size)
+        results = self._cached(thread_texts, analyze, "thread-sentiment",
+                               self.sentiment_analyzer.fingerprint)
+        return [[torch.tensor(scores) for scores in thread]
+                for thread in results]
+
+    def _classify(self, texts):
+        def classify(indices):
+            results = self.classifier.classify_batch(
+                [texts[i] for i in indices], CATEGORY_LABELS)
+            return [{"labels": result["labels"], "scores": result["scores"]}
+                    for result in results]
+
+        if self.cache is None:
+            return self.classifier.classify_batch(texts, CATEGORY_LABELS)
+        return self._cached(texts, classify, "category",
+                            self.classifier.fingerprint, CATEGORY_LABELS)
+
+    """
+    Look texts up in the score cache and only run compute on the indices of
+    distinct texts that are missing, storing their results for the next run.
+    """
+    def _cached(self, texts, compute, *key_parts):
+        keys = [ScoreCache.make_key(*key_parts, text) for text in texts]
+        results = self.cache.get_many(keys)
+
+        missing = {}
+        for i, key in enumerate(keys):
+            if key not in results:
+                missing.setdefault(key, i)
+        if len(missing) > 0:
+            computed = dict(zip(missing, compute(list(missing.values()))))
+            self.cache.put_many(computed)
+            results.update(computed)
+
+        return [results[key] for key in keys]
+
+    """
+    Score threads in a pool of forked worker processes, one shard of whole
+    threads per worker. Results are merged back in the input thread order.
+    """
+    def _score_threads_parallel(self, threads):
+        global _worker_pipeline, _worker_threads
+
+        if "fork" not in multiprocessing.get_all_start_methods():
+            print("Warning: parallel scoring requires the fork start method."
+                  " Scoring in a single process instead.")
+            return self._score_threads(threads)
+
+        shards = shard_threads(threads, self.workers)
+        num_threads = max(1, (os.cpu_count() or 1) // len(shards))
+
+        _worker_pipeline = self
+        _worker_threads = threads
+        try:
+            context = multiprocessing.get_context("fork")
+            with context.Pool(len(shards), initializer=_init_scoring_worker,
+                              initargs=(num_threads,)) as pool:
+                shard_results = pool.map(_score_shard, shards)
+        finally:
+            _worker_pipeline = None
+            _worker_threads = None
+
+        kept = [None] * len(threads)
+        for shard, (results, counters) in zip(shards, shard_results):
+            for t, thread_kept in zip(shard, results):
+                kept[t] = thread_kept
+            self._add_counters(counters)
+        return kept
+
+    """
+    Snapshot the cache and cascade counters, so that the counts of forked
+    workers can be added back to the parent's.
+    """
+    def _counters(self):
+        counters = {}
+        for name, component in (("cache", self.cache),
+                                ("cascade", self.cascade),
+                                ("dedup", self.dedup)):
+            if component is not None:
+                for field in component.COUNTERS:
+                    counters[(name, field)] = getattr(component, field)
+        return counters
+
+    def _add_counters(self, counters):
+        components = {"cache": self.cache, "cascade": self.cascade,
+                      "dedup": self.dedup}
+        for (name, field), delta in counters.items():
+            component = components[name]
+            setattr(component, field, getattr(component, field) + delta)
+
     def save_scored_json(self):
         pass
 
 
+"""
+Keyword arguments for ScoringPipeline from the environment:
+
+- SCORING_WORKERS, SCORING_MODE, CONTEXT_TOKENS
+- SCORE_CACHE_PATH, SCORE_CACHE_MAX_ENTRIES
+- SCORING_CASCADE, SCORING_DEDUP, CATEGORY_CLASSIFIER
+- INFERENCE_BACKEND, INFERENCE_THREADS
+"""
+
+
+def scoring_options_from_env():
+    cache = None
+    if os.getenv("SCORE_CACHE_PATH"):
+        cache = ScoreCache(
+            os.getenv("SCORE_CACHE_PATH"),
+            max_entries=int(os.getenv("SCORE_CACHE_MAX_ENTRIES", "500000")))
+    num_threads = os.getenv("INFERENCE_THREADS")
+    context_tokens = os.getenv("CONTEXT_TOKENS")
+    return {
+        "workers": int(os.getenv("SCORING_WORKERS", "1")),
+        "cache": cache,
+        "context_tokens": int(context_tokens) if context_tokens else None,
+        "mode": os.getenv("SCORING_MODE", "message"),
+        "cascade": SmallTalkFilter() if os.getenv("SCORING_CASCADE") else None,
+        "classifier_type": os.getenv("CATEGORY_CLASSIFIER", "zero-shot"),
+        "dedup": Deduplicator() if os.getenv("SCORING_DEDUP") else None,
+        "backend": os.getenv("INFERENCE_BACKEND", "torch"),
+        "num_threads": int(num_threads) if num_threads else None,
+    }
+
+
 def main():
     if len(sys.argv) != 3:
         print("Usage: python scoring.py <input_path> <output_path>")
@@ -144,21 +809,22 @@ def main():
     input_path = sys.argv[1]
     output_path = sys.argv[2]
 
-    mp = MessageParser(input_path)
-    mp.load_messages()
-    unscored = mp.group_messages()
-
-    sp = ScoringPipeline(unscored)
+    # Only normalizes extraction records given directly, since
+    # preprocessing's output is normalized already
+    normalize = os.getenv("NORMALIZE_TEXT", "1") != "0"
+    mp = MessageParser(input_path,
+                       normalizer=TextNormalizer() if normalize else None)
+    # With PREPROCESS_STATE_PATH set, preprocessing's output only holds the
+    # threads that changed since its last run, so that is all that gets
+    # scored. Only preprocessing advances the watermarks.
+    unscored = mp.load_store()
+
+    sp = ScoringPipeline(unscored, **scoring_options_from_env())
     scored = sp.score_messages()
 
-    # Save scored messages to JSON
-    # Get file path
-    output_path = Path(output_path)
-    output_path.parent.mkdir(parents=True, exist_ok=True)
-
-    # Save scored messages to JSON file
-    with open(output_path, 'w') as f:
-        json.dump(scored, f, indent=4)
+    # Save scored messages as a compact stage file (.jsonl[.gz|.zst]) or,
+    # for any other path, as pretty-printed JSON
+    write_records(output_path, "scored", scored)
     print(f"Scored messages saved to {output_path}")
 
 
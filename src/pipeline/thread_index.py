@@ -0,0 +1,128 @@
+import bisect
+
+"""
+An index of messages by thread.
+
+Slack's conversations_history lists messages newest first, so threads
+grouped in file order would reach the scorer with replies before their
+parents. The index keeps every thread sorted by timestamp whatever order the
+messages arrive in.
+
+- get(channel_id, parent_thread_ts) looks a thread up in O(1)
+- threads() and grouped() iterate channels in first-seen order and the
+  threads of each channel by root timestamp
+- window(start, end) returns only the messages in a time range, without
+  regrouping the rest
+"""
+
+
+def _timestamp(message):
+    return message.timestamp
+
+
+def _thread_start(parent_thread_ts):
+    return float(parent_thread_ts)
+
+
+class ThreadIndex:
+    def __init__(self):
+        self._channels = {}
+        self._threads = {}
+        # Every message, sorted by timestamp on the first window() after
+        # an add. Only built once window() is called
+        self._timeline = None
+        self._timeline_sorted = True
+
+    @classmethod
+    def from_messages(cls, messages):
+        index = cls()
+        index.add_many(messages)
+        return index
+
+    def add(self, message):
+        key = (message.channel_id, message.parent_thread_ts)
+        thread = self._threads.get(key)
+        if thread is None:
+            thread = []
+            self._threads[key] = thread
+            channel = self._channels.setdefault(message.channel_id, {})
+            channel[message.parent_thread_ts] = thread
+        # Newest-first exports insert at the front, which is cheap for the
+        # short lists threads are; equal timestamps keep arrival order
+        bisect.insort(thread, message, key=_timestamp)
+
+        if self._timeline is None:
+            return
+        if (self._timeline_sorted and len(self._timeline) > 0
+                and message.timestamp < self._timeline[-1].timestamp):
+            self._timeline_sorted = False
+        self._timeline.append(message)
+
+    def add_many(self, messages):
+        for message in messages:
+            self.add(message)
+
+    def get(self, channel_id, parent_thread_ts):
+        return self._threads.get((channel_id, parent_thread_ts))
+
+    def __contains__(self, key):
+        return key in self._threads
+
+    def __len__(self):
+        return len(self._threads)
+
+    def channels(self):
+        return list(self._channels)
+
+    """
+    Yield ((channel_id, parent_thread_ts), thread) pairs in order.
+    """
+    def threads(self, channel_id=None):
+        channel_ids = self._channels if channel_id is None else [channel_id]
+        for channel_id in channel_ids:
+            channel = self._channels.get(channel_id, {})
+            for parent_ts in sorted(channel, key=_thread_start):
+                yield (channel_id, parent_ts), channel[parent_ts]
+
+    """
+    Return the threads as {channel_id: {parent_thread_ts: [messages]}}, the
+    shape ScoringPipeline takes.
+    """
+    def grouped(self):
+        grouped = {}
+        for (channel_id, parent_ts), thread in self.threads():
+            grouped.setdefault(channel_id, {})[parent_ts] = thread
+        return grouped
+
+    """
+    Return the messages with start <= timestamp < end, grouped like
+    grouped(). Either bound may be None for an open range.
+    """
+    def window(self, start=None, end=None):
+        if self._timeline is None:
+            self._timeline = [message for thread in self._threads.values()
+                              for message in thread]
+            self._timeline_sorted = False
+        if not self._timeline_sorted:
+            self._timeline.sort(key=_timestamp)
+            self._timeline_sorted = True
+
+        lo, hi = 0, len(self._timeline)
+        if start is not None:
+            lo = bisect.bisect_left(self._timeline, start, key=_timestamp)
+        if end is not None:
+            hi = bisect.bisect_left(self._timeline, end, key=_timestamp)
+
+        threads = {}
+        for message in self._timeline[lo:hi]:
+            channel = threads.setdefault(message.channel_id, {})
+            channel.setdefault(message.parent_thread_ts, []).append(message)
+
+        grouped = {}
+        for channel_id in self._channels:
+            if channel_id in threads:
+                channel = threads[channel_id]
+                grouped[channel_id] = {
+                    parent_ts: channel[parent_ts]
+                    for parent_ts in sorted(channel, key=_thread_start)}
+        return grouped
@@ -0,0 +1,378 @@
+import json
+import os
+import time
+import uuid
+
+"""
+Completion-driven chaining of the pipeline stages.
+
+The slash-command Lambda only starts the extraction stage and records the
+run in S3. Each stage writes its output under its own prefix, and that
+write is the stage's "done" event: the stage-router Lambda receives the S3
+ObjectCreated notification and immediately enqueues the next stage with the
+new key as its input. Stages that do not write to S3 can call stage_done()
+directly.
+
+extraction -> ml -> insights -> pdf (then the slack-pdf-delivery Lambda)
+
+Output keys follow <prefix>/<team_id>/<run_id>_<suffix>, where run_id is
+the UTC timestamp the run was started at.
+
+Runs are deduplicated per team: a request claims the team's active run
+with a conditional S3 write, and later requests are attached to the claimed
+run instead of starting another full pipeline, as long as the run started
+less than the dedupe window ago, has not been delivered and has not
+stalled. A run stalls when none of its stages reported output for the stall
+timeout, e.g. because a stage failed; stage_done records each stage's
+progress in the run record. Otherwise the claim is taken over,
+again conditionally, by a new run.
+
+The slack-pdf-delivery Lambda marks a run delivered before it lists the
+attached requests and posts the report to their channels too. A request
+checks the mark after attaching itself, so it is either listed by the
+delivery or starts a new run.
+"""
+
+STAGES = ["extraction", "ml", "insights", "pdf"]
+
+OUTPUT_PREFIXES = {
+    "extraction": "extractions",
+    "ml": "preprocessed",
+    "insights": "insights",
+    "pdf": "reports",
+}
+OUTPUT_SUFFIXES = {
+    "extraction": "messages.jsonl.gz",
+    "ml": "preprocessed.jsonl.gz",
+    "insights": "insights.json",
+    "pdf": "report.pdf",
+}
+# Names written before the compact stage format. Stages are told where to
+# write through the output_key of their queue message, but containers that
+# still write these names keep chaining until they are redeployed
+LEGACY_OUTPUT_SUFFIXES = {
+    "extraction": "messages.json",
+    "ml": "preprocessed.json",
+}
+
+# Environment variable and default URL of each stage's queue
+QUEUE_URLS = {
+    "extraction": ("QUEUE_URL", None),
+    "ml": ("ML_QUEUE_URL", "https://sqs.us-east-2.amazonaws.com/"
+                           "822218735328/ml-processing-queue"),
+    "insights": ("INSIGHTS_QUEUE_URL", "https://sqs.us-east-2.amazonaws.com/"
+                                       "822218735328/insights-processing-"
+                                       "queue"),
+    "pdf": ("PDF_QUEUE_URL", "https://sqs.us-east-2.amazonaws.com/"
+                             "822218735328/pdf-processing-queue"),
+}
+
+DEFAULT_BUCKET = "slack-message-extract"
+RUNS_PREFIX = "runs"
+DEFAULT_DEDUPE_WINDOW = 900
+DEFAULT_STALL_TIMEOUT = 600
+
+
+def results_bucket():
+    return os.environ.get("RESULTS_BUCKET", DEFAULT_BUCKET)
+
+
+def dedupe_window():
+    return float(os.environ.get("RUN_DEDUPE_WINDOW_SECONDS",
+                                DEFAULT_DEDUPE_WINDOW))
+
+
+def stall_timeout():
+    return float(os.environ.get("RUN_STALL_TIMEOUT_SECONDS",
+                                DEFAULT_STALL_TIMEOUT))
+
+
+def queue_url(stage):
+    name, default = QUEUE_URLS[stage]
+    url = os.environ.get(name, default)
+    if url is None:
+        raise KeyError(f"{name} is not set")
+    return url
+
+
+def output_key(stage, team_id, run_id):
+    return (f"{OUTPUT_PREFIXES[stage]}/{team_id}/"
+            f"{run_id}_{OUTPUT_SUFFIXES[stage]}")
+
+
+def run_key(team_id, run_id):
+    return f"{RUNS_PREFIX}/{team_id}/{run_id}.json"
+
+
+def claim_key(team_id):
+    return f"{RUNS_PREFIX}/{team_id}/active.json"
+
+
+def delivered_key(team_id, run_id):
+    return f"{RUNS_PREFIX}/{team_id}/{run_id}/delivered.json"
+
+
+def requests_prefix(team_id, run_id):
+    return f"{RUNS_PREFIX}/{team_id}/{run_id}/requests/"
+
+
+def next_stage(stage):
+    index = STAGES.index(stage)
+    return STAGES[index + 1] if index + 1 < len(STAGES) else None
+
+
+"""
+Return (stage, team_id, run_id) for the output key of a stage, or None for
+keys outside the pipeline's prefixes.
+"""
+
+
+def parse_output_key(key):
+    parts = key.split("/")
+    if len(parts) != 3:
+        return None
+    prefix, team_id, name = parts
+    for stage in STAGES:
+        if prefix != OUTPUT_PREFIXES[stage]:
+            continue
+        for suffix in (OUTPUT_SUFFIXES[stage],
+                       LEGACY_OUTPUT_SUFFIXES.get(stage)):
+            if suffix and name.endswith("_" + suffix):
+                return stage, team_id, name[:-len(suffix) - 1]
+    return None
+
+
+"""
+Build the queue message that starts a stage, in the format each stage's
+container consumes.
+"""
+
+
+def stage_message(stage, run, input_key=None):
+    team_id, run_id = run["team_id"], run["run_id"]
+    common = {
+        "team_id": team_id,
+        "run_id": run_id,
+        "extraction_timestamp": run_id,
+        "trigger_source": run.get("trigger_source", "slack_command"),
+        "output_key": output_key(stage, team_id, run_id),
+    }
+    request = run.get("original_request", {})
+    if stage == "extraction":
+        return dict(common, channel_id=request.get("channel_id"),
+                    user_id=request.get("user_id"),
+                    response_url=request.get("response_url"),
+                    timestamp=run.get("requested_at"))
+    if stage == "ml":
+        return dict(common, s3_key=input_key, original_request=request)
+    return dict(common, bucket=run.get("bucket", results_bucket()),
+                key=input_key)
+
+
+def send_stage_message(sqs, stage, run, input_key=None):
+    response = sqs.send_message(
+        QueueUrl=queue_url(stage),
+        MessageBody=json.dumps(stage_message(stage, run, input_key)))
+    print(f"Started {stage} stage of run {run['run_id']}: "
+          f"{response['MessageId']}")
+    return response
+
+
+"""
+Record a run in S3, so that later stages can be chained from output keys
+alone, and enqueue its extraction stage. With a thread pool, both requests
+are made at the same time.
+"""
+
+
+def start_run(sqs, s3, run, pool=None):
+    run = dict(run, bucket=run.get("bucket", results_bucket()))
+
+    def put_run():
+        s3.put_object(Bucket=run["bucket"],
+                      Key=run_key(run["team_id"], run["run_id"]),
+                      Body=json.dumps(run).encode("utf-8"),
+                      ContentType="application/json")
+
+    if pool is None:
+        put_run()
+        return send_stage_message(sqs, "extraction", run)
+    put = pool.submit(put_run)
+    response = send_stage_message(sqs, "extraction", run)
+    put.result()
+    return response
+
+
+"""
+Whether a claimed run has stalled: none of its stages reported output,
+through stage_done, for the stall timeout.
+"""
+
+
+def stalled(claim, run, now, stall):
+    progress = [claim["claimed_at"]] + list(run.get("progress", {}).values())
+    return now - max(progress) >= stall
+
+
+def attach_request(s3, run, claimed):
+    key = (requests_prefix(run["team_id"], claimed) +
+           f"{uuid.uuid4().hex}.json")
+    request = dict(run.get("original_request", {}),
+                   requested_at=run.get("requested_at"))
+    s3.put_object(Bucket=run["bucket"], Key=key,
+                  Body=json.dumps(request).encode("utf-8"),
+                  ContentType="application/json")
+    return key
+
+
+"""
+Start run unless its team has a run that can still be joined, in which case
+run's original request is attached to that run. Returns the run that will
+answer the request and whether it was started now. A window of 0 turns
+deduplication off.
+"""
+
+
+def request_run(sqs, s3, run, now=None, window=None, pool=None, stall=None):
+    window = dedupe_window() if window is None else window
+    if window <= 0:
+        start_run(sqs, s3, run, pool=pool)
+        return run, True
+
+    run = dict(run, bucket=run.get("bucket", results_bucket()))
+    bucket, team_id = run["bucket"], run["team_id"]
+    now = time.time() if now is None else now
+    stall = stall_timeout() if stall is None else stall
+    key = claim_key(team_id)
+    body = json.dumps({"run_id": run["run_id"], "claimed_at": now})
+    condition = {"IfNoneMatch": "*"}
+    while True:
+        try:
+            s3.put_object(Bucket=bucket, Key=key, Body=body,
+                          ContentType="application/json", **condition)
+            break
+        except s3.exceptions.ClientError as e:
+            # PreconditionFailed when the claim exists or was replaced,
+            # ConditionalRequestConflict when it is being written at the
+            # same time
+            if e.response["Error"]["Code"] not in (
+                    "PreconditionFailed", "ConditionalRequestConflict"):
+                raise
+        response = s3.get_object(Bucket=bucket, Key=key)
+        claim = json.loads(response["Body"].read())
+        # Take the claim over only if nobody else has in the meantime
+        condition = {"IfMatch": response["ETag"]}
+        if now - claim["claimed_at"] >= window:
+            continue
+
+        # Attach while the run record is read, since runs are rarely
+        # stalled, and undo the attachment when it is
+        claimed = claim["run_id"]
+        if pool is None:
+            active = load_run(s3, bucket, team_id, claimed)
+            request_key = attach_request(s3, run, claimed)
+        else:
+            loading = pool.submit(load_run, s3, bucket, team_id, claimed)
+            request_key = attach_request(s3, run, claimed)
+            active = loading.result()
+        if stalled(claim, active, now, stall):
+            print(f"Run {claimed} of {team_id} has stalled, starting a new "
+                  f"one")
+            s3.delete_object(Bucket=bucket, Key=request_key)
+            continue
+        if run_delivered(s3, bucket, team_id, claimed):
+            # The delivery has listed the attached requests already, maybe
+            # without this one
+            s3.delete_object(Bucket=bucket, Key=request_key)
+            continue
+        print(f"Attached request to run {claimed} of {team_id}")
+        return active, False
+
+    start_run(sqs, s3, run, pool=pool)
+    return run, True
+
+
+"""
+Return the original requests of the duplicate commands attached to a run.
+"""
+
+
+def attached_requests(s3, bucket, team_id, run_id):
+    requests = []
+    paginator = s3.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket,
+                                   Prefix=requests_prefix(team_id, run_id)):
+        for item in page.get("Contents", []):
+            response = s3.get_object(Bucket=bucket, Key=item["Key"])
+            requests.append(json.loads(response["Body"].read()))
+    return requests
+
+
+"""
+Mark a run as delivered. Requests attached after this start a new run.
+"""
+
+
+def mark_delivered(s3, bucket, team_id, run_id):
+    s3.put_object(Bucket=bucket, Key=delivered_key(team_id, run_id),
+                  Body=json.dumps({"delivered_at": time.time()}),
+                  ContentType="application/json")
+
+
+def run_delivered(s3, bucket, team_id, run_id):
+    return last_modified(s3, bucket,
+                         delivered_key(team_id, run_id)) is not None
+
+
+"""
+Return the time an object was last written, or None when it does not exist.
+"""
+
+
+def last_modified(s3, bucket, key):
+    try:
+        response = s3.head_object(Bucket=bucket, Key=key)
+    except s3.exceptions.ClientError as e:
+        if e.response["Error"]["Code"] in ("404", "NoSuchKey"):
+            return None
+        raise
+    return response["LastModified"].timestamp()
+
+
+def load_run(s3, bucket, team_id, run_id):
+    try:
+        response = s3.get_object(Bucket=bucket, Key=run_key(team_id, run_id))
+    except s3.exceptions.NoSuchKey:
+        print(f"Warning: no record of run {team_id}/{run_id}")
+        return {"team_id": team_id, "run_id": run_id, "bucket": bucket}
+    return json.loads(response["Body"].read())
+
+
+"""
+Handle the "done" event of a stage whose output was written to bucket/key:
+record the stage's progress in the run record, so that requests can tell
+the run has not stalled, and enqueue the next stage with that key as its
+input. Returns the next stage, or None when the key is not a stage output
+or the pipeline is complete.
+"""
+
+
+def stage_done(sqs, s3, bucket, key, now=None):
+    parsed = parse_output_key(key)
+    if parsed is None:
+        print(f"Ignoring {key}: not a pipeline stage output")
+        return None
+    stage, team_id, run_id = parsed
+    run = load_run(s3, bucket, team_id, run_id)
+    progress = dict(run.get("progress", {}))
+    progress[stage] = time.time() if now is None else now
+    run = dict(run, progress=progress)
+    s3.put_object(Bucket=bucket, Key=run_key(team_id, run_id),
+                  Body=json.dumps(run).encode("utf-8"),
+                  ContentType="application/json")
+
+    following = next_stage(stage)
+    if following is None:
+        return None
+    send_stage_message(sqs, following, run, input_key=key)
+    return following
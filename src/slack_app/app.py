@@ -3,6 +3,7 @@ from slack_bolt import App
 from slack_bolt.adapter.socket_mode import SocketModeHandler
 from dotenv import load_dotenv
 from src.slack_app.handlers import register_handlers
+from src.slack_app.jobs import JobExecutor
 
 load_dotenv()
 
@@ -10,7 +11,12 @@ SLACK_BOT_TOKEN = os.getenv("SLACK_BOT_TOKEN")
 SLACK_APP_TOKEN = os.getenv("SLACK_APP_TOKEN")
 
 app = App(token=SLACK_BOT_TOKEN)
-register_handlers(app, app.client)
+# Extractions run on their own workers so that listeners only ack
+executor = JobExecutor(
+    max_workers=int(os.getenv("JOB_WORKERS", "2")),
+    max_queued=int(os.getenv("JOB_QUEUE_SIZE", "20")),
+    coalesce_window=float(os.getenv("RUN_DEDUPE_WINDOW_SECONDS", "900")))
+register_handlers(app, app.client, executor)
 
 if __name__ == "__main__":
     handler = SocketModeHandler(app, SLACK_APP_TOKEN)
@@ -0,0 +1,71 @@
+import json
+import os
+from pathlib import Path
+
+import boto3
+from botocore.exceptions import ClientError
+
+"""
+Stores for extraction checkpoints: the newest message ts extracted from each
+channel, as a {channel_id: ts} mapping under "cursors", and the threads still
+open in each channel under "threads".
+
+Later runs start conversations.history from the checkpoint (minus a look-back
+window for recently edited messages) instead of fetching the whole history.
+The checkpoints live in a local JSON file, or in an S3 object when the
+extraction runs in a container.
+"""
+
+
+class LocalCursorStore:
+    def __init__(self, path):
+        self.path = Path(path)
+
+    def load(self):
+        if not self.path.exists():
+            return {}
+        with self.path.open("r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def save(self, cursors):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        with tmp_path.open("w", encoding="utf-8") as f:
+            json.dump(cursors, f)
+        os.replace(tmp_path, self.path)
+
+
+class S3CursorStore:
+    def __init__(self, bucket, key, s3_client=None):
+        self.bucket = bucket
+        self.key = key
+        self.s3 = s3_client or boto3.client("s3")
+
+    def load(self):
+        try:
+            response = self.s3.get_object(Bucket=self.bucket, Key=self.key)
+        except ClientError as e:
+            if e.response["Error"]["Code"] == "NoSuchKey":
+                return {}
+            raise
+        return json.loads(response["Body"].read())
+
+    def save(self, cursors):
+        self.s3.put_object(Bucket=self.bucket, Key=self.key,
+                           Body=json.dumps(cursors).encode("utf-8"),
+                           ContentType="application/json")
+
+
+"""
+Return the cursor store for a location: s3://bucket/key for S3, anything
+else is a local path. Returns None when location is empty.
+"""
+
+
+def cursor_store(location):
+    if not location:
+        return None
+    if location.startswith("s3://"):
+        bucket, _, key = location[len("s3://"):].partition("/")
+        return S3CursorStore(bucket, key)
+    return LocalCursorStore(location)
@@ -0,0 +1,408 @@
+import asyncio
+import time
+
+from slack_sdk.errors import SlackApiError
+from slack_sdk.web.async_client import AsyncWebClient
+from src.slack_app.client import format_message
+
+"""
+Concurrent extraction of channel history with slack_sdk's async client.
+
+Channels are fetched in parallel, up to a fixed number at a time. Every
+API call first takes a token from the bucket of its method, refilled at
+the method's tier limit, so that concurrency never turns into a burst of
+rate-limited calls. When Slack still answers 429, the Retry-After delay
+pauses the whole bucket before the call is retried.
+
+Records are yielded as their pages arrive instead of after the last
+channel is done.
+
+conversations.history only returns thread parents, so parents with replies
+are queued for a pool of reply workers that page through
+conversations.replies. Their replies join the same record stream.
+
+Given checkpoints from an earlier run, history is only fetched from each
+channel's newest ts minus a look-back window, so that messages edited since
+the last run are fetched again. New replies do not bring their parent back
+into the channel history, so the checkpoints also remember the threads that
+had replies within THREAD_WINDOW of the newest message. Those threads are
+hydrated again on later runs, from the same look-back bound, until they go
+quiet.
+"""
+
+# Requests per minute for the Slack API tier of each method, see
+# https://api.slack.com/apis/rate-limits
+TIER_LIMITS = {
+    "conversations.list": 20,
+    "conversations.history": 50,
+    "conversations.replies": 50,
+}
+DEFAULT_TIER_LIMIT = 20
+
+# Threads without replies for this long are no longer hydrated again
+THREAD_WINDOW = 7 * 86400
+
+# Marks the end of the record stream
+_DONE = object()
+
+
+class _ChannelDone:
+    """Queued after the last record of a channel, replies included"""
+    def __init__(self, channel_id):
+        self.channel_id = channel_id
+
+
+class TokenBucket:
+    def __init__(self, rate_per_minute, capacity=None, clock=time.monotonic):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity or max(1, rate_per_minute // 10)
+        self.clock = clock
+        self._tokens = float(self.capacity)
+        self._updated = clock()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now):
+        elapsed = max(0.0, now - self._updated)
+        self._tokens = min(self.capacity, self._tokens + elapsed * self.rate)
+        self._updated = now
+
+    """
+    Wait until a token is available and take it. Waiters are served in
+    arrival order.
+    """
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = self.clock()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._refill(now)
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    """
+    Hand out no tokens for the next seconds, as asked by a Retry-After
+    header.
+    """
+    def pause(self, seconds):
+        now = self.clock()
+        self._paused_until = max(self._paused_until, now + seconds)
+        self._refill(now)
+        self._tokens = 0.0
+
+
+class RateLimiter:
+    def __init__(self, limits=None, max_retries=5):
+        self.limits = dict(TIER_LIMITS if limits is None else limits)
+        self.max_retries = max_retries
+        self.buckets = {}
+        self.retries = 0
+
+    def bucket(self, method):
+        if method not in self.buckets:
+            rate = self.limits.get(method, DEFAULT_TIER_LIMIT)
+            self.buckets[method] = TokenBucket(rate)
+        return self.buckets[method]
+
+    """
+    Call an async Web API method under its bucket, retrying rate-limited
+    calls after their Retry-After delay.
+    """
+    async def call(self, method, func, **kwargs):
+        bucket = self.bucket(method)
+        attempt = 0
+        while True:
+            await bucket.acquire()
+            try:
+                return await func(**kwargs)
+            except SlackApiError as e:
+                response = e.response
+                status = getattr(response, "status_code", None)
+                if status != 429 or attempt >= self.max_retries:
+                    raise
+                retry_after = float(
+                    response.headers.get("Retry-After", 1))
+                print(f"Rate limited on {method}, retrying in "
+                      f"{retry_after:.0f}s")
+                bucket.pause(retry_after)
+                attempt += 1
+                self.retries += 1
+
+
+class ChannelExtractor:
+    def __init__(self, client: AsyncWebClient, limiter=None, concurrency=8,
+                 page_size=200, hydrate_replies=True, reply_concurrency=8,
+                 cursors=None, lookback=86400, open_threads=None,
+                 thread_window=THREAD_WINDOW):
+        self.client = client
+        self.limiter = limiter or RateLimiter()
+        self.concurrency = concurrency
+        self.page_size = page_size
+        self.hydrate_replies = hydrate_replies
+        self.reply_concurrency = reply_concurrency
+        # Newest ts extracted per channel, updated as pages arrive
+        self.cursors = dict(cursors or {})
+        self.lookback = lookback
+        # {channel_id: {thread_ts: latest_reply}} of threads to hydrate
+        # again
+        self.open_threads = {channel_id: dict(threads) for channel_id, threads
+                             in (open_threads or {}).items()}
+        self.thread_window = thread_window
+        self.api_calls = 0
+        self.threads_hydrated = 0
+        # Threads queued but not hydrated yet, and channels whose history
+        # is complete
+        self._pending_threads = {}
+        self._history_done = set()
+
+    async def _call(self, method, func, **kwargs):
+        self.api_calls += 1
+        return await self.limiter.call(method, func, **kwargs)
+
+    async def get_joined_channels(self):
+        channels, cursor = [], None
+        while True:
+            result = await self._call(
+                "conversations.list", self.client.conversations_list,
+                types="public_channel,private_channel", cursor=cursor,
+                limit=1000)
+            channels.extend(
+                {"id": channel["id"], "name": channel["name"]}
+                for channel in result["channels"]
+                if channel.get("is_member", False))
+            cursor = result.get("response_metadata", {}).get("next_cursor")
+            if not cursor:
+                return channels
+
+    """
+    Yield the pages of a channel's history, each as a list of raw
+    messages.
+    """
+    async def iter_history(self, channel_id, **kwargs):
+        cursor = None
+        while True:
+            history = await self._call(
+                "conversations.history", self.client.conversations_history,
+                channel=channel_id, cursor=cursor, limit=self.page_size,
+                **kwargs)
+            yield history.get("messages", [])
+            cursor = history.get("response_metadata", {}).get("next_cursor")
+            if not cursor:
+                return
+
+    """
+    Yield the pages of a thread's replies, without the parent message that
+    conversations.replies repeats at the top of the first page.
+    """
+    async def iter_replies(self, channel_id, thread_ts, **kwargs):
+        cursor = None
+        while True:
+            replies = await self._call(
+                "conversations.replies", self.client.conversations_replies,
+                channel=channel_id, ts=thread_ts, cursor=cursor,
+                limit=self.page_size, **kwargs)
+            yield [msg for msg in replies.get("messages", [])
+                   if msg.get("ts") != thread_ts
+                   # Broadcast replies are in the channel history already
+                   and msg.get("subtype") != "thread_broadcast"]
+            cursor = replies.get("response_metadata", {}).get("next_cursor")
+            if not cursor:
+                return
+
+    def _oldest(self, channel_id):
+        cursor = self.cursors.get(channel_id)
+        if cursor is None:
+            return None
+        return f"{max(0.0, float(cursor) - self.lookback):.6f}"
+
+    def _advance_cursor(self, channel_id, ts):
+        cursor = self.cursors.get(channel_id)
+        if cursor is None or float(ts) > float(cursor):
+            self.cursors[channel_id] = ts
+
+    def _note_reply(self, channel_id, thread_ts, ts):
+        channel_threads = self.open_threads.setdefault(channel_id, {})
+        latest = channel_threads.get(thread_ts)
+        if latest is None or float(ts) > float(latest):
+            channel_threads[thread_ts] = ts
+
+    async def _queue_thread(self, channel, thread_ts, threads, oldest=None):
+        self._pending_threads[channel["id"]] = \
+            self._pending_threads.get(channel["id"], 0) + 1
+        await threads.put((channel, thread_ts, oldest))
+
+    async def _extract_channel(self, channel, queue, threads, semaphore):
+        async with semaphore:
+            oldest = self._oldest(channel["id"])
+            kwargs = {} if oldest is None else {"oldest": oldest}
+            seen = set()
+            async for page in self.iter_history(channel["id"], **kwargs):
+                for msg in page:
+                    self._advance_cursor(channel["id"], msg["ts"])
+                    await queue.put(
+                        format_message(msg, channel["id"], channel["name"]))
+                    if self.hydrate_replies and msg.get("reply_count", 0) > 0:
+                        seen.add(msg["ts"])
+                        self._note_reply(channel["id"], msg["ts"],
+                                         msg.get("latest_reply", msg["ts"]))
+                        await self._queue_thread(channel, msg["ts"], threads)
+            if self.hydrate_replies and oldest is not None:
+                # Open threads whose parent is older than the history fetched
+                for thread_ts in list(self.open_threads.get(channel["id"],
+                                                            {})):
+                    if thread_ts not in seen:
+                        await self._queue_thread(channel, thread_ts, threads,
+                                                 oldest)
+        self._history_done.add(channel["id"])
+        await self._check_channel_done(channel["id"], queue)
+
+    async def _check_channel_done(self, channel_id, queue):
+        if (channel_id in self._history_done
+                and self._pending_threads.get(channel_id, 0) == 0):
+            await queue.put(_ChannelDone(channel_id))
+
+    async def _hydrate_threads(self, queue, threads):
+        while True:
+            item = await threads.get()
+            if item is _DONE:
+                return
+            channel, thread_ts, oldest = item
+            kwargs = {} if oldest is None else {"oldest": oldest}
+            try:
+                async for page in self.iter_replies(channel["id"], thread_ts,
+                                                    **kwargs):
+                    for msg in page:
+                        self._note_reply(channel["id"], thread_ts, msg["ts"])
+                        await queue.put(format_message(msg, channel["id"],
+                                                       channel["name"]))
+            except SlackApiError as e:
+                if (oldest is None
+                        or e.response.get("error") != "thread_not_found"):
+                    raise
+                # The parent of an open thread was deleted since the last run
+                self.open_threads[channel["id"]].pop(thread_ts, None)
+            self.threads_hydrated += 1
+            self._pending_threads[channel["id"]] -= 1
+            await self._check_channel_done(channel["id"], queue)
+
+    """
+    The checkpoints to store after the extraction: the newest ts of each
+    channel, and the threads with replies within thread_window of it.
+    """
+    def checkpoint(self):
+        threads = {}
+        for channel_id, channel_threads in self.open_threads.items():
+            cursor = self.cursors.get(channel_id)
+            if cursor is None:
+                continue
+            cutoff = float(cursor) - self.thread_window
+            kept = {thread_ts: latest
+                    for thread_ts, latest in channel_threads.items()
+                    if float(latest) >= cutoff}
+            if kept:
+                threads[channel_id] = kept
+        return {"cursors": dict(self.cursors), "threads": threads}
+
+    """
+    Yield format_message records from every channel, replies included, as
+    they arrive. on_channel_done(channel_id) is called once every record
+    of a channel has been yielded. The first error stops the other channels
+    and is raised.
+    """
+    async def stream(self, channels, on_channel_done=None):
+        queue = asyncio.Queue(maxsize=10 * self.page_size)
+        # Unbounded, so that channel workers never wait on reply workers
+        threads = asyncio.Queue()
+        semaphore = asyncio.Semaphore(self.concurrency)
+        tasks = [asyncio.create_task(
+                     self._extract_channel(channel, queue, threads,
+                                           semaphore))
+                 for channel in channels]
+        hydrators = [asyncio.create_task(
+                         self._hydrate_threads(queue, threads))
+                     for _ in range(self.reply_concurrency
+                                    if self.hydrate_replies else 0)]
+
+        async def finish():
+            try:
+                await asyncio.gather(*tasks)
+                for _ in hydrators:
+                    await threads.put(_DONE)
+                await asyncio.gather(*hydrators)
+            finally:
+                await queue.put(_DONE)
+
+        finisher = asyncio.create_task(finish())
+        try:
+            while True:
+                record = await queue.get()
+                if record is _DONE:
+                    break
+                if isinstance(record, _ChannelDone):
+                    if on_channel_done is not None:
+                        on_channel_done(record.channel_id)
+                    continue
+                yield record
+            await finisher
+        finally:
+            for task in tasks + hydrators + [finisher]:
+                task.cancel()
+
+
+"""
+Extract every joined channel into a stage writer as the records arrive.
+Writers with an end_segment method, like SegmentedStageWriter, are told
+when each channel is complete, and progress(done, total) is called with
+the number of channels done so far. With a cursor store, only messages
+since the stored checkpoints (minus lookback seconds) are fetched, and the
+checkpoints are advanced once the extraction has finished, and writers
+with a metadata dict are told the output is incremental. Checkpoints
+stored as a plain {channel_id: ts} mapping by earlier versions are read as
+channel cursors without open threads. Returns the number of messages and
+channels extracted.
+"""
+
+
+async def extract_workspace(client: AsyncWebClient, writer, concurrency=8,
+                            limiter=None, hydrate_replies=True,
+                            cursor_store=None, lookback=86400,
+                            progress=None):
+    state = cursor_store.load() if cursor_store is not None else {}
+    if "cursors" not in state:
+        state = {"cursors": state, "threads": {}}
+    extractor = ChannelExtractor(client, limiter=limiter,
+                                 concurrency=concurrency,
+                                 hydrate_replies=hydrate_replies,
+                                 cursors=state["cursors"], lookback=lookback,
+                                 open_threads=state.get("threads"))
+    channels = await extractor.get_joined_channels()
+    if len(state["cursors"]) > 0 and hasattr(writer, "metadata"):
+        # Later stages need incremental preprocessing to report on more
+        # than the messages since the checkpoints
+        writer.metadata["incremental"] = True
+
+    count = 0
+    done = []
+    end_segment = getattr(writer, "end_segment", None)
+
+    def on_channel_done(channel_id):
+        if end_segment is not None:
+            end_segment(channel_id)
+        done.append(channel_id)
+        if progress is not None:
+            progress(len(done), len(channels))
+
+    async for record in extractor.stream(channels, on_channel_done):
+        writer.write(record)
+        count += 1
+    print(f"Extracted {count} messages from {len(channels)} channels and "
+          f"{extractor.threads_hydrated} threads with "
+          f"{extractor.api_calls} API calls "
+          f"({extractor.limiter.retries} rate-limit retries)")
+    if cursor_store is not None:
+        cursor_store.save(extractor.checkpoint())
+    return count, len(channels)
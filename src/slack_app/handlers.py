@@ -1,50 +1,87 @@
+import asyncio
 import os
-import json
 from slack_bolt import App
 from slack_sdk import WebClient
-from src.slack_app.client import get_joined_channels, format_message
+from slack_sdk.web.async_client import AsyncWebClient
+from src.slack_app.checkpoints import cursor_store
+from src.slack_app.extraction import extract_workspace
+from src.slack_app.jobs import JobExecutor, JobQueueFull
+from src.pipeline.handoff import SegmentedStageWriter, manifest_path
 
+# Always points at the newest extraction, for running the later stages
+LATEST_OUTPUT = "messages.jsonl.gz"
 
-def register_handlers(app: App, client: WebClient):
-    @app.command("/generate_feedback")
-    def handle_generate_feedback(ack, body, respond, logger):
-        ack()
 
-        try:
-            all_messages = []
-            channels = get_joined_channels(client)
+"""
+Point latest_path, and its manifest, at the stage file at path. The links
+are replaced atomically, so readers never see a missing file.
+"""
 
-            for channel in channels:
-                channel_id = channel["id"]
-                channel_name = channel["name"]
-                cursor = None
 
-                while True:
-                    history = client.conversations_history(
-                        channel=channel_id, cursor=cursor, limit=200)
-                    messages = history.get("messages", [])
+def link_latest(path, latest_path):
+    for target, link in [(path, latest_path),
+                         (manifest_path(path), manifest_path(latest_path))]:
+        tmp_link = f"{link}.tmp"
+        if os.path.lexists(tmp_link):
+            os.remove(tmp_link)
+        os.symlink(os.path.relpath(target, os.path.dirname(str(link))),
+                   tmp_link)
+        os.replace(tmp_link, link)
 
-                    for msg in messages:
-                        all_messages.append(
-                            format_message(msg, channel_id, channel_name))
 
-                    cursor = history.get(
-                        "response_metadata", {}).get("next_cursor")
-                    if not cursor:
-                        break
+def register_handlers(app: App, client: WebClient, executor=None):
+    executor = executor or JobExecutor()
 
-            # Save to JSON
+    def extract_messages(job, logger):
+        try:
+            # Save as a compressed stage file for preprocessing, with one
+            # segment per channel and a manifest, writing records as the
+            # channels are fetched concurrently
             output_dir = "output"
             os.makedirs(output_dir, exist_ok=True)
-            output_path = os.path.join(output_dir, "messages.json")
-            with open(output_path, "w") as f:
-                json.dump(all_messages, f, indent=2)
+            output_path = os.path.join(output_dir,
+                                       f"{job.job_id}_messages.jsonl.gz")
+            concurrency = int(os.getenv("EXTRACTION_CONCURRENCY", "8"))
+            # Only fetch messages since the last run when checkpoints are
+            # kept, in a local file or at s3://bucket/key
+            store = cursor_store(os.getenv("EXTRACTION_CURSORS"))
+            lookback_hours = float(os.getenv("EXTRACTION_LOOKBACK_HOURS",
+                                             "24"))
+
+            def progress(done, total):
+                # Halfway is the only update, to save the few responses
+                # Slack allows per command
+                if done == (total + 1) // 2 and total > 1:
+                    job.notify(f"Extracted {done} of {total} channels...")
+
+            job.notify("Extracting messages...")
+            with SegmentedStageWriter(output_path, "extraction") as writer:
+                num_messages, num_channels = asyncio.run(extract_workspace(
+                    AsyncWebClient(token=client.token), writer,
+                    concurrency=concurrency, cursor_store=store,
+                    lookback=lookback_hours * 3600, progress=progress))
+            link_latest(output_path, os.path.join(output_dir, LATEST_OUTPUT))
 
-            respond(
-                f"Extracted {len(all_messages)} messages from {len(channels)}"
-                f" channels and saved to `{output_path}`."
-            )
+            return (f"Extracted {num_messages} messages from {num_channels}"
+                    f" channels and saved to `{output_path}`.")
 
         except Exception as e:
             logger.error(f"Failed to generate insights: {e}")
-            respond("Failed to extract messages due to an error.")
+            job.notify("Failed to extract messages due to an error.",
+                       final=True)
+            raise
+
+    @app.command("/generate_feedback")
+    def handle_generate_feedback(ack, body, respond, logger):
+        ack()
+
+        try:
+            # Repeated commands from the same workspace share one
+            # extraction instead of each starting their own
+            executor.submit("extraction",
+                            lambda job: extract_messages(job, logger),
+                            respond=respond,
+                            key=f"extraction:{body.get('team_id')}")
+        except JobQueueFull:
+            executor.send(respond, "Too many extractions are running right "
+                                   "now. Please try again in a few minutes.")
@@ -0,0 +1,245 @@
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+"""
+Runs long slash-command work, such as a workspace extraction, off the Bolt
+listener threads.
+
+Listeners only ack() and submit a job, so their latency stays the same
+however large the job is. Jobs run on a bounded pool of worker threads;
+at most max_queued more wait for a worker, and submissions beyond that are
+refused instead of piling up. Each job tracks its status and reports
+progress through the command's respond function, which Slack accepts at
+most MAX_RESPONSES times per command. Responses are HTTP calls, so they are
+sent in order by a notifier thread, never on the listener that submits.
+
+Jobs submitted with a key are coalesced: while a job with the same key is
+queued or running, a repeated command attaches its respond function to
+that job instead of starting another one, and every command gets the same
+progress and result. With a coalesce_window, a job that succeeded that
+many seconds ago or less answers repeats with its result.
+"""
+
+JOB_STATES = ["queued", "running", "succeeded", "failed"]
+
+# Messages a response_url accepts, see
+# https://api.slack.com/interactivity/handling#message_responses
+MAX_RESPONSES = 5
+
+
+class JobQueueFull(Exception):
+    pass
+
+
+class Job:
+    def __init__(self, name, func, respond=None, key=None, notifier=None):
+        self.job_id = uuid.uuid4().hex[:8]
+        self.name = name
+        self.func = func
+        self.key = key
+        self.status = "queued"
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.result = None
+        self.error = None
+        # Called with each response to send; sent right away without one
+        self.notifier = notifier
+        # [respond, responses sent] for each command the job answers
+        self.responders = []
+        if respond is not None:
+            self.attach(respond)
+
+    def attach(self, respond):
+        responder = [respond, 0]
+        self.responders.append(responder)
+        return responder
+
+    """
+    Send a message through every respond function. The last response a
+    response_url takes is kept for the final result, so progress updates
+    beyond that are dropped unless final is set.
+    """
+    def notify(self, text, final=False):
+        for responder in list(self.responders):
+            self._send(responder, text, final)
+
+    def _send(self, responder, text, final=False):
+        if self.notifier is None:
+            self._respond(responder, text, final)
+        else:
+            self.notifier(lambda: self._respond(responder, text, final))
+
+    def _respond(self, responder, text, final):
+        limit = MAX_RESPONSES if final else MAX_RESPONSES - 1
+        if responder[1] >= limit:
+            return
+        responder[1] += 1
+        try:
+            responder[0](text)
+        except Exception as e:
+            print(f"Job {self.job_id}: failed to send response: {e}")
+
+    def to_dict(self):
+        return {
+            "job_id": self.job_id,
+            "name": self.name,
+            "key": self.key,
+            "status": self.status,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "error": self.error,
+        }
+
+
+class JobExecutor:
+    def __init__(self, max_workers=2, max_queued=20, keep_finished=100,
+                 coalesce_window=0):
+        self.max_workers = max_workers
+        self.max_queued = max_queued
+        self.keep_finished = keep_finished
+        self.coalesce_window = coalesce_window
+        self._pool = ThreadPoolExecutor(max_workers,
+                                        thread_name_prefix="job")
+        self._lock = threading.Lock()
+        self._jobs = OrderedDict()
+        self._notices = queue.Queue()
+        threading.Thread(target=self._send_notices, name="job-notifier",
+                         daemon=True).start()
+
+    def _send_notices(self):
+        while True:
+            send = self._notices.get()
+            try:
+                send()
+            finally:
+                self._notices.task_done()
+
+    """
+    Send text through respond from the notifier thread, e.g. to answer a
+    command that could not be submitted.
+    """
+    def send(self, respond, text):
+        def deliver():
+            try:
+                respond(text)
+            except Exception as e:
+                print(f"Failed to send response: {e}")
+        self._notices.put(deliver)
+
+    """
+    Wait until every response queued so far has been sent.
+    """
+    def wait_for_notices(self):
+        self._notices.join()
+
+    def _count(self, status):
+        return sum(1 for job in self._jobs.values() if job.status == status)
+
+    """
+    Return the latest job with key that is unfinished, or that succeeded
+    within the coalesce window.
+    """
+    def _find(self, key):
+        for job in reversed(self._jobs.values()):
+            if job.key != key:
+                continue
+            if job.status in ("queued", "running"):
+                return job
+            if (job.status == "succeeded" and job.finished_at >=
+                    time.time() - self.coalesce_window):
+                return job
+        return None
+
+    """
+    Queue func(job) to run on a worker and return its Job. Whatever func
+    returns becomes the job's result and, if it is a string, the final
+    response. Raises JobQueueFull when max_queued jobs are already waiting.
+    When key matches a job that is in flight, or succeeded within the
+    coalesce window, that job is returned instead and answers respond too.
+    """
+    def submit(self, name, func, respond=None, key=None):
+        if key is not None:
+            with self._lock:
+                job = self._find(key)
+                finished = job is not None and job.status == "succeeded"
+                joined = None
+                if job is not None and not finished and respond:
+                    # Attached under the lock that guards status changes,
+                    # so the job's final response reaches respond too
+                    joined = job.attach(respond)
+            if joined is not None:
+                job._send(joined, f"Job `{job.job_id}` is already running "
+                                  f"for the same request; you will get its "
+                                  f"result too.")
+            if finished and respond:
+                text = (job.result if isinstance(job.result, str) else
+                        f"Job `{job.job_id}` just finished.")
+                job._send([respond, 0], f"This was just run: {text}",
+                          final=True)
+            if job is not None:
+                return job
+
+        job = Job(name, func, respond, key, notifier=self._notices.put)
+        with self._lock:
+            # Counted from all unfinished jobs, since submitted jobs may not
+            # have been picked up by a free worker yet
+            active = self._count("queued") + self._count("running")
+            waiting = max(0, active - self.max_workers)
+            if waiting >= self.max_queued:
+                raise JobQueueFull(f"{waiting} jobs are already waiting")
+            self._jobs[job.job_id] = job
+            self._trim()
+            ahead = active - self.max_workers + 1
+        if ahead > 0:
+            job.notify(f"Job `{job.job_id}` is queued and starts after "
+                       f"{ahead} other job(s) finish.")
+        self._pool.submit(self._run, job)
+        return job
+
+    def _run(self, job):
+        with self._lock:
+            job.status = "running"
+            job.started_at = time.time()
+        try:
+            job.result = job.func(job)
+            with self._lock:
+                job.status = "succeeded"
+                job.finished_at = time.time()
+            if isinstance(job.result, str):
+                job.notify(job.result, final=True)
+        except Exception as e:
+            with self._lock:
+                job.status = "failed"
+                job.finished_at = time.time()
+            job.error = str(e)
+            print(f"Job {job.job_id} ({job.name}) failed: {e}")
+
+    def _trim(self):
+        finished = [job_id for job_id, job in self._jobs.items()
+                    if job.status in ("succeeded", "failed")]
+        for job_id in finished[:max(0, len(finished) - self.keep_finished)]:
+            del self._jobs[job_id]
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def jobs(self, status=None):
+        with self._lock:
+            return [job for job in self._jobs.values()
+                    if status is None or job.status == status]
+
+    def stats(self):
+        with self._lock:
+            return {status: self._count(status) for status in JOB_STATES}
+
+    def shutdown(self, wait=True):
+        self._pool.shutdown(wait=wait)
+        if wait:
+            self.wait_for_notices()
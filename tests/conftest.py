@@ -0,0 +1,269 @@
+import pytest
+
+TINY_VOCAB = (
+    "the a an this example is inquiry goal complaint praise other hello "
+    "thanks great build broken deploy why what we need to fix it i love "
+    "team bad release is slow when will ship lunch anyone ok sure"
+).split()
+
+
+def _save_tiny_tokenizer(path):
+    from tokenizers import Tokenizer, models, pre_tokenizers, processors
+    from transformers import PreTrainedTokenizerFast
+
+    vocab = {"<s>": 0, "<pad>": 1, "</s>": 2, "<unk>": 3}
+    for word in TINY_VOCAB:
+        vocab.setdefault(word, len(vocab))
+
+    tokenizer = Tokenizer(models.WordLevel(vocab, unk_token="<unk>"))
+    tokenizer.pre_tokenizer = pre_tokenizers.Whitespace()
+    tokenizer.post_processor = processors.TemplateProcessing(
+        single="<s> $A </s>",
+        pair="<s> $A </s> </s> $B </s>",
+        special_tokens=[("<s>", 0), ("</s>", 2)]
+    )
+    fast = PreTrainedTokenizerFast(
+        tokenizer_object=tokenizer, bos_token="<s>", eos_token="</s>",
+        pad_token="<pad>", unk_token="<unk>", model_max_length=64)
+    fast.save_pretrained(path)
+    return len(vocab)
+
+
+@pytest.fixture(scope="session")
+def tiny_sentiment_model(tmp_path_factory):
+    """A randomly initialised RoBERTa sentiment model saved to disk"""
+    torch = pytest.importorskip("torch")
+    from transformers import RobertaConfig, RobertaForSequenceClassification
+
+    path = tmp_path_factory.mktemp("tiny-sentiment")
+    vocab_size = _save_tiny_tokenizer(path)
+    torch.manual_seed(0)
+    config = RobertaConfig(
+        vocab_size=vocab_size, hidden_size=16, num_hidden_layers=1,
+        num_attention_heads=2, intermediate_size=32,
+        max_position_embeddings=72, pad_token_id=1, bos_token_id=0,
+        eos_token_id=2, num_labels=3, initializer_range=0.5)
+    RobertaForSequenceClassification(config).save_pretrained(path)
+    return str(path)
+
+
+@pytest.fixture(scope="session")
+def tiny_nli_model(tmp_path_factory):
+    """A randomly initialised BART NLI model saved to disk"""
+    torch = pytest.importorskip("torch")
+    from transformers import BartConfig, BartForSequenceClassification
+
+    path = tmp_path_factory.mktemp("tiny-nli")
+    vocab_size = _save_tiny_tokenizer(path)
+    torch.manual_seed(1)
+    config = BartConfig(
+        vocab_size=vocab_size, d_model=16, encoder_layers=1,
+        decoder_layers=1, encoder_attention_heads=2,
+        decoder_attention_heads=2, encoder_ffn_dim=32, decoder_ffn_dim=32,
+        max_position_embeddings=128, pad_token_id=1, bos_token_id=0,
+        eos_token_id=2, num_labels=3, init_std=0.5,
+        id2label={0: "contradiction", 1: "neutral", 2: "entailment"},
+        label2id={"contradiction": 0, "neutral": 1, "entailment": 2})
+    BartForSequenceClassification(config).save_pretrained(path)
+    return str(path)
+
+
+@pytest.fixture(scope="session")
+def tiny_tokenizer(tiny_sentiment_model):
+    """Word-level tokenizer of the tiny models: one token per word"""
+    from transformers import AutoTokenizer
+    return AutoTokenizer.from_pretrained(tiny_sentiment_model)
+
+
+class NeutralAnalyzer:
+    """Stand-in for SentimentAnalyzer that scores everything neutral"""
+    def __init__(self, tokenizer, max_input_tokens=62):
+        self.tokenizer = tokenizer
+        self.max_input_tokens = max_input_tokens
+        self.inputs = []
+
+    def encode(self, texts):
+        return self.tokenizer(list(texts),
+                              add_special_tokens=False)["input_ids"]
+
+    def analyze_encoded(self, input_ids, batch_size=None):
+        import torch
+        self.inputs.extend(input_ids)
+        return [torch.tensor([0.1, 0.8, 0.1]) for _ in input_ids]
+
+
+class KeywordClassifier:
+    """Stand-in for ZeroShotClassifier that records its inputs"""
+    fingerprint = {"model": "keyword"}
+
+    def __init__(self):
+        self.calls = []
+
+    def classify(self, text, labels=None):
+        self.calls.append(text)
+        last_line = text.split("\n")[-1]
+        if "fix" in last_line or "why" in last_line:
+            return {"labels": ["complaint", "other"], "scores": [0.9, 0.1]}
+        return {"labels": ["other", "praise"], "scores": [0.8, 0.2]}
+
+    def classify_batch(self, texts, labels=None):
+        return [self.classify(text, labels) for text in texts]
+
+
+@pytest.fixture
+def neutral_analyzer(tiny_tokenizer):
+    return NeutralAnalyzer(tiny_tokenizer)
+
+
+@pytest.fixture
+def keyword_classifier():
+    return KeywordClassifier()
+
+
+@pytest.fixture
+def make_message():
+    """Factory for UnscoredMessages of channel C1 unless given"""
+    from src.pipeline.preprocessing import UnscoredMessage
+
+    def make(text, ts, parent_ts=None, channel="C1"):
+        return UnscoredMessage(
+            message_text=text,
+            reactions=[],
+            channel_id=channel,
+            channel_name="general",
+            timestamp=ts,
+            is_thread_reply=parent_ts is not None,
+            parent_thread_ts=parent_ts or ts
+        )
+    return make
+
+
+@pytest.fixture
+def make_record():
+    """Factory for records in the format of the Slack export"""
+    def make(text, ts, **overrides):
+        record = {
+            "channel_id": "C08PH0ZMY7L",
+            "channel_name": "all-intellicue",
+            "user_id": "U08PH0ZCNCA",
+            "message_text": text,
+            "message_type": "message",
+            "timestamp": ts,
+            "parent_thread_ts": ts,
+            "is_thread_reply": False,
+            "reactions": [],
+            "subtype": None,
+            "sent_by_bot_id": None,
+            "last_edited": None
+        }
+        record.update(overrides)
+        return record
+    return make
+
+
+class FakeResponse:
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+
+
+class FakeSlackClient:
+    """
+    Async Slack client serving pages of fake history. Threads have paged
+    replies, only messages newer than oldest are served, like Slack does,
+    and the first rate_limited history calls fail with a 429.
+    """
+    def __init__(self, channels, replies=None, rate_limited=0, delay=0.01):
+        self.channels = channels
+        self.replies = replies or {}
+        self.rate_limited = rate_limited
+        self.delay = delay
+        self.active = 0
+        self.max_active = 0
+        self.calls = []
+        self.oldest = {}
+        self.replies_oldest = {}
+
+    async def _wait(self):
+        import asyncio
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        await asyncio.sleep(self.delay)
+        self.active -= 1
+
+    async def conversations_list(self, **kwargs):
+        return {"channels": [{"id": cid, "name": cid.lower(),
+                              "is_member": True}
+                             for cid in self.channels]}
+
+    async def conversations_history(self, channel, cursor=None, limit=200,
+                                    oldest=None, **kwargs):
+        from slack_sdk.errors import SlackApiError
+
+        self.calls.append((channel, cursor))
+        self.oldest[channel] = oldest
+        if self.rate_limited > 0:
+            self.rate_limited -= 1
+            raise SlackApiError("ratelimited",
+                                FakeResponse(429, {"Retry-After": "0"}))
+        await self._wait()
+
+        pages = self.channels[channel]
+        page = int(cursor or 0)
+        next_cursor = str(page + 1) if page + 1 < len(pages) else ""
+        messages = []
+        for ts in pages[page]:
+            if oldest is not None and float(ts) <= float(oldest):
+                continue
+            message = {"type": "message", "ts": ts, "text": ts}
+            if ts in self.replies:
+                replies = [reply for page in self.replies[ts]
+                           for reply in page]
+                message["reply_count"] = len(replies)
+                message["latest_reply"] = max(replies, key=float)
+            messages.append(message)
+        return {"messages": messages,
+                "response_metadata": {"next_cursor": next_cursor}}
+
+    async def conversations_replies(self, channel, ts, cursor=None,
+                                    limit=200, oldest=None, **kwargs):
+        self.replies_oldest[ts] = oldest
+        await self._wait()
+
+        pages = self.replies[ts]
+        page = int(cursor or 0)
+        messages = [{"type": "message", "ts": reply, "thread_ts": ts,
+                     "text": reply} for reply in pages[page]
+                    if oldest is None or float(reply) > float(oldest)]
+        if page == 0:
+            # Slack repeats the parent at the top of the first page
+            messages.insert(0, {"type": "message", "ts": ts,
+                                "thread_ts": ts, "reply_count": 1})
+        next_cursor = str(page + 1) if page + 1 < len(pages) else ""
+        return {"messages": messages,
+                "response_metadata": {"next_cursor": next_cursor}}
+
+
+class ListWriter:
+    def __init__(self):
+        self.records = []
+
+    def write(self, record):
+        self.records.append(record)
+
+
+@pytest.fixture
+def make_slack_client():
+    return FakeSlackClient
+
+
+@pytest.fixture
+def make_writer():
+    return ListWriter
+
+
+@pytest.fixture
+def slack_limits():
+    """Tier limits high enough that the rate limiter never waits"""
+    return {"conversations.list": 6000, "conversations.history": 6000,
+            "conversations.replies": 6000}
@@ -0,0 +1,66 @@
+import pytest
+from src.pipeline.cascade import SmallTalkFilter
+from src.pipeline.scoring import ScoringPipeline
+
+
+@pytest.mark.parametrize("text", [
+    "ok!", "+1", ":tada: :tada:", "", "lol ok", "<@U123> got it",
+    "Will do :thumbsup:",
+])
+def test_small_talk_is_rejected(text):
+    assert SmallTalkFilter().is_small_talk(text)
+
+
+@pytest.mark.parametrize("text", [
+    "ok?", "ok but the deploy failed again", "the release is slow",
+    "great work on the launch",
+    # Thanks are praise and go to the classifier
+    "Thank you so much team!", "thanks everyone", "thank you all so much",
+    "Good morning team!",
+])
+def test_uncertain_messages_pass_through(text):
+    assert not SmallTalkFilter().is_small_talk(text)
+
+
+def test_pipeline_skips_classifier_for_small_talk(neutral_analyzer,
+                                                  keyword_classifier,
+                                                  make_message):
+    threads = {}
+    for i, text in enumerate(["ok!", "why did the deploy fail", "+1"]):
+        ts = f"{100 + i}.000001"
+        threads[ts] = [make_message(text, ts)]
+    cascade = SmallTalkFilter()
+    pipeline = ScoringPipeline(
+        {"C1": threads}, sentiment_analyzer=neutral_analyzer,
+        classifier=keyword_classifier, cascade=cascade)
+    scored = pipeline.score_messages()
+
+    assert keyword_classifier.calls == ["why did the deploy fail"]
+    assert [message["message_text"] for message in scored] == [
+        "why did the deploy fail"]
+    assert cascade.stats() == {"checked": 3, "rejected": 2,
+                               "hit_rate": pytest.approx(2 / 3)}
+
+
+def test_replies_are_checked_with_their_thread_context(neutral_analyzer,
+                                                       keyword_classifier,
+                                                       make_message):
+    root = "100.000001"
+    thread = [make_message("why is the build broken", root),
+              make_message("ok", "100.000002", root)]
+    unscored = {"C1": {root: thread}}
+
+    baseline = ScoringPipeline(
+        unscored, sentiment_analyzer=neutral_analyzer,
+        classifier=keyword_classifier).score_messages()
+    cascade = SmallTalkFilter()
+    scored = ScoringPipeline(
+        unscored, sentiment_analyzer=neutral_analyzer,
+        classifier=keyword_classifier, cascade=cascade).score_messages()
+
+    # "ok" on its own is small talk, but it is classified together
+    # with the question it answers
+    assert len(keyword_classifier.calls) == 4
+    assert keyword_classifier.calls[:2] == keyword_classifier.calls[2:]
+    assert scored == baseline
+    assert cascade.rejected == 0
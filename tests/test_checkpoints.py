@@ -0,0 +1,129 @@
+import asyncio
+
+import boto3
+from moto import mock_aws
+
+from src.pipeline.handoff import SegmentedStageWriter, is_incremental
+from src.slack_app.checkpoints import (LocalCursorStore, S3CursorStore,
+                                       cursor_store)
+from src.slack_app.extraction import RateLimiter, extract_workspace
+
+
+def test_local_store_round_trip(tmp_path):
+    store = LocalCursorStore(tmp_path / "state" / "cursors.json")
+    assert store.load() == {}
+    store.save({"C1": "100.000001"})
+    assert store.load() == {"C1": "100.000001"}
+    assert isinstance(cursor_store(str(tmp_path / "c.json")),
+                      LocalCursorStore)
+    assert cursor_store("") is None
+
+
+@mock_aws
+def test_s3_store_round_trip():
+    s3 = boto3.client("s3", region_name="us-east-1")
+    s3.create_bucket(Bucket="slack-message-extract")
+    store = S3CursorStore("slack-message-extract", "cursors/T1.json",
+                          s3_client=s3)
+
+    assert store.load() == {}
+    store.save({"C1": "100.000001"})
+    assert store.load() == {"C1": "100.000001"}
+
+    store = cursor_store("s3://slack-message-extract/cursors/T1.json")
+    assert (store.bucket, store.key) == ("slack-message-extract",
+                                         "cursors/T1.json")
+
+
+def test_later_runs_only_fetch_new_messages(tmp_path, make_slack_client,
+                                            make_writer, slack_limits):
+    store = LocalCursorStore(tmp_path / "cursors.json")
+    limiter = RateLimiter(slack_limits)
+
+    client = make_slack_client({"C1": [["1000.0", "2000.0"]],
+                                "C2": [["50.0"]]}, delay=0)
+    writer = make_writer()
+    asyncio.run(extract_workspace(client, writer, limiter=limiter,
+                                  cursor_store=store, lookback=100))
+    assert len(writer.records) == 3
+    assert client.oldest == {"C1": None, "C2": None}
+    assert store.load() == {"cursors": {"C1": "2000.0", "C2": "50.0"},
+                            "threads": {}}
+
+    client = make_slack_client(
+        {"C1": [["1000.0", "1950.0", "2000.0", "3000.0"]],
+         "C2": [["50.0"]]}, delay=0)
+    writer = make_writer()
+    asyncio.run(extract_workspace(client, writer, limiter=limiter,
+                                  cursor_store=store, lookback=100))
+    # Messages within the look-back window are fetched again
+    assert client.oldest == {"C1": "1900.000000", "C2": "0.000000"}
+    assert sorted(r["timestamp"] for r in writer.records) == [
+        "1950.0", "2000.0", "3000.0", "50.0"]
+    assert store.load() == {"cursors": {"C1": "3000.0", "C2": "50.0"},
+                            "threads": {}}
+
+
+def test_legacy_checkpoints_are_read_as_cursors(tmp_path, make_slack_client,
+                                                make_writer, slack_limits):
+    store = LocalCursorStore(tmp_path / "cursors.json")
+    store.save({"C1": "2000.0"})
+    client = make_slack_client({"C1": [["1000.0", "2000.0", "3000.0"]]},
+                               delay=0)
+    asyncio.run(extract_workspace(client, make_writer(),
+                                  limiter=RateLimiter(slack_limits),
+                                  cursor_store=store, lookback=100))
+    assert client.oldest == {"C1": "1900.000000"}
+    assert store.load()["cursors"] == {"C1": "3000.0"}
+
+
+def test_open_threads_are_hydrated_again(tmp_path, make_slack_client,
+                                         make_writer, slack_limits):
+    store = LocalCursorStore(tmp_path / "cursors.json")
+    limiter = RateLimiter(slack_limits)
+    day = 86400.0
+
+    client = make_slack_client({"C1": [["1000.0", "2000.0"]]},
+                               {"1000.0": [["1001.0"]]}, delay=0)
+    asyncio.run(extract_workspace(client, make_writer(), limiter=limiter,
+                                  cursor_store=store, lookback=100))
+    assert store.load()["threads"] == {"C1": {"1000.0": "1001.0"}}
+
+    # A new reply to a thread whose parent is older than the look-back
+    # window, and a thread that has gone quiet since
+    later = str(2000.0 + 8 * day)
+    client = make_slack_client(
+        {"C1": [["1000.0", "2000.0", "3000.0", later]]},
+        {"1000.0": [["1001.0", "3001.0"]], "3000.0": [["3002.0"]]}, delay=0)
+    writer = make_writer()
+    asyncio.run(extract_workspace(client, writer, limiter=limiter,
+                                  cursor_store=store, lookback=100))
+    assert client.replies_oldest == {"1000.0": "1900.000000",
+                                     "3000.0": None}
+    assert sorted(r["timestamp"] for r in writer.records) == [
+        "2000.0", "3000.0", "3001.0", "3002.0", later]
+    # Replies older than THREAD_WINDOW close their threads
+    assert store.load()["threads"] == {}
+
+
+def test_incremental_extractions_are_marked(tmp_path, monkeypatch, capsys,
+                                            make_slack_client, slack_limits):
+    from src.pipeline import preprocessing
+
+    store = LocalCursorStore(tmp_path / "cursors.json")
+    monkeypatch.delenv("PREPROCESS_STATE_PATH", raising=False)
+    for name in ("full", "delta"):
+        path = tmp_path / f"{name}_messages.jsonl.gz"
+        client = make_slack_client({"C1": [["1000.0", "2000.0"]]}, delay=0)
+        with SegmentedStageWriter(str(path), "extraction") as writer:
+            asyncio.run(extract_workspace(client, writer,
+                                          limiter=RateLimiter(slack_limits),
+                                          cursor_store=store))
+        monkeypatch.setattr("sys.argv", [
+            "preprocessing.py", str(path),
+            str(tmp_path / f"{name}_preprocessed.jsonl.gz")])
+        preprocessing.main()
+
+    assert not is_incremental(tmp_path / "full_messages.jsonl.gz")
+    assert is_incremental(tmp_path / "delta_messages.jsonl.gz")
+    assert capsys.readouterr().out.count("PREPROCESS_STATE_PATH") == 1
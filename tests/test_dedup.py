@@ -0,0 +1,100 @@
+import torch
+from src.pipeline.dedup import Deduplicator, normalize_text
+from src.pipeline.preprocessing import UnscoredMessage
+from src.pipeline.scoring import ScoringPipeline
+
+STANDUP = ("Yesterday: worked on the billing migration. Today: finishing "
+           "the billing migration tests. Blockers: none")
+
+
+class RecordingAnalyzer:
+    max_input_tokens = 62
+
+    def __init__(self, tokenizer):
+        self.tokenizer = tokenizer
+        self.inputs = []
+
+    def encode(self, texts):
+        return self.tokenizer(list(texts),
+                              add_special_tokens=False)["input_ids"]
+
+    def analyze_encoded(self, input_ids, batch_size=None):
+        self.inputs.extend(input_ids)
+        return [torch.tensor([0.8, 0.1, 0.1]) for _ in input_ids]
+
+    def supports_thread_pass(self):
+        return True
+
+    def analyze_threads(self, threads_ids, batch_size=None):
+        return [self.analyze_encoded(ids) for ids in threads_ids]
+
+
+class RecordingClassifier:
+    def __init__(self):
+        self.texts = []
+
+    def classify_batch(self, texts, labels=None):
+        self.texts.extend(texts)
+        return [{"sequence": text, "labels": ["complaint", "other"],
+                 "scores": [0.9, 0.1]} for text in texts]
+
+
+def make_threads(texts, replies=()):
+    threads = {}
+    for i, text in enumerate(texts):
+        ts = f"{100 + i}.000001"
+        threads[ts] = [UnscoredMessage(text, [], "C1", "general", ts,
+                                       False, ts)]
+    root = "100.000001"
+    for j, text in enumerate(replies):
+        threads[root].append(UnscoredMessage(
+            text, [], "C1", "general", f"100.00010{j}", True, root))
+    return {"C1": threads}
+
+
+def test_exact_duplicates_use_normalized_text():
+    assert normalize_text("  Thanks\n  TEAM ") == "thanks team"
+    groups = Deduplicator().group(["+1", "thanks team", "Thanks  team",
+                                   "+1", "ship it"])
+    assert groups == [0, 1, 1, 0, 4]
+
+
+def test_near_duplicates_are_grouped():
+    near = STANDUP.replace("none", "waiting on review")
+    other = "The deploy pipeline has been failing since this morning"
+    groups = Deduplicator().group([STANDUP, other, near])
+    assert groups == [0, 1, 0]
+
+    exact_only = Deduplicator(near_duplicates=False)
+    assert exact_only.group([STANDUP, other, near]) == [0, 1, 2]
+
+
+def test_duplicate_roots_are_scored_once(tiny_tokenizer):
+    dedup = Deduplicator()
+    sa, zcs = RecordingAnalyzer(tiny_tokenizer), RecordingClassifier()
+    unscored = make_threads(["the build is broken", "the build is broken",
+                             "when will we ship"],
+                            replies=["the build is broken"])
+    scored = ScoringPipeline(unscored, sentiment_analyzer=sa,
+                             classifier=zcs, dedup=dedup).score_messages()
+
+    # Two distinct roots, plus the reply which is never collapsed
+    assert len(sa.inputs) == 3
+    assert zcs.texts[:2] == ["the build is broken", "when will we ship"]
+    assert [message["timestamp"] for message in scored] == [
+        100.000001, 100.0001, 101.000001, 102.000001]
+    assert dedup.stats() == {"checked": 3, "collapsed": 1}
+
+
+def test_thread_mode_collapses_single_message_threads(tiny_tokenizer):
+    dedup = Deduplicator()
+    sa, zcs = RecordingAnalyzer(tiny_tokenizer), RecordingClassifier()
+    unscored = make_threads(["the build is broken", "ok", "OK"],
+                            replies=["ok"])
+    scored = ScoringPipeline(unscored, sentiment_analyzer=sa,
+                             classifier=zcs, dedup=dedup,
+                             mode="thread").score_messages()
+
+    assert zcs.texts == ["the build is broken", "ok", "ok"]
+    assert len(scored) == 4
+    assert scored[-1]["message_text"] == "OK"
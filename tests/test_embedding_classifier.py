@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+from src.pipeline.embedding_classifier import EmbeddingClassifier
+from src.pipeline.scoring import CATEGORY_LABELS, ScoringPipeline
+
+TEXTS = ["we need to fix the build", "thanks", "why is the release slow"]
+
+
+@pytest.fixture(scope="module")
+def classifier(tiny_sentiment_model):
+    # The tiny sentiment model's encoder doubles as an embedding model
+    return EmbeddingClassifier(model_name=tiny_sentiment_model,
+                               batch_size=2)
+
+
+def test_embeddings_are_normalized(classifier):
+    embeddings = classifier.embed(TEXTS)
+    assert embeddings.shape == (3, classifier.model.config.hidden_size)
+    assert np.linalg.norm(embeddings, axis=1) == pytest.approx(
+        [1.0, 1.0, 1.0], abs=1e-5)
+    assert classifier.embed([]).shape[0] == 0
+
+
+def test_classify_batch_has_zero_shot_shape(classifier):
+    results = classifier.classify_batch(TEXTS, CATEGORY_LABELS)
+
+    assert [result["sequence"] for result in results] == TEXTS
+    for result in results:
+        assert sorted(result["labels"]) == sorted(CATEGORY_LABELS)
+        assert result["scores"] == sorted(result["scores"], reverse=True)
+        assert sum(result["scores"]) == pytest.approx(1.0)
+
+    single = classifier.classify(TEXTS[0], CATEGORY_LABELS)
+    assert single["labels"] == results[0]["labels"]
+    assert single["scores"] == pytest.approx(results[0]["scores"], abs=1e-5)
+
+
+def test_label_embeddings_are_computed_once(classifier, mocker):
+    labels = ["inquiry", "release notes"]
+    first = classifier.label_embeddings(labels)
+    embed = mocker.spy(classifier, "embed")
+    classifier.classify_batch(TEXTS, labels)
+
+    # Only the messages are embedded on later calls
+    embed.assert_called_once()
+    assert first.shape == (2, classifier.model.config.hidden_size)
+
+
+def test_unknown_classifier_type_is_rejected():
+    with pytest.raises(ValueError):
+        ScoringPipeline({}, classifier_type="regex")
@@ -0,0 +1,120 @@
+import asyncio
+
+import pytest
+from slack_sdk.errors import SlackApiError
+
+from src.slack_app.extraction import (ChannelExtractor, RateLimiter,
+                                      TokenBucket, extract_workspace)
+
+
+def test_channels_are_fetched_concurrently_with_pagination(
+        make_slack_client, slack_limits):
+    channels = {f"C{i}": [[f"{i}.1", f"{i}.2"], [f"{i}.3"]]
+                for i in range(6)}
+    client = make_slack_client(channels)
+    extractor = ChannelExtractor(client, limiter=RateLimiter(slack_limits),
+                                 concurrency=3)
+
+    async def collect():
+        return [r async for r in extractor.stream(
+            await extractor.get_joined_channels())]
+
+    records = asyncio.run(collect())
+    assert len(records) == 18
+    assert client.max_active == 3
+    assert {r["channel_name"] for r in records} == {f"c{i}"
+                                                    for i in range(6)}
+    assert extractor.api_calls == 13
+
+
+def test_rate_limited_calls_are_retried(make_slack_client, make_writer,
+                                        slack_limits):
+    client = make_slack_client({"C1": [["1.1"]]}, rate_limited=2)
+    limiter = RateLimiter(slack_limits)
+    writer = make_writer()
+
+    count, num_channels = asyncio.run(
+        extract_workspace(client, writer, limiter=limiter))
+    assert (count, num_channels) == (1, 1)
+    assert writer.records[0]["timestamp"] == "1.1"
+    assert limiter.retries == 2
+    assert len(client.calls) == 3
+
+
+def test_errors_stop_the_stream(make_slack_client, slack_limits):
+    client = make_slack_client({"C1": [["1.1"]]}, rate_limited=10)
+    extractor = ChannelExtractor(client, limiter=RateLimiter(
+        slack_limits, max_retries=1))
+
+    async def collect():
+        return [r async for r in extractor.stream([{"id": "C1",
+                                                    "name": "c1"}])]
+
+    with pytest.raises(SlackApiError):
+        asyncio.run(collect())
+
+
+def test_token_bucket_paces_calls_at_the_tier_rate(monkeypatch):
+    now = [0.0]
+    original_sleep = asyncio.sleep
+
+    async def fake_sleep(seconds):
+        now[0] += seconds
+        await original_sleep(0)
+
+    monkeypatch.setattr(asyncio, "sleep", fake_sleep)
+
+    async def run():
+        bucket = TokenBucket(60, capacity=1, clock=lambda: now[0])
+        for _ in range(3):
+            await bucket.acquire()
+        bucket.pause(10)
+        await bucket.acquire()
+
+    asyncio.run(run())
+    # One call per second after the first, then nothing until the pause
+    # is over
+    assert now[0] == pytest.approx(2 + 10)
+
+
+def test_thread_replies_are_hydrated(make_slack_client, slack_limits):
+    channels = {"C1": [[f"1{i}.0" for i in range(10)]]}
+    replies = {f"1{i}.0": [[f"1{i}.1", f"1{i}.2"], [f"1{i}.3"]]
+               for i in range(10)}
+    client = make_slack_client(channels, replies)
+    extractor = ChannelExtractor(client, limiter=RateLimiter(slack_limits),
+                                 reply_concurrency=4)
+
+    async def collect():
+        return [r async for r in extractor.stream([{"id": "C1",
+                                                    "name": "c1"}])]
+
+    records = asyncio.run(collect())
+    assert len(records) == 10 + 30
+    assert extractor.threads_hydrated == 10
+    assert client.max_active <= 1 + 4
+    replies_of = [r for r in records if r["parent_thread_ts"] == "13.0"]
+    assert [r["timestamp"] for r in replies_of] == [
+        "13.0", "13.1", "13.2", "13.3"]
+    assert all(r["is_thread_reply"] for r in replies_of[1:])
+
+
+def test_channels_are_reported_done_after_their_replies(make_slack_client,
+                                                        slack_limits):
+    channels = {"C1": [["10.0", "11.0"]], "C2": [["20.0"]]}
+    replies = {"10.0": [["10.1"], ["10.2"]], "20.0": [["20.1"]]}
+    client = make_slack_client(channels, replies)
+    extractor = ChannelExtractor(client, limiter=RateLimiter(slack_limits))
+    events = []
+
+    async def collect():
+        async for record in extractor.stream(
+                await extractor.get_joined_channels(),
+                on_channel_done=lambda c: events.append(("done", c))):
+            events.append((record["channel_id"], record["timestamp"]))
+
+    asyncio.run(collect())
+    for channel, count in (("C1", 4), ("C2", 2)):
+        done = events.index(("done", channel))
+        assert len([e for e in events[:done] if e[0] == channel]) == count
+        assert not any(e[0] == channel for e in events[done + 1:])
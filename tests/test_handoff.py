@@ -0,0 +1,157 @@
+import gzip
+import json
+
+import pytest
+
+from src.pipeline.handoff import (SegmentedStageWriter, StageWriter,
+                                  load_records, read_manifest, read_records,
+                                  read_segment, write_records)
+from src.pipeline.preprocessing import MessageParser
+
+
+def make_record(text, ts, channel="C1", **overrides):
+    record = {
+        "channel_id": channel,
+        "channel_name": "general",
+        "user_id": "U1",
+        "message_text": text,
+        "message_type": "message",
+        "timestamp": ts,
+        "parent_thread_ts": ts,
+        "is_thread_reply": False,
+        "reactions": [{"name": "tada", "count": 2}],
+        "subtype": None,
+        "sent_by_bot_id": None,
+        "last_edited": None
+    }
+    record.update(overrides)
+    return record
+
+
+RECORDS = [
+    make_record("hello", "1746565594.746919"),
+    make_record("other channel", "1746565595.000001", channel="C2"),
+    make_record("a reply", "1746565596.000001",
+                parent_thread_ts="1746565594.746919", is_thread_reply=True),
+]
+
+
+@pytest.mark.parametrize("suffix", [".jsonl", ".jsonl.gz"])
+def test_round_trip_types_fields(tmp_path, suffix):
+    path = tmp_path / f"messages{suffix}"
+    with StageWriter(path, "extraction", block_size=2) as writer:
+        writer.write_many(RECORDS)
+
+    records = list(read_records(path))
+    assert len(records) == 3
+    assert records[0]["timestamp"] == pytest.approx(1746565594.746919)
+    assert records[1]["channel_id"] == "C2"
+    assert records[2]["parent_thread_ts"] == "1746565594.746919"
+    assert records[2]["is_thread_reply"] is True
+    assert records[0]["reactions"] == [{"name": "tada", "count": 2}]
+    assert records[0]["subtype"] is None
+
+
+def test_blocks_intern_repeated_strings(tmp_path):
+    path = tmp_path / "messages.jsonl"
+    with StageWriter(path, "extraction") as writer:
+        writer.write_many(RECORDS)
+
+    lines = path.read_text().splitlines()
+    header, block = json.loads(lines[0]), json.loads(lines[1])
+    assert header["stage"] == "extraction"
+    assert block["strings"]["channel_name"] == ["general"]
+    assert block["columns"]["channel_name"] == [0, 0, 0]
+
+
+def test_compressed_file_is_smaller_than_debug_json(tmp_path):
+    records = [make_record(f"message {i}", f"17465655{i:02d}.000001")
+               for i in range(100)]
+    write_records(tmp_path / "messages.jsonl.gz", "extraction", records)
+    write_records(tmp_path / "messages.json", "extraction", records)
+
+    compact = (tmp_path / "messages.jsonl.gz").stat().st_size
+    debug = (tmp_path / "messages.json").stat().st_size
+    assert compact < debug / 5
+    assert load_records(tmp_path / "messages.json") == records
+
+
+def test_writer_rejects_unknown_fields(tmp_path):
+    with StageWriter(tmp_path / "scored.jsonl", "scored") as writer:
+        with pytest.raises(ValueError):
+            writer.write({"message_text": "hi", "score": 1})
+
+
+def test_optional_fields_are_omitted(tmp_path):
+    path = tmp_path / "scored.jsonl.gz"
+    write_records(path, "scored", [
+        {"message_text": "hi", "timestamp": 1.0, "parent_thread_ts": "1.0",
+         "sentiment": "positive", "category": "Praise", "reactions": []},
+    ])
+    assert "thread_sentiment" not in load_records(path)[0]
+
+
+def test_plain_jsonl_without_header(tmp_path):
+    path = tmp_path / "messages.jsonl"
+    path.write_text("\n".join(json.dumps(r) for r in RECORDS) + "\n")
+    assert list(read_records(path)) == RECORDS
+
+
+def test_parser_reads_and_writes_stage_files(tmp_path):
+    source = tmp_path / "messages.jsonl.gz"
+    write_records(source, "extraction", RECORDS)
+
+    parser = MessageParser(str(source))
+    parser.load_messages()
+    grouped = parser.group_messages()
+    assert [m.message_text for m in grouped["C1"]["1746565594.746919"]] \
+        == ["hello", "a reply"]
+
+    output = tmp_path / "preprocessed.jsonl.gz"
+    parser = MessageParser(str(source))
+    parser.load_messages()
+    parser.get_messages_json(output)
+    with gzip.open(output, "rt") as f:
+        assert json.loads(f.readline())["stage"] == "preprocessed"
+    records = load_records(output)
+    assert [r["message_text"] for r in records] \
+        == ["hello", "a reply", "other channel"]
+
+
+@pytest.mark.parametrize("suffix", [".jsonl", ".jsonl.gz"])
+def test_segmented_writer_flushes_per_channel(tmp_path, suffix):
+    path = tmp_path / f"messages{suffix}"
+    records = [make_record(f"message {i}", f"{1000 + i}.000001",
+                           channel=f"C{i % 3}") for i in range(10)]
+
+    with SegmentedStageWriter(path, "extraction", block_size=2) as writer:
+        writer.write_many(records[:4])
+        writer.end_segment("C1")
+        # C0 filled a block, C1 ended and C2 is still buffered
+        manifest = read_manifest(path)
+        assert manifest["records"] == 3
+        writer.write_many(records[4:])
+
+    manifest = read_manifest(path)
+    assert manifest["records"] == 10
+    assert manifest["bytes"] == path.stat().st_size
+    by_channel = {}
+    for segment in manifest["segments"]:
+        by_channel.setdefault(segment["key"], []).extend(
+            read_segment(path, segment))
+    for channel, channel_records in by_channel.items():
+        assert [r["message_text"] for r in channel_records] == [
+            r["message_text"] for r in records if r["channel_id"] == channel]
+
+    # The whole file also reads as one stage file
+    assert sorted(r["message_text"] for r in read_records(path)) == \
+        sorted(r["message_text"] for r in records)
+
+
+def test_segmented_writer_zstd(tmp_path):
+    pytest.importorskip("zstandard")
+    path = tmp_path / "messages.jsonl.zst"
+    with SegmentedStageWriter(path, "extraction", block_size=1) as writer:
+        writer.write_many(RECORDS)
+    assert list(read_records(path)) == load_records(path)
+    assert len(read_manifest(path)["segments"]) == 3
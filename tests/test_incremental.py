@@ -0,0 +1,158 @@
+import json
+
+import boto3
+import pytest
+from moto import mock_aws
+
+from src.pipeline.handoff import load_records
+from src.pipeline.incremental import PreprocessState
+from src.pipeline.preprocessing import MessageParser
+
+DAY = 86400
+
+
+def texts(grouped):
+    return {parent_ts: [m.message_text for m in thread]
+            for channel in grouped.values()
+            for parent_ts, thread in channel.items()}
+
+
+def test_runs_only_process_new_messages(tmp_path, make_message):
+    path = tmp_path / "state.json"
+    first = [
+        make_message("build is broken", "1000.000001"),
+        make_message("on it", "1001.000001", "1000.000001"),
+        make_message("hello", "1002.000001", channel="C2"),
+    ]
+    state = PreprocessState(path)
+    assert texts(state.merge(first)) == {
+        "1000.000001": ["build is broken", "on it"],
+        "1002.000001": ["hello"]}
+    state.save()
+
+    # The next extraction overlaps the first one
+    second = first + [
+        make_message("fixed now", "2000.000001", "1000.000001"),
+        make_message("new topic", "2001.000001"),
+    ]
+    state = PreprocessState(path)
+    grouped = state.merge(second)
+    # Touched threads come back whole, untouched ones not at all
+    assert texts(grouped) == {
+        "1000.000001": ["build is broken", "on it", "fixed now"],
+        "2001.000001": ["new topic"]}
+    assert state.watermark("C1") == 2001.000001
+    assert state.watermark("C2") == 1002.000001
+    assert state.merge(second) == {}
+
+
+def test_refetched_edits_and_late_replies_are_new(tmp_path, make_message):
+    state = PreprocessState(tmp_path / "state.json")
+    state.merge([
+        make_message("build is broken", "1000.000001"),
+        make_message("on it", "1001.000001", "1000.000001"),
+        make_message("new topic", "2000.000001"),
+    ])
+
+    # A look-back window fetched again, with an edit and a reply that
+    # arrived after the newer topic
+    grouped = state.merge([
+        make_message("build is broken", "1000.000001"),
+        make_message("on it, reverting", "1001.000001", "1000.000001"),
+        make_message("reverted", "1500.000001", "1000.000001"),
+        make_message("new topic", "2000.000001"),
+    ])
+    assert texts(grouped) == {
+        "1000.000001": ["build is broken", "on it, reverting", "reverted"]}
+    assert state.watermark("C1") == 2000.000001
+
+
+def test_quiet_threads_are_pruned(tmp_path, make_message):
+    state = PreprocessState(tmp_path / "state.json", open_days=1)
+    state.merge([make_message("old", "1000.000001")])
+    state.merge([make_message("new", str(1000 + 2 * DAY))])
+
+    open_threads = state.channels["C1"]["open_threads"]
+    assert list(open_threads) == [str(1000 + 2 * DAY)]
+
+    # A late reply to a closed thread is passed on by itself
+    grouped = state.merge([
+        make_message("late reply", str(1001 + 2 * DAY), "1000.000001")])
+    assert texts(grouped) == {"1000.000001": ["late reply"]}
+
+
+@mock_aws
+def test_state_is_kept_in_s3(make_message):
+    s3 = boto3.client("s3", region_name="us-east-1")
+    s3.create_bucket(Bucket="slack-message-extract")
+    location = "s3://slack-message-extract/state/T1.json"
+
+    state = PreprocessState(location, s3_client=s3)
+    state.merge([make_message("build is broken", "1000.000001")])
+    state.save()
+
+    state = PreprocessState(location, s3_client=s3)
+    assert state.watermark("C1") == 1000.000001
+    assert state.merge([make_message("build is broken", "1000.000001")]) == {}
+
+
+def test_parser_groups_new_messages(tmp_path):
+    state_path = tmp_path / "state.json"
+    state_path.write_text(json.dumps({
+        "version": 1,
+        "channels": {"C08PH0ZMY7L": {
+            "watermark": 1746565594.746919,
+            "open_threads": {"1746565594.746919": [{
+                "message_text": "seen", "reactions": [],
+                "channel_id": "C08PH0ZMY7L", "channel_name": "general",
+                "timestamp": "1746565594.746919", "is_thread_reply": False,
+                "parent_thread_ts": "1746565594.746919"}]}}}}))
+    export = tmp_path / "messages.json"
+    export.write_text(json.dumps([
+        {"channel_id": "C08PH0ZMY7L", "channel_name": "general",
+         "user_id": "U1", "message_text": text, "message_type": "message",
+         "timestamp": ts, "parent_thread_ts": ts, "is_thread_reply": False,
+         "reactions": [], "subtype": None, "sent_by_bot_id": None,
+         "last_edited": None}
+        for text, ts in [("seen", "1746565594.746919"),
+                         ("unseen", "1746565595.000001")]]))
+
+    parser = MessageParser(str(export))
+    parser.load_messages()
+    grouped = parser.group_new_messages(PreprocessState(state_path))
+    assert texts(grouped) == {"1746565595.000001": ["unseen"]}
+
+
+@pytest.mark.parametrize("suffix", [".jsonl.gz", ".json"])
+def test_preprocessing_and_scoring_mains_in_sequence(
+        tmp_path, monkeypatch, make_record, neutral_analyzer,
+        keyword_classifier, suffix):
+    from src.pipeline import preprocessing, scoring
+
+    monkeypatch.setenv("PREPROCESS_STATE_PATH", str(tmp_path / "state.json"))
+    monkeypatch.setattr(scoring, "scoring_options_from_env", lambda: {
+        "sentiment_analyzer": neutral_analyzer,
+        "classifier": keyword_classifier})
+
+    def run(records, name):
+        export = tmp_path / f"{name}.json"
+        export.write_text(json.dumps(records))
+        # .json is the grouped debug output, read back by scoring too
+        preprocessed = tmp_path / f"{name}_preprocessed{suffix}"
+        scored = tmp_path / f"{name}_scored.jsonl.gz"
+        monkeypatch.setattr("sys.argv", ["preprocessing.py", str(export),
+                                         str(preprocessed)])
+        preprocessing.main()
+        monkeypatch.setattr("sys.argv", ["scoring.py", str(preprocessed),
+                                         str(scored)])
+        scoring.main()
+        return [r["message_text"] for r in load_records(str(scored))]
+
+    first = [make_record("why is the build broken", "1000.000001")]
+    assert run(first, "first") == ["why is the build broken"]
+
+    # Scoring gets the new messages preprocessing passed on, instead of
+    # finding them all behind the watermark preprocessing just saved
+    second = first + [make_record("we need to fix it", "2000.000001")]
+    assert run(second, "second") == ["we need to fix it"]
+    assert run(second, "third") == []
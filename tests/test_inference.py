@@ -0,0 +1,43 @@
+import pytest
+from src.pipeline.inference import load_backend
+from src.pipeline.scoring import SentimentAnalyzer, ZeroShotClassifier
+
+TEXTS = ["we need to fix the build", "thanks", "why is the release slow"]
+
+
+def test_unknown_backend_is_rejected(tiny_sentiment_model):
+    with pytest.raises(ValueError):
+        SentimentAnalyzer(model_name=tiny_sentiment_model, backend="tpu")
+
+
+def test_torch_backend_runs_in_inference_mode(tiny_sentiment_model):
+    sa = SentimentAnalyzer(model_name=tiny_sentiment_model)
+    encoded = sa.tokenizer(TEXTS, padding=True, return_tensors="pt")
+
+    logits = load_backend(sa.model, sa.tokenizer, "torch")(encoded)
+    assert logits.shape == (3, 3)
+    assert not logits.requires_grad
+
+
+@pytest.mark.parametrize("backend,tolerance", [("quantized", 0.1),
+                                               ("onnx", 1e-4)])
+def test_backends_match_torch(tiny_sentiment_model, tiny_nli_model,
+                              backend, tolerance):
+    if backend == "onnx":
+        pytest.importorskip("onnxruntime")
+
+    reference = SentimentAnalyzer(model_name=tiny_sentiment_model)
+    sa = SentimentAnalyzer(model_name=tiny_sentiment_model, backend=backend)
+    assert sa.fingerprint["backend"] == backend
+    for expected, scores in zip(reference.analyze_batch(TEXTS),
+                                sa.analyze_batch(TEXTS)):
+        assert scores.tolist() == pytest.approx(expected.tolist(),
+                                                abs=tolerance)
+
+    reference = ZeroShotClassifier(model_name=tiny_nli_model)
+    zcs = ZeroShotClassifier(model_name=tiny_nli_model, backend=backend)
+    for expected, result in zip(reference.classify_batch(TEXTS),
+                                zcs.classify_batch(TEXTS)):
+        expected_scores = dict(zip(expected["labels"], expected["scores"]))
+        scores = dict(zip(result["labels"], result["scores"]))
+        assert scores == pytest.approx(expected_scores, abs=tolerance)
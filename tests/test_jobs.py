@@ -0,0 +1,175 @@
+import threading
+
+import pytest
+
+from src.pipeline.handoff import SegmentedStageWriter, load_records
+from src.slack_app.handlers import link_latest, register_handlers
+from src.slack_app.jobs import MAX_RESPONSES, JobExecutor, JobQueueFull
+
+
+class Responses:
+    def __init__(self):
+        self.messages = []
+
+    def __call__(self, text):
+        self.messages.append(text)
+
+
+def test_jobs_run_on_bounded_workers():
+    executor = JobExecutor(max_workers=2, max_queued=1)
+    release = threading.Event()
+    started = []
+
+    def work(job):
+        started.append(job.job_id)
+        release.wait(5)
+        return f"done {job.job_id}"
+
+    responses = Responses()
+    first = executor.submit("extraction", work)
+    second = executor.submit("extraction", work)
+    third = executor.submit("extraction", work, respond=responses)
+    with pytest.raises(JobQueueFull):
+        executor.submit("extraction", work)
+
+    executor.wait_for_notices()
+    assert responses.messages == [
+        f"Job `{third.job_id}` is queued and starts after 1 other job(s) "
+        f"finish."]
+    assert executor.stats()["queued"] >= 1
+
+    release.set()
+    executor.shutdown(wait=True)
+    assert [job.status for job in (first, second, third)] == [
+        "succeeded"] * 3
+    assert responses.messages[-1] == f"done {third.job_id}"
+    assert executor.get(third.job_id) is third
+
+
+def test_failed_jobs_are_tracked():
+    executor = JobExecutor(max_workers=1)
+
+    def fail(job):
+        raise RuntimeError("boom")
+
+    job = executor.submit("extraction", fail)
+    executor.shutdown(wait=True)
+    assert job.status == "failed"
+    assert job.error == "boom"
+    assert executor.jobs(status="failed") == [job]
+
+
+def test_progress_responses_leave_room_for_the_result():
+    executor = JobExecutor(max_workers=1)
+    responses = Responses()
+
+    def chatty(job):
+        for i in range(10):
+            job.notify(f"step {i}")
+        return "finished"
+
+    executor.submit("extraction", chatty, respond=responses)
+    executor.shutdown(wait=True)
+    assert len(responses.messages) == MAX_RESPONSES
+    assert responses.messages[-1] == "finished"
+
+
+def test_jobs_with_the_same_key_are_coalesced():
+    executor = JobExecutor(max_workers=2, coalesce_window=60)
+    release = threading.Event()
+    runs = []
+
+    def work(job):
+        runs.append(job.job_id)
+        release.wait(5)
+        return "report ready"
+
+    first, second, other = Responses(), Responses(), Responses()
+    job = executor.submit("extraction", work, respond=first, key="T1")
+    assert executor.submit("extraction", work, respond=second,
+                           key="T1") is job
+    assert executor.submit("extraction", work, respond=other,
+                           key="T2") is not job
+    release.set()
+    executor.shutdown(wait=True)
+
+    assert len(runs) == 2
+    assert first.messages == ["report ready"]
+    assert "already running" in second.messages[0]
+    assert second.messages[-1] == "report ready"
+
+    # A repeat within the window gets the result without running again
+    late = Responses()
+    assert executor.submit("extraction", work, respond=late,
+                           key="T1") is job
+    executor.wait_for_notices()
+    assert late.messages == ["This was just run: report ready"]
+    assert len(runs) == 2
+
+
+def test_responses_are_not_sent_on_the_submitting_thread():
+    executor = JobExecutor(max_workers=1, max_queued=1)
+    release, responded = threading.Event(), threading.Event()
+    threads = []
+
+    def slow_respond(text):
+        threads.append(threading.current_thread().name)
+        release.wait(5)
+        responded.set()
+
+    job = executor.submit("extraction", lambda job: release.wait(5),
+                          key="T1")
+    # Neither joining nor being refused waits for the response
+    assert executor.submit("extraction", None, respond=slow_respond,
+                           key="T1") is job
+    executor.submit("extraction", lambda job: None)
+    with pytest.raises(JobQueueFull):
+        executor.submit("extraction", None)
+    executor.send(slow_respond, "Too many extractions")
+    assert not responded.is_set()
+
+    release.set()
+    executor.shutdown(wait=True)
+    assert threads == ["job-notifier"] * 2
+
+
+class FakeApp:
+    def __init__(self):
+        self.commands = {}
+
+    def command(self, name):
+        def register(func):
+            self.commands[name] = func
+            return func
+        return register
+
+
+def test_slash_command_only_acks_and_submits(mocker):
+    app = FakeApp()
+    executor = mocker.Mock()
+    register_handlers(app, mocker.Mock(), executor)
+
+    ack, respond = mocker.Mock(), mocker.Mock()
+    app.commands["/generate_feedback"](ack=ack, body={}, respond=respond,
+                                       logger=mocker.Mock())
+    ack.assert_called_once()
+    executor.submit.assert_called_once()
+    assert executor.submit.call_args.kwargs["respond"] is respond
+    assert executor.submit.call_args.kwargs["key"] == "extraction:None"
+
+    executor.submit.side_effect = JobQueueFull("full")
+    app.commands["/generate_feedback"](ack=ack, body={}, respond=respond,
+                                       logger=mocker.Mock())
+    assert executor.send.call_args.args[0] is respond
+    assert "try again" in executor.send.call_args.args[1]
+
+
+def test_latest_output_follows_the_newest_extraction(tmp_path, make_record):
+    latest = tmp_path / "messages.jsonl.gz"
+    for job_id in ["a1", "b2"]:
+        path = tmp_path / f"{job_id}_messages.jsonl.gz"
+        with SegmentedStageWriter(str(path), "extraction") as writer:
+            writer.write(make_record(job_id, "1000.000001"))
+        link_latest(str(path), str(latest))
+        assert [r["message_text"] for r in load_records(str(latest))] == [
+            job_id]
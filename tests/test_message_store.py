@@ -0,0 +1,90 @@
+import pytest
+
+from src.pipeline.message_store import MessageStore
+from src.pipeline.scoring import ScoringPipeline
+
+
+@pytest.fixture
+def thread_messages(make_message):
+    return [
+        make_message("why is the build broken", "100.000001"),
+        make_message("thanks", "100.000002", "100.000001"),
+        make_message("we need to fix it", "100.000003", "100.000001"),
+        make_message("hello team", "200.000001", channel="C2"),
+    ]
+
+
+def test_store_columns_and_views(thread_messages):
+    store = MessageStore(capacity=2)
+    messages = thread_messages
+    for message in messages:
+        store.add_message(message)
+
+    assert len(store) == 4
+    assert store.timestamp[:4].tolist() == pytest.approx(
+        [100.000001, 100.000002, 100.000003, 200.000001])
+    # Channel ids and thread timestamps share one interned string table
+    assert store.channel_id[0] == store.channel_id[2]
+    assert store.strings.values.count("100.000001") == 1
+    for message, view in zip(messages, store):
+        assert view.to_dict() == message.to_dict()
+    with pytest.raises(IndexError):
+        store[4]
+
+
+def test_store_groups_like_the_parser(thread_messages):
+    store = MessageStore.from_messages(thread_messages)
+    grouped = store.group()
+
+    assert list(grouped) == ["C1", "C2"]
+    thread = grouped["C1"]["100.000001"]
+    assert [m.message_text for m in thread] == [
+        "why is the build broken", "thanks", "we need to fix it"]
+    assert [r["message_text"] for r in store.records()][-1] == "hello team"
+
+
+def test_lexsort_grouping_matches_the_thread_index(make_message):
+    import random
+
+    from src.pipeline.thread_index import ThreadIndex
+
+    messages = [make_message(f"m{i}", f"{1000 + i // 3}.000001",
+                             f"{100 + i % 7}.000001", channel=f"C{i % 3}")
+                for i in range(60)]
+    random.Random(0).shuffle(messages)
+    store = MessageStore.from_messages(messages)
+    grouped = store.group()
+    expected = ThreadIndex.from_messages(messages).grouped()
+
+    assert list(grouped) == list(expected)
+    for channel_id, threads in expected.items():
+        assert list(grouped[channel_id]) == list(threads)
+        for parent_ts, thread in threads.items():
+            assert [m.message_text for m in grouped[channel_id][parent_ts]] \
+                == [m.message_text for m in thread]
+    assert MessageStore().group() == {}
+
+
+def test_pipeline_scores_into_store(thread_messages, neutral_analyzer,
+                                    keyword_classifier):
+    messages = thread_messages
+    grouped = {}
+    for message in messages:
+        grouped.setdefault(message.channel_id, {}).setdefault(
+            message.parent_thread_ts, []).append(message)
+
+    expected = ScoringPipeline(
+        grouped, sentiment_analyzer=neutral_analyzer,
+        classifier=keyword_classifier).score_messages()
+
+    store = MessageStore.from_messages(messages)
+    scored = ScoringPipeline(
+        store, sentiment_analyzer=neutral_analyzer,
+        classifier=keyword_classifier).score_messages()
+
+    assert len(scored) == len(expected) == 2
+    assert list(scored) == expected
+    assert store.label("category", 2) == "complaint"
+    assert store.sentiment_scores[2].tolist() == pytest.approx(
+        [0.1, 0.8, 0.1])
+    assert store.label("sentiment", 1) is None
@@ -0,0 +1,273 @@
+import importlib.util
+import json
+import os
+from pathlib import Path
+
+import boto3
+import pytest
+from moto import mock_aws
+
+from src.shared import orchestration
+
+LAMBDAS = Path(__file__).resolve().parent.parent / "lambdas"
+BUCKET = "slack-message-extract"
+
+
+def load_lambda(name):
+    spec = importlib.util.spec_from_file_location(
+        f"{name.replace('-', '_')}_lambda",
+        LAMBDAS / name / "lambda_function.py")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture
+def aws(monkeypatch):
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    with mock_aws():
+        sqs = boto3.client("sqs")
+        s3 = boto3.client("s3")
+        s3.create_bucket(Bucket=BUCKET)
+        for stage, (env, _) in orchestration.QUEUE_URLS.items():
+            url = sqs.create_queue(QueueName=f"{stage}-queue")["QueueUrl"]
+            monkeypatch.setenv(env, url)
+        yield sqs, s3
+
+
+def receive(sqs, stage):
+    url = os.environ[orchestration.QUEUE_URLS[stage][0]]
+    messages = sqs.receive_message(QueueUrl=url,
+                                   MaxNumberOfMessages=10).get("Messages",
+                                                               [])
+    return [json.loads(message["Body"]) for message in messages]
+
+
+def s3_event(key):
+    return {"Records": [{"s3": {"bucket": {"name": BUCKET},
+                                "object": {"key": key}}}]}
+
+
+def test_output_keys_round_trip():
+    for stage in orchestration.STAGES:
+        key = orchestration.output_key(stage, "T1", "20250101_120000")
+        assert orchestration.parse_output_key(key) == (
+            stage, "T1", "20250101_120000")
+    assert orchestration.parse_output_key("runs/T1/x.json") is None
+    assert orchestration.parse_output_key(
+        "extractions/T1/20250101_120000_messages.json") == (
+        "extraction", "T1", "20250101_120000")
+    assert orchestration.parse_output_key(
+        "preprocessed/T1/20250101_120000_preprocessed.json") == (
+        "ml", "T1", "20250101_120000")
+    assert orchestration.next_stage("pdf") is None
+
+
+def test_slash_command_only_starts_extraction(aws):
+    sqs, s3 = aws
+    handler = load_lambda("slack-slash-command")
+    response = handler.lambda_handler(
+        {"headers": {}, "body": "team_id=T1&channel_id=C1&user_id=U1"
+                                "&response_url=https%3A%2F%2Fhooks"}, None)
+    assert response["statusCode"] == 200
+
+    extraction = receive(sqs, "extraction")
+    assert len(extraction) == 1
+    assert extraction[0]["team_id"] == "T1"
+    assert extraction[0]["response_url"] == "https://hooks"
+    for stage in ("ml", "insights", "pdf"):
+        assert receive(sqs, stage) == []
+
+    run_id = extraction[0]["run_id"]
+    run = json.loads(s3.get_object(
+        Bucket=BUCKET, Key=orchestration.run_key("T1", run_id))["Body"]
+        .read())
+    assert run["original_request"]["channel_id"] == "C1"
+
+
+def test_each_stage_output_starts_the_next_stage(aws):
+    sqs, s3 = aws
+    run = {"team_id": "T1", "run_id": "20250101_120000",
+           "original_request": {"channel_id": "C1"}}
+    orchestration.start_run(sqs, s3, run)
+    key = receive(sqs, "extraction")[0]["output_key"]
+
+    router = load_lambda("stage-router")
+    for stage in ("ml", "insights", "pdf"):
+        s3.put_object(Bucket=BUCKET, Key=key, Body=b"output")
+        response = router.lambda_handler(s3_event(key), None)
+        assert json.loads(response["body"])["started"] == [
+            {"key": key, "next_stage": stage}]
+
+        message = receive(sqs, stage)[0]
+        assert message["run_id"] == "20250101_120000"
+        if stage == "ml":
+            assert message["s3_key"] == key
+            assert message["original_request"] == {"channel_id": "C1"}
+        else:
+            assert (message["bucket"], message["key"]) == (BUCKET, key)
+        key = message["output_key"]
+
+    # The report is the last stage and other objects are ignored
+    assert orchestration.stage_done(sqs, s3, BUCKET, key) is None
+    assert orchestration.stage_done(sqs, s3, BUCKET, "misc/file") is None
+
+
+def test_slash_command_reuses_clients_between_invocations(aws, monkeypatch):
+    sqs, _ = aws
+    monkeypatch.setenv("RUN_DEDUPE_WINDOW_SECONDS", "0")
+    handler = load_lambda("slack-slash-command")
+    event = {"headers": {}, "body": "team_id=T1&channel_id=C1&user_id=U1"}
+    handler.lambda_handler(event, None)
+    clients = dict(handler._clients)
+    handler.lambda_handler(event, None)
+    assert set(clients) == {"sqs", "s3"}
+    assert all(handler._clients[name] is clients[name] for name in clients)
+    assert len(receive(sqs, "extraction")) == 2
+
+
+def slash_command(handler, channel):
+    response = handler.lambda_handler(
+        {"headers": {}, "body": f"team_id=T1&channel_id={channel}"
+                                f"&user_id=U1"}, None)
+    assert response["statusCode"] == 200
+    return json.loads(response["body"])["text"]
+
+
+def test_repeated_slash_commands_join_the_run_in_flight(aws):
+    sqs, s3 = aws
+    handler = load_lambda("slack-slash-command")
+    slash_command(handler, "C1")
+    assert "already being generated" in slash_command(handler, "C2")
+
+    extraction = receive(sqs, "extraction")
+    assert len(extraction) == 1
+    run_id = extraction[0]["run_id"]
+    attached = orchestration.attached_requests(s3, BUCKET, "T1", run_id)
+    assert [request["channel_id"] for request in attached] == ["C2"]
+
+    # Until the report is delivered, requests still join the run
+    s3.put_object(Bucket=BUCKET, Body=b"%PDF",
+                  Key=orchestration.output_key("pdf", "T1", run_id))
+    assert "already being generated" in slash_command(handler, "C3")
+    assert receive(sqs, "extraction") == []
+
+    # Afterwards they start a new run instead of missing the report
+    orchestration.mark_delivered(s3, BUCKET, "T1", run_id)
+    assert "Starting" in slash_command(handler, "C4")
+    assert len(receive(sqs, "extraction")) == 1
+
+
+def request(sqs, s3, team_id, run_id, now, **kwargs):
+    run = {"team_id": team_id, "run_id": run_id,
+           "original_request": {"channel_id": "C1"}}
+    active, started = orchestration.request_run(sqs, s3, run, now=now,
+                                                window=900, **kwargs)
+    return active["run_id"], started
+
+
+def test_runs_are_deduplicated_per_team_and_window(aws):
+    sqs, s3 = aws
+    assert request(sqs, s3, "T1", "a", 1799) == ("a", True)
+    # The window starts with the run, not at a fixed boundary
+    assert request(sqs, s3, "T1", "b", 1801) == ("a", False)
+    assert request(sqs, s3, "T2", "c", 1801) == ("c", True)
+    assert request(sqs, s3, "T1", "d", 2699) == ("d", True)
+    assert request(sqs, s3, "T1", "e", 2700) == ("d", False)
+    assert len(receive(sqs, "extraction")) == 3
+
+
+def test_stalled_runs_are_replaced(aws):
+    sqs, s3 = aws
+    assert request(sqs, s3, "T1", "a", 1000, stall=300) == ("a", True)
+    assert request(sqs, s3, "T1", "b", 1200, stall=300) == ("a", False)
+    # No stage of a has written output since it started
+    assert request(sqs, s3, "T1", "c", 1300, stall=300) == ("c", True)
+
+    # Stage output counts as progress, under the legacy names too
+    assert request(sqs, s3, "T2", "d", 1000, stall=300) == ("d", True)
+    orchestration.stage_done(sqs, s3, BUCKET,
+                             "extractions/T2/d_messages.json", now=1250)
+    assert request(sqs, s3, "T2", "e", 1500, stall=300) == ("d", False)
+    assert request(sqs, s3, "T2", "f", 1550, stall=300) == ("f", True)
+    # Requests are only attached to the run that answers them
+    assert orchestration.attached_requests(s3, BUCKET, "T1", "a") == [
+        {"channel_id": "C1", "requested_at": None}]
+
+
+def test_requests_racing_the_delivery_start_a_new_run(aws, monkeypatch):
+    sqs, s3 = aws
+    assert request(sqs, s3, "T1", "a", 1000) == ("a", True)
+
+    # The delivery lists the attached requests just before this one is
+    # attached
+    attach_request = orchestration.attach_request
+
+    def attach_late(s3, run, claimed):
+        orchestration.mark_delivered(s3, BUCKET, "T1", claimed)
+        return attach_request(s3, run, claimed)
+
+    monkeypatch.setattr(orchestration, "attach_request", attach_late)
+    assert request(sqs, s3, "T1", "b", 1001) == ("b", True)
+    assert orchestration.attached_requests(s3, BUCKET, "T1", "a") == []
+    assert len(receive(sqs, "extraction")) == 2
+
+
+def test_report_is_delivered_to_attached_channels(aws, mocker, monkeypatch):
+    sqs, s3 = aws
+    monkeypatch.setenv("SLACK_BOT_TOKEN", "xoxb-test")
+    monkeypatch.setenv("SLACK_CHANNEL_ID", "C0")
+    for run_id, channel in (("a", "C1"), ("b", "C2"), ("c", "C0")):
+        orchestration.request_run(
+            sqs, s3, {"team_id": "T1", "run_id": run_id,
+                      "original_request": {"channel_id": channel}},
+            now=1000, window=900)
+    key = orchestration.output_key("pdf", "T1", "a")
+    s3.put_object(Bucket=BUCKET, Key=key, Body=b"%PDF")
+
+    delivery = load_lambda("slack-pdf-delivery")
+    slack = mocker.patch.object(delivery, "WebClient").return_value
+    delivery.lambda_handler(s3_event(key), None)
+    channels = [call.kwargs["channel"]
+                for call in slack.files_upload_v2.call_args_list]
+    assert channels == ["C0", "C2"]
+
+
+def test_channels_the_bot_is_not_in_do_not_fail_the_delivery(
+        aws, mocker, monkeypatch):
+    sqs, s3 = aws
+    monkeypatch.setenv("SLACK_BOT_TOKEN", "xoxb-test")
+    monkeypatch.setenv("SLACK_CHANNEL_ID", "C0")
+    for run_id, channel in (("a", "C1"), ("b", "D2"), ("c", "C3")):
+        orchestration.request_run(
+            sqs, s3, {"team_id": "T1", "run_id": run_id,
+                      "original_request": {
+                          "channel_id": channel,
+                          "response_url": f"https://hooks/{channel}"}},
+            now=1000, window=900)
+    key = orchestration.output_key("pdf", "T1", "a")
+    s3.put_object(Bucket=BUCKET, Key=key, Body=b"%PDF")
+
+    delivery = load_lambda("slack-pdf-delivery")
+    slack = mocker.patch.object(delivery, "WebClient").return_value
+
+    def upload(channel, **kwargs):
+        if channel == "D2":
+            raise RuntimeError("not_in_channel")
+
+    slack.files_upload_v2.side_effect = upload
+    urlopen = mocker.patch.object(delivery.urllib.request, "urlopen")
+    delivery.lambda_handler(s3_event(key), None)
+    channels = [call.kwargs["channel"]
+                for call in slack.files_upload_v2.call_args_list]
+    # Attached requests are listed in no particular order
+    assert channels[0] == "C0" and sorted(channels[1:]) == ["C3", "D2"]
+    # The command from D2 is told where the report went instead
+    request = urlopen.call_args.args[0]
+    assert request.full_url == "https://hooks/D2"
+    assert "<#C0>" in json.loads(request.data)["text"]
+
+    # The configured channel failing still fails the invocation
+    slack.files_upload_v2.side_effect = RuntimeError("channel_not_found")
+    with pytest.raises(RuntimeError):
+        delivery.lambda_handler(s3_event(key), None)
@@ -2,8 +2,10 @@ import sys
 import json
 import tempfile
 import os
+import pytest
 # Import the MessageParser class from the module
-from src.pipeline.preprocessing import MessageParser
+from src.pipeline.preprocessing import (MessageParser, TextNormalizer,
+                                        iter_records)
 
 
 def test_json_single_message(monkeypatch, capsys):
@@ -48,3 +50,112 @@ def test_json_single_message(monkeypatch, capsys):
 
     # Clean up the temporary file
     os.remove(temp_file_path)
+
+
+@pytest.fixture
+def export(make_record):
+    return [
+        make_record("hello", "1746565594.746919"),
+        make_record("bot says hi", "1746565595.000001", sent_by_bot_id="B1"),
+        make_record("joined", "1746565596.000001", subtype="channel_join"),
+        make_record("a reply with \"quotes\", [brackets] and {braces}",
+                    "1746565597.000001", parent_thread_ts="1746565594.746919",
+                    is_thread_reply=True),
+    ]
+
+
+def test_iter_records_streams_array_and_jsonl(tmp_path, export):
+    array_path = tmp_path / "messages.json"
+    array_path.write_text(json.dumps(export, indent=2))
+    jsonl_path = tmp_path / "messages.jsonl"
+    jsonl_path.write_text("\n".join(json.dumps(r) for r in export) + "\n")
+
+    for path in (array_path, jsonl_path):
+        with open(path) as file:
+            # Tiny chunks force records to span several reads
+            assert list(iter_records(file, chunk_size=7)) == export
+
+
+def test_streaming_parser_groups_lazily(tmp_path, export):
+    path = tmp_path / "messages.json"
+    path.write_text(json.dumps(export))
+
+    eager = MessageParser(str(path))
+    eager.load_messages()
+    eager.group_messages()
+
+    streaming = MessageParser(str(path), streaming=True)
+    streaming.load_messages()
+    streaming.group_messages()
+
+    assert streaming.ungrouped_messages == []
+    thread = streaming.grouped_messages["C08PH0ZMY7L"]["1746565594.746919"]
+    assert [m.message_text for m in thread] == [
+        "hello", "a reply with \"quotes\", [brackets] and {braces}"]
+    assert ([m.to_dict() for m in thread] ==
+            [m.to_dict() for m in
+             eager.grouped_messages["C08PH0ZMY7L"]["1746565594.746919"]])
+
+
+def test_streaming_parser_rejects_truncated_file(tmp_path, export):
+    path = tmp_path / "messages.json"
+    path.write_text(json.dumps(export)[:-20])
+
+    parser = MessageParser(str(path), streaming=True)
+    with pytest.raises(SystemExit):
+        parser.group_messages()
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("hey <@U123ABC> see <https://x.com/a?b=1|the doc> :tada:",
+     "hey @user see the doc"),
+    ("<!here> build is broken\n```Traceback\n  File x```",
+     "@here build is broken [code]"),
+    ("ask in <#C0123|support> or <!subteam^S1|@devs>",
+     "ask in #support or @devs"),
+    ("`make test` fails at 10:30:45 &amp; <https://ci.example.com>",
+     "make test fails at 10:30:45 & link"),
+])
+def test_normalize_slack_markup(text, expected):
+    assert TextNormalizer.normalize(text) == expected
+
+
+def test_parser_drops_empty_messages_and_reports_savings(tmp_path, capsys,
+                                                         make_record):
+    path = tmp_path / "messages.json"
+    path.write_text(json.dumps([
+        make_record("", "100.000001"),
+        make_record(":+1::skin-tone-2:", "101.000001"),
+        make_record("<@U1> the deploy failed :cry:", "102.000001"),
+    ]))
+
+    normalizer = TextNormalizer()
+    parser = MessageParser(str(path), normalizer=normalizer)
+    messages = parser.load_messages()
+
+    assert [m.message_text for m in messages] == ["@user the deploy failed"]
+    stats = normalizer.stats()
+    assert stats["checked"] == 3
+    assert stats["dropped"] == 2
+    assert stats["tokens_saved"] == stats["tokens_before"] - 5
+    assert "dropped 2 of 3 messages" in capsys.readouterr().out
+
+
+@pytest.mark.parametrize("suffix", [".jsonl.gz", ".json"])
+def test_preprocessed_records_are_not_normalized_again(tmp_path, capsys,
+                                                       make_record, suffix):
+    export = tmp_path / "messages.json"
+    export.write_text(json.dumps([
+        make_record("use &amp;lt;br&amp;gt; tags", "100.000001")]))
+    preprocessed = tmp_path / f"preprocessed{suffix}"
+    parser = MessageParser(str(export), normalizer=TextNormalizer())
+    parser.load_messages()
+    parser.get_messages_json(str(preprocessed))
+    capsys.readouterr()
+
+    normalizer = TextNormalizer()
+    parser = MessageParser(str(preprocessed), normalizer=normalizer)
+    assert [m.message_text for m in parser.load_messages()] == [
+        "use &lt;br&gt; tags"]
+    assert normalizer.checked == 0
+    assert "Normalization" not in capsys.readouterr().out
@@ -0,0 +1,86 @@
+import json
+import threading
+
+import pytest
+
+from src.pipeline.runner import PipelineRunner, Stage, run_stages
+
+
+def test_independent_stages_overlap():
+    barrier = threading.Barrier(2, timeout=5)
+
+    def independent(name):
+        def run():
+            # Deadlocks unless both stages run at the same time
+            barrier.wait()
+            return name
+        return run
+
+    results = run_stages([
+        Stage("join", lambda left, right: left + right,
+              requires=("left", "right")),
+        Stage("left", independent("a")),
+        Stage("right", independent("b")),
+    ])
+    assert results == {"left": "a", "right": "b", "join": "ab"}
+
+
+def test_stage_errors_and_bad_requirements():
+    def fail():
+        raise RuntimeError("boom")
+
+    with pytest.raises(RuntimeError):
+        run_stages([Stage("fail", fail),
+                    Stage("after", lambda fail: fail, requires=("fail",))])
+    with pytest.raises(ValueError):
+        run_stages([Stage("a", lambda: 1, requires=("missing",))])
+    with pytest.raises(ValueError):
+        run_stages([Stage("a", lambda b: b, requires=("b",)),
+                    Stage("b", lambda a: a, requires=("a",))])
+
+
+def test_pipeline_runs_end_to_end(tmp_path, make_record, neutral_analyzer,
+                                  keyword_classifier):
+    export = tmp_path / "messages.json"
+    export.write_text(json.dumps([
+        make_record("why is the build broken <@U1>", "100.000001"),
+        make_record("thanks", "101.000001", parent_thread_ts="100.000001",
+                    is_thread_reply=True),
+        make_record(":tada:", "102.000001"),
+    ]))
+
+    seen = []
+
+    def insights(scored):
+        seen.extend(scored)
+        return {"actionable_next_steps": ["Fix the build"]}
+
+    runner = PipelineRunner(
+        str(export), report_path=tmp_path / "report.pdf",
+        persist_dir=tmp_path / "intermediates",
+        scoring_options={"sentiment_analyzer": neutral_analyzer,
+                         "classifier": keyword_classifier},
+        generate_insights=insights)
+    results = runner.run()
+
+    assert [m["message_text"] for m in seen] == [
+        "why is the build broken @user"]
+    assert results["report"] == tmp_path / "report.pdf"
+    assert (tmp_path / "report.pdf").read_bytes().startswith(b"%PDF")
+    assert sorted(p.name for p in (tmp_path / "intermediates").iterdir()) \
+        == ["insights.json", "preprocessed.jsonl.gz", "scored.jsonl.gz"]
+
+
+def test_intermediates_are_only_persisted_on_request(
+        tmp_path, make_record, neutral_analyzer, keyword_classifier):
+    export = tmp_path / "messages.json"
+    export.write_text(json.dumps([make_record("why is it slow",
+                                              "100.000001")]))
+    runner = PipelineRunner(
+        str(export), report_path=None,
+        scoring_options={"sentiment_analyzer": neutral_analyzer,
+                         "classifier": keyword_classifier},
+        generate_insights=lambda scored: {"count": len(scored)})
+
+    assert runner.run()["insights"] == {"count": 1}
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["messages.json"]
@@ -0,0 +1,90 @@
+import time
+from src.pipeline.preprocessing import UnscoredMessage
+from src.pipeline.score_cache import ScoreCache
+from src.pipeline.scoring import ScoringPipeline
+import torch
+
+
+class CountingAnalyzer:
+    fingerprint = {"model": "counting-sentiment", "revision": "1"}
+    max_input_tokens = 62
+
+    def __init__(self, tokenizer):
+        self.tokenizer = tokenizer
+        self.texts = []
+
+    def encode(self, texts):
+        return self.tokenizer(list(texts),
+                              add_special_tokens=False)["input_ids"]
+
+    def analyze_encoded(self, input_ids, batch_size=None):
+        self.texts.extend(self.tokenizer.decode(ids) for ids in input_ids)
+        return [torch.tensor([0.7, 0.2, 0.1]) for _ in input_ids]
+
+
+class CountingClassifier:
+    fingerprint = {"model": "counting-nli", "revision": "1"}
+
+    def __init__(self):
+        self.texts = []
+
+    def classify_batch(self, texts, labels=None):
+        self.texts.extend(texts)
+        return [{"sequence": text, "labels": ["complaint", "other"],
+                 "scores": [0.9, 0.1]} for text in texts]
+
+
+def make_unscored(texts):
+    threads = {}
+    for i, text in enumerate(texts):
+        ts = f"{1000 + i}.000001"
+        threads[ts] = [UnscoredMessage(text, [], "C1", "general", ts,
+                                       False, ts)]
+    return {"C1": threads}
+
+
+def test_make_key_depends_on_every_part():
+    key = ScoreCache.make_key("sentiment", {"model": "a"}, "hello")
+    assert key == ScoreCache.make_key("sentiment", {"model": "a"}, "hello")
+    assert key != ScoreCache.make_key("sentiment", {"model": "b"}, "hello")
+    assert key != ScoreCache.make_key("sentiment", {"model": "a"}, "hello!")
+
+
+def test_get_and_put_count_hits_and_misses(tmp_path):
+    cache = ScoreCache(tmp_path / "scores.db")
+    cache.put_many({"a": [0.1, 0.2, 0.7]})
+
+    assert cache.get_many(["a", "b"]) == {"a": [0.1, 0.2, 0.7]}
+    assert cache.stats() == {"hits": 1, "misses": 1, "hit_rate": 0.5}
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = ScoreCache(tmp_path / "scores.db", max_entries=2)
+    cache.put_many({"a": 1})
+    time.sleep(0.01)
+    cache.put_many({"b": 2})
+    time.sleep(0.01)
+    cache.get_many(["a"])
+    time.sleep(0.01)
+    cache.put_many({"c": 3})
+
+    assert len(cache) == 2
+    assert set(cache.get_many(["a", "b", "c"])) == {"a", "c"}
+
+
+def test_rerun_only_scores_new_messages(tmp_path, tiny_tokenizer):
+    cache = ScoreCache(tmp_path / "scores.db")
+    sa, zcs = CountingAnalyzer(tiny_tokenizer), CountingClassifier()
+    first = ScoringPipeline(make_unscored(["build is broken", "why"]),
+                            sentiment_analyzer=sa, classifier=zcs,
+                            cache=cache).score_messages()
+
+    sa.texts, zcs.texts = [], []
+    second = ScoringPipeline(
+        make_unscored(["build is broken", "why", "release is slow"]),
+        sentiment_analyzer=sa, classifier=zcs, cache=cache).score_messages()
+
+    assert sa.texts == ["release is slow"]
+    assert zcs.texts == ["release is slow"]
+    assert second[:2] == first
+    assert cache.hits == 4
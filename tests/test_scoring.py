@@ -0,0 +1,254 @@
+import pytest
+import torch
+from src.pipeline.scoring import (CATEGORY_LABELS, ScoringPipeline,
+                                  SentimentAnalyzer, ZeroShotClassifier,
+                                  length_sorted_batches, shard_threads)
+from src.pipeline.context import ThreadContext
+from src.pipeline.score_cache import ScoreCache
+
+
+def test_length_sorted_batches():
+    batches = list(length_sorted_batches([5, 1, 3, 2, 4], 2))
+    assert batches == [[1, 3], [2, 4], [0]]
+
+
+def test_analyze_batch_matches_single_messages(tiny_sentiment_model):
+    sa = SentimentAnalyzer(model_name=tiny_sentiment_model, batch_size=2)
+    texts = ["we need to fix the build", "thanks", "i love this team",
+             "why is the release slow", "ok"]
+
+    batched = sa.analyze_batch(texts)
+    assert len(batched) == len(texts)
+    for text, scores in zip(texts, batched):
+        single = sa.analyze_sentiment(text)
+        assert scores.shape == (3,)
+        assert float(scores.sum()) == pytest.approx(1.0, abs=1e-5)
+        assert scores.tolist() == pytest.approx(single.tolist(), abs=1e-5)
+
+    assert sa.analyze_batch([]) == []
+
+
+def test_classify_batch_matches_zero_shot_pipeline(tiny_nli_model):
+    from transformers import pipeline
+
+    reference = pipeline("zero-shot-classification", model=tiny_nli_model)
+    zcs = ZeroShotClassifier(model_name=tiny_nli_model, batch_size=4)
+    texts = ["we need to fix the build", "thanks", "why is the release slow"]
+
+    results = zcs.classify_batch(texts)
+    assert len(results) == len(texts)
+    for text, result in zip(texts, results):
+        expected = reference(text, CATEGORY_LABELS)
+        assert result["sequence"] == text
+        assert result["labels"] == expected["labels"]
+        assert result["scores"] == pytest.approx(expected["scores"],
+                                                 abs=1e-5)
+    single = zcs.classify(texts[1])
+    assert single["labels"] == results[1]["labels"]
+    assert single["scores"] == pytest.approx(results[1]["scores"], abs=1e-5)
+
+
+def test_score_messages_uses_kept_messages_as_context(
+        make_message, neutral_analyzer, keyword_classifier):
+    thread = [
+        make_message("why is the build broken", "100.000001"),
+        make_message("thanks", "100.000002", "100.000001"),
+        make_message("we need to fix it", "100.000003", "100.000001"),
+    ]
+    single = [make_message("hello team", "200.000001")]
+    unscored = {"C1": {"100.000001": thread, "200.000001": single}}
+
+    classifier = keyword_classifier
+    pipeline = ScoringPipeline(unscored,
+                               sentiment_analyzer=neutral_analyzer,
+                               classifier=classifier)
+    pipeline.score_messages()
+
+    # Threads are scored breadth-first, one batch per reply depth
+    assert classifier.calls[:2] == ["why is the build broken", "hello team"]
+    # Context only grows with messages that survived the filter
+    assert classifier.calls[2] == "why is the build broken\nthanks"
+    assert classifier.calls[3] == ("why is the build broken\n"
+                                   "we need to fix it")
+    # Kept messages come back grouped by thread in the input order
+    timestamps = [m["timestamp"] for m in pipeline.scored_messages]
+    assert timestamps == [100.000001, 100.000003]
+
+
+def test_shard_threads_keeps_threads_whole():
+    threads = [["m"] * 5, ["m"], ["m"] * 3, ["m"] * 2, ["m"]]
+    shards = shard_threads(threads, 2)
+
+    assert sorted(t for shard in shards for t in shard) == [0, 1, 2, 3, 4]
+    loads = [sum(len(threads[t]) for t in shard) for shard in shards]
+    assert sorted(loads) == [6, 6]
+    assert shard_threads(threads[:1], 4) == [[0]]
+
+
+def test_parallel_scoring_matches_serial(tiny_sentiment_model,
+                                         tiny_nli_model, make_message):
+    unscored = {"C1": {}, "C2": {}}
+    texts = ["why is the build broken", "thanks", "we need to fix it",
+             "i love this team", "when will we ship", "ok sure"]
+    for i, text in enumerate(texts):
+        channel = unscored["C1" if i % 2 else "C2"]
+        root = f"{100 + i}.000001"
+        channel[root] = [make_message(text, root)]
+        for j, reply in enumerate(texts[:i % 3]):
+            channel[root].append(
+                make_message(reply, f"{100 + i}.00001{j}", root))
+
+    sa = SentimentAnalyzer(model_name=tiny_sentiment_model)
+    zcs = ZeroShotClassifier(model_name=tiny_nli_model)
+    serial = ScoringPipeline(unscored, sentiment_analyzer=sa,
+                             classifier=zcs).score_messages()
+    parallel = ScoringPipeline(unscored, sentiment_analyzer=sa,
+                               classifier=zcs, workers=3).score_messages()
+
+    assert len(serial) > 0
+    assert parallel == serial
+
+
+def test_thread_context_keeps_root_and_recent_replies(tiny_tokenizer,
+                                                      neutral_analyzer):
+    context = ThreadContext(tiny_tokenizer, max_tokens=8)
+    encode = neutral_analyzer.encode
+    for text in ["why is the build broken", "we need to fix it",
+                 "ok sure", "thanks"]:
+        context.add(text, encode([text])[0])
+
+    text, ids = context.build("when will we ship", encode(["when"])[0])
+    # Root (5 tokens) always fits first, then the newest replies
+    assert text == "why is the build broken\nthanks\nwhen will we ship"
+    assert len(ids) == 7
+    # Replies that can no longer fit next to the root were dropped
+    assert [entry for entry, _ in context.recent] == ["ok sure", "thanks"]
+
+    long_text = " ".join(["team"] * 12)
+    text, ids = context.build(long_text, encode([long_text])[0])
+    assert ids == encode([" ".join(["team"] * 8)])[0]
+    assert text == " ".join(["team"] * 8)
+
+
+def test_long_threads_stay_within_token_budget(
+        make_message, neutral_analyzer, keyword_classifier):
+    root = "100.000001"
+    thread = [make_message("why is the build broken", root)]
+    for i in range(30):
+        thread.append(make_message("we need to fix it",
+                                   f"100.0001{i:02d}", root))
+    sa = neutral_analyzer
+    pipeline = ScoringPipeline({"C1": {root: thread}},
+                               sentiment_analyzer=sa,
+                               classifier=keyword_classifier,
+                               context_tokens=20)
+    pipeline.score_messages()
+
+    assert len(pipeline.scored_messages) == 31
+    assert max(len(ids) for ids in sa.inputs) <= 20
+    assert pipeline.scored_messages[-1]["message_text"].startswith(
+        "why is the build broken\n")
+
+
+def test_analyze_threads_encodes_each_chunk_once(tiny_sentiment_model):
+    sa = SentimentAnalyzer(model_name=tiny_sentiment_model, batch_size=1)
+    passes = []
+    sa.model.base_model.register_forward_hook(
+        lambda module, args, output: passes.append(1))
+
+    short = sa.encode(["why is the build broken", "thanks", ""])
+    # 6 messages of 19 tokens, 21 with <s> and </s>, need two 64-token chunks
+    long = sa.encode([" ".join(["team"] * 19)] * 6)
+    results = sa.analyze_threads([short, long])
+
+    assert [len(thread) for thread in results] == [3, 6]
+    assert all(scores.shape == (3,) for thread in results
+               for scores in thread)
+    assert len(passes) == 1 + 2
+
+
+def test_analyze_threads_reads_chunk_starts_like_single_messages(
+        tiny_sentiment_model):
+    sa = SentimentAnalyzer(model_name=tiny_sentiment_model)
+    texts = ["why is the build broken", "the build is broken again",
+             "thanks", "ok"]
+    ids = sa.encode(texts)
+    per_message = sa.analyze_encoded(ids)
+
+    # A message on its own is read exactly where the head was trained to
+    singles = sa.analyze_threads([[message_ids] for message_ids in ids])
+    for (scores,), expected in zip(singles, per_message):
+        assert torch.allclose(scores, expected, atol=1e-5)
+
+    # With room for one long message per chunk the thread packs as
+    # [0], [1], [2, 3]: a message that fills its chunk keeps its
+    # per-message scores, while a packed message also attends to its
+    # neighbour and the second one is read at shifted positions
+    sa.max_input_tokens = max(len(message_ids) for message_ids in ids)
+    thread = sa.analyze_threads([ids])[0]
+    assert len(thread) == len(texts)
+    for scores, expected in zip(thread[:2], per_message[:2]):
+        assert torch.allclose(scores, expected, atol=1e-5)
+    for scores, expected in zip(thread[2:], per_message[2:]):
+        assert torch.allclose(scores.sum(), torch.tensor(1.0))
+        assert not torch.allclose(scores, expected, atol=1e-5)
+
+
+def test_analyze_threads_falls_back_without_a_thread_pass(
+        tiny_sentiment_model):
+    sa = SentimentAnalyzer(model_name=tiny_sentiment_model)
+    ids = sa.encode(["why is the build broken", "thanks"])
+    expected = sa.analyze_encoded(ids)
+
+    # e.g. a BERT-style head, or the ONNX backend
+    sa.model.config.model_type = "bert"
+    assert not sa.supports_thread_pass()
+    results = sa.analyze_threads([ids])[0]
+    for scores, row in zip(results, expected):
+        assert torch.allclose(scores, row)
+
+
+def test_thread_mode_uses_the_score_cache(tiny_sentiment_model, tmp_path,
+                                          make_message, keyword_classifier):
+    root = "100.000001"
+    thread = [make_message("why is the build broken", root),
+              make_message("thanks", "100.000002", root)]
+    sa = SentimentAnalyzer(model_name=tiny_sentiment_model)
+    passes = []
+    sa.model.base_model.register_forward_hook(
+        lambda module, args, output: passes.append(1))
+
+    runs = []
+    for _ in range(2):
+        cache = ScoreCache(str(tmp_path / "cache.db"))
+        pipeline = ScoringPipeline(
+            {"C1": {root: thread}}, sentiment_analyzer=sa,
+            classifier=keyword_classifier, mode="thread", cache=cache)
+        runs.append(pipeline.score_messages())
+    assert len(passes) == 1
+    assert runs[0] == runs[1]
+
+
+def test_thread_mode_scores_messages_without_prefix(tiny_sentiment_model,
+                                                    make_message,
+                                                    keyword_classifier):
+    root = "100.000001"
+    thread = [make_message("why is the build broken", root),
+              make_message("thanks", "100.000002", root),
+              make_message("we need to fix it", "100.000003", root)]
+    classifier = keyword_classifier
+    pipeline = ScoringPipeline(
+        {"C1": {root: thread}},
+        sentiment_analyzer=SentimentAnalyzer(
+            model_name=tiny_sentiment_model),
+        classifier=classifier, mode="thread")
+    scored = pipeline.score_messages()
+
+    assert classifier.calls == [message.message_text for message in thread]
+    kept_texts = [message["message_text"] for message in scored]
+    assert "why is the build broken" in kept_texts
+    assert "we need to fix it" in kept_texts
+    assert len({message["thread_sentiment"] for message in scored}) == 1
+
+    with pytest.raises(ValueError):
+        ScoringPipeline({}, mode="paragraph")
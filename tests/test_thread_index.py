@@ -0,0 +1,73 @@
+import json
+
+import pytest
+
+from src.pipeline.message_store import MessageStore
+from src.pipeline.preprocessing import MessageParser
+from src.pipeline.thread_index import ThreadIndex
+
+
+@pytest.fixture
+def messages(make_message):
+    # Listed newest first, as conversations_history returns them
+    return [
+        make_message("late root", "300.000001", channel="C2"),
+        make_message("second reply", "102.000001", "100.000001"),
+        make_message("other root", "200.000001"),
+        make_message("first reply", "101.000001", "100.000001"),
+        make_message("root", "100.000001"),
+    ]
+
+
+def test_threads_are_sorted_by_timestamp(messages):
+    index = ThreadIndex.from_messages(messages)
+
+    assert len(index) == 3
+    thread = index.get("C1", "100.000001")
+    assert [m.message_text for m in thread] == [
+        "root", "first reply", "second reply"]
+    assert ("C2", "300.000001") in index
+    assert index.get("C1", "999.000001") is None
+
+    keys = [key for key, _ in index.threads()]
+    assert keys == [("C2", "300.000001"), ("C1", "100.000001"),
+                    ("C1", "200.000001")]
+    assert list(index.grouped()["C1"]) == ["100.000001", "200.000001"]
+
+
+def test_window_returns_messages_in_range(messages, make_message):
+    index = ThreadIndex.from_messages(messages)
+    # The timeline is only built for the first query
+    assert index._timeline is None
+
+    window = index.window(101, 250)
+    assert list(window) == ["C1"]
+    assert [m.message_text for m in window["C1"]["100.000001"]] == [
+        "first reply", "second reply"]
+    assert [m.message_text for m in window["C1"]["200.000001"]] == [
+        "other root"]
+
+    assert list(index.window(start=250)) == ["C2"]
+    assert index.window(end=100) == {}
+    # Messages added later show up in the next query
+    index.add(make_message("new reply", "301.000001", "300.000001",
+                           channel="C2"))
+    assert len(index.window(start=250)["C2"]["300.000001"]) == 2
+
+
+def test_parser_and_store_group_newest_first_exports(tmp_path, make_record):
+    path = tmp_path / "messages.json"
+    path.write_text(json.dumps([
+        make_record("reply", "101.000001", parent_thread_ts="100.000001",
+                    is_thread_reply=True),
+        make_record("root", "100.000001"),
+    ]))
+
+    parser = MessageParser(str(path))
+    parser.load_messages()
+    thread = parser.group_messages()["C08PH0ZMY7L"]["100.000001"]
+    assert [m.message_text for m in thread] == ["root", "reply"]
+
+    store = MessageStore.from_messages(parser.ungrouped_messages)
+    thread = store.group()["C08PH0ZMY7L"]["100.000001"]
+    assert [m.message_text for m in thread] == ["root", "reply"]
@@ -0,0 +1,83 @@
+"""
+Benchmark the small-talk cascade in front of the zero-shot classifier on a
+labelled sample.
+
+The sample is a JSON list of {"message_text": "...", "keep": true/false}
+records, where keep says whether the message belongs in the report. Every
+message is scored as a single-message thread, once without and once with
+the cascade, and the script reports the cascade hit rate, the end-to-end
+speedup and how well each run agrees with the labels.
+
+Usage (from the repository root):
+    PYTHONPATH=. python tools/benchmark_cascade.py <labelled_sample.json>
+"""
+import json
+import sys
+import time
+from src.pipeline.cascade import SmallTalkFilter
+from src.pipeline.preprocessing import UnscoredMessage
+from src.pipeline.scoring import ScoringPipeline
+
+
+def build_threads(sample):
+    threads = {}
+    for i, record in enumerate(sample):
+        ts = f"{1000000000 + i}.000000"
+        threads[ts] = [UnscoredMessage(record["message_text"], [], "C0",
+                                       "sample", ts, False, ts)]
+    return {"C0": threads}
+
+
+def run(unscored, models, cascade=None):
+    pipeline = ScoringPipeline(unscored, sentiment_analyzer=models[0],
+                               classifier=models[1], cascade=cascade)
+    start = time.perf_counter()
+    scored = pipeline.score_messages()
+    elapsed = time.perf_counter() - start
+    return {message["timestamp"] for message in scored}, elapsed
+
+
+def accuracy(sample, unscored, kept):
+    threads = list(unscored["C0"].values())
+    correct = sum(
+        (thread[0].timestamp in kept) == bool(record["keep"])
+        for record, thread in zip(sample, threads))
+    return correct / len(sample)
+
+
+def main():
+    if len(sys.argv) != 2:
+        print("Usage: python tools/benchmark_cascade.py "
+              "<labelled_sample.json>")
+        sys.exit(1)
+
+    with open(sys.argv[1], "r", encoding="utf-8") as f:
+        sample = json.load(f)
+    unscored = build_threads(sample)
+
+    loader = ScoringPipeline({})
+    loader.load_models()
+    models = (loader.sentiment_analyzer, loader.classifier)
+
+    # Warm up so that neither run pays for first-call overhead
+    run(build_threads(sample[:8]), models)
+
+    baseline_kept, baseline_time = run(unscored, models)
+    cascade = SmallTalkFilter()
+    cascade_kept, cascade_time = run(unscored, models, cascade)
+    stats = cascade.stats()
+
+    false_drops = len(baseline_kept - cascade_kept)
+    print(f"Messages:              {len(sample)}")
+    print(f"Cascade hit rate:      {stats['rejected']}/{stats['checked']} "
+          f"({stats['hit_rate']:.1%}) positive/neutral messages")
+    print(f"Without cascade:       {baseline_time:.2f}s, "
+          f"accuracy {accuracy(sample, unscored, baseline_kept):.1%}")
+    print(f"With cascade:          {cascade_time:.2f}s, "
+          f"accuracy {accuracy(sample, unscored, cascade_kept):.1%}")
+    print(f"Speedup:               {baseline_time / cascade_time:.2f}x")
+    print(f"Kept only w/o cascade: {false_drops}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""
+Benchmark the slack-slash-command Lambda handler against moto.
+
+Cold samples each run in a fresh interpreter and time loading the Lambda
+module plus its first invocation, which is what a new container pays before
+Slack gets its answer. Warm samples reuse one loaded module, as an already
+running container does. Both report p50/p99 handler latency in milliseconds.
+moto has to import boto3 itself, so the cold figures leave out boto3's own
+import time.
+
+moto answers in-process, so the warm samples also add AWS_LATENCY_MS
+(default 20) to every AWS request, roughly a round trip to S3 or SQS from
+Lambda, and report how many requests a repeated command makes.
+
+Usage (from the repository root):
+    PYTHONPATH=. python tools/benchmark_slash_lambda.py [samples]
+"""
+import contextlib
+import importlib.util
+import io
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+LAMBDA = ROOT / "lambdas" / "slack-slash-command" / "lambda_function.py"
+BUCKET = "slack-message-extract"
+EVENT = {"headers": {},
+         "body": "team_id=T1&channel_id=C1&user_id=U1"
+                 "&response_url=https%3A%2F%2Fhooks"}
+
+
+def setup_aws():
+    import boto3
+    from src.shared import orchestration
+
+    os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+    sqs = boto3.client("sqs")
+    boto3.client("s3").create_bucket(Bucket=BUCKET)
+    for stage, (env, _) in orchestration.QUEUE_URLS.items():
+        url = sqs.create_queue(QueueName=f"{stage}-queue")["QueueUrl"]
+        os.environ[env] = url
+
+
+def load_lambda():
+    spec = importlib.util.spec_from_file_location("slash_command_lambda",
+                                                  LAMBDA)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def invoke(handler):
+    start = time.perf_counter()
+    response = handler.lambda_handler(EVENT, None)
+    elapsed = (time.perf_counter() - start) * 1000
+    if response["statusCode"] != 200:
+        raise RuntimeError(f"Handler failed: {response}")
+    return elapsed
+
+
+def cold_sample():
+    start = time.perf_counter()
+    handler = load_lambda()
+    load = (time.perf_counter() - start) * 1000
+    return load + invoke(handler)
+
+
+"""
+Make every request of the handler's AWS clients take latency_ms longer, and
+return the list the number of requests is appended to.
+"""
+
+
+def simulate_latency(handler, latency_ms):
+    requests = [0]
+
+    def before_send(**kwargs):
+        requests[0] += 1
+        time.sleep(latency_ms / 1000)
+
+    for client in handler._clients.values():
+        client.meta.events.register("before-send", before_send)
+    return requests
+
+
+def percentile(samples, p):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, round(p / 100 * (len(ordered) - 1)))
+    return ordered[index]
+
+
+def report(name, samples):
+    print(f"{name}: p50 {percentile(samples, 50):.1f} ms, "
+          f"p99 {percentile(samples, 99):.1f} ms "
+          f"({len(samples)} samples)")
+
+
+def main():
+    from moto import mock_aws
+
+    if len(sys.argv) > 1 and sys.argv[1] == "--cold-sample":
+        with mock_aws():
+            setup_aws()
+            print(cold_sample())
+        return
+
+    samples = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    env = dict(os.environ, PYTHONPATH=str(ROOT))
+    cold = []
+    for _ in range(samples):
+        result = subprocess.run(
+            [sys.executable, __file__, "--cold-sample"], env=env,
+            capture_output=True, text=True, check=True)
+        cold.append(float(result.stdout.strip().splitlines()[-1]))
+
+    with mock_aws():
+        setup_aws()
+        handler = load_lambda()
+        # Keep the handler's own log lines out of the report
+        with contextlib.redirect_stdout(io.StringIO()):
+            invoke(handler)
+            requests = simulate_latency(
+                handler, float(os.environ.get("AWS_LATENCY_MS", "20")))
+            # Later commands join the run the first one started
+            warm = [invoke(handler) for _ in range(samples * 10)]
+
+    report("Cold", cold)
+    report("Warm", warm)
+    print(f"AWS requests per repeated command: "
+          f"{requests[0] / len(warm):.1f}")
+
+
+if __name__ == "__main__":
+    main()